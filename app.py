@@ -1,40 +1,31 @@
 import os
-import pickle
-import tempfile
+import html
 import logging
-import numpy as np
-import onnxruntime as ort
+import threading
 from io import BytesIO, StringIO
 from pathlib import Path
-import matplotlib.pyplot as plt
-from shapely import Polygon
-from shapely.affinity import translate
-from viktor import File, ViktorController, ParamsFromFile
+from viktor import File, ViktorController, ParamsFromFile, UserMessage
 from viktor.errors import UserError, InputViolation
 from viktor.parametrization import (ViktorParametrization, NumberField, Text, FileField, OptionField, OptionListElement, ActionButton,
-                                    GeoPolylineField, GeoPolygonField, GeoPointField)
+                                    DownloadButton, BooleanField, GeoPolylineField, GeoPolygonField, GeoPointField)
+from viktor.result import DownloadResult
 from viktor.geometry import CircularExtrusion, Group, Material, Color, Point, LinearPattern, Line
-from viktor.views import GeometryView, GeometryResult, IFCView, IFCResult, ImageResult, ImageView
+from viktor.views import (GeometryView, GeometryResult, IFCView, IFCResult, ImageResult, ImageView,
+                          MapView, MapResult, MapPolygon, MapPoint, WebView, WebResult)
 from viktor.core import Storage
 
-from src.generate_ifc import generate_ifc
-from src.dxf_reader import extract_red_lines, get_heights_data
-from src.ifc_plan_extracting import get_building_polygon
-from src.normalization import scaling_object, normalize_vector
-from src.polygon_placing import place_polygon, add_holes
-from src.picture_processing import vec_to_features
+from src.pipeline import KNN_VARIANTS, building_footprint, ifc_archive
+from src.polygon_placing import CLEARANCE_ALTERNATIVES
+from src.jobs import JOB_VIEW_WAIT, get_job_queue, generate_variant
+from src.resources import warm_up
+from src.tracing import recent_spans
 
-onnx_model_path = Path(__file__).parent / 'models/resnet50.onnx'
-session = ort.InferenceSession(onnx_model_path)
-logging.basicConfig(level=logging.DEBUG)
+# ONNX Runtime, ezdxf, ifcopenshell, triangle and matplotlib are imported by the views that need them,
+# the models are loaded on first use (or in the background when WARM_UP_MODELS=1)
+logging.basicConfig(level=logging.INFO)
 
-kd_vectors_path = Path(__file__).parent / 'models/kd_vectors.pkl'
-with open(kd_vectors_path, 'rb') as file:
-    tree = pickle.load(file)
-
-xy_coords_path = Path(__file__).parent / 'models/xy_coords.pkl'
-with open(xy_coords_path, 'rb') as file:
-    xy_coords = pickle.load(file)
+if os.environ.get('WARM_UP_MODELS') == '1':
+    threading.Thread(target=warm_up, daemon=True).start()
 
 files_dict = {
     "Модель 85.4_0_КР_R19": ('Границы участка 85.4_0_КР_R19.dxf', 
@@ -47,12 +38,6 @@ files_dict = {
                              'Подоснова МКСП_ВЕР12Б_К10_КР_П_R21_ДСШ.dxf')
 }
 
-building_var_dict = {
-    'Вариант_1': None,
-    'Вариант_2': None,
-    'Вариант_3': None,
-}
-
 IFC_MODEL_OPTIONS = [
     OptionListElement(label="85.4_0_КР_R19.ifc", value='85.4_0_КР_R19.ifc'),
     OptionListElement(label="К01_КР_П_R20.ifc", value='К01_КР_П_R20.ifc'),
@@ -72,11 +57,78 @@ BOUND_DXF = [
 ]
 
 BUILDING_VAR_OPTIONS = [
-    OptionListElement(label="Вариант_1", value='Вариант_1'),
-    OptionListElement(label="Вариант_2", value='Вариант_2'),
-    OptionListElement(label="Вариант_3", value='Вариант_3'),
+    OptionListElement(label=f"Вариант_{i + 1}", value=f'Вариант_{i + 1}') for i in range(KNN_VARIANTS)
+]
+
+PLACEMENT_MODE_OPTIONS = [
+    OptionListElement(label="First fit (Первое подходящее)", value='first'),
+    OptionListElement(label="Max clearance (Максимальный отступ от границ)", value='clearance'),
 ]
 
+# Rows shown by the pipeline trace view
+TRACE_VIEW_ROWS = 200
+
+
+def input_paths(params):
+    model_path = Path(__file__).parent / 'data/ifc' / params["input_ifc_file"]
+    bound_file_path = Path(__file__).parent / 'data/bound_dxf' / files_dict[params["bound_file"]][0]
+    elevation_baseline_file_path = Path(__file__).parent / 'data/height_dxf' / files_dict[params["bound_file"]][1]
+    return model_path, bound_file_path, elevation_baseline_file_path
+
+
+def generation_job(params):
+    # Identical requests share one job of the local queue, the views only wait for its artifacts
+    model_path, bound_file_path, elevation_baseline_file_path = input_paths(params)
+    inputs = {
+        'bound_file_path': bound_file_path,
+        'elevation_baseline_file_path': elevation_baseline_file_path,
+        'model_path': model_path,
+        'building_area': float(params.building_area),
+        'placement_mode': params.placement_mode,
+        'variant': [option.value for option in BUILDING_VAR_OPTIONS].index(params.building_var),
+        'num_floors': int(params.building_floors),
+        'elevation_height': float(params.elevation_height),
+        'avoid_obstacles': bool(params.avoid_obstacles),
+        'buildings': int(params.building_count or 1),
+        'option': int(params.placement_option or 1),
+    }
+    return get_job_queue().submit('generate', inputs, generate_variant)
+
+
+def job_artifact(params, artifact: str, timeout: float = JOB_VIEW_WAIT):
+    # A slow generation keeps running in the background, the view reports how far it got and is updated later
+    job = generation_job(params)
+    job.wait(timeout, artifact)
+    if artifact in job.artifacts:
+        if job.artifacts.get('warning'):
+            UserMessage.warning(job.artifacts['warning'])
+        return job.artifacts[artifact]
+    if job.status == 'failed':
+        raise UserError(job.error)
+    raise UserError(f'Still generating, press Update in a few seconds '
+                    f'(Генерация продолжается, обновите вид через несколько секунд): {job.progress()}')
+
+
+def trace_table(spans: list) -> str:
+    columns = ['id', 'parent', 'stage', 'wall_s', 'cpu_s', 'peak_rss_delta', 'cache', 'thread']
+    extra = lambda span: ', '.join(f'{key}={value}' for key, value in span.items() if key not in columns)
+    cell = lambda value: f'{value:.4f}' if isinstance(value, float) else ('' if value is None else str(value))
+
+    rows = ''.join('<tr>' + ''.join(f'<td>{html.escape(cell(span.get(column)))}</td>' for column in columns)
+                   + f'<td>{html.escape(extra(span))}</td></tr>' for span in spans)
+    header = ''.join(f'<th>{column}</th>' for column in columns + ['sizes'])
+    return f'<table border="1" cellspacing="0" cellpadding="3"><tr>{header}</tr>{rows}</table>'
+
+
+def job_table(jobs: list) -> str:
+    columns = ['id', 'kind', 'status', 'stage', 'seconds', 'artifacts', 'error']
+    cell = lambda value: f'{value:.1f}' if isinstance(value, float) else ('' if value is None else str(value))
+
+    rows = ''.join('<tr>' + ''.join(f'<td>{html.escape(cell(job.get(column)))}</td>' for column in columns)
+                   + '</tr>' for job in jobs)
+    header = ''.join(f'<th>{column}</th>' for column in columns)
+    return f'<table border="1" cellspacing="0" cellpadding="3"><tr>{header}</tr>{rows}</table>'
+
 
 class Parametrization(ViktorParametrization):
     text_building = Text('## Input data (Введите данные)')
@@ -89,7 +141,17 @@ class Parametrization(ViktorParametrization):
                     description="Выберите из выпадающего списка необходимую модель здания", flex=80)
     building_var = OptionField("Select building variant (Выберите вариацию здания)", options=BUILDING_VAR_OPTIONS, default=BUILDING_VAR_OPTIONS[0].value,
                     description="Выберите из выпадающего списка необходимую модель здания", flex=80)
+    placement_mode = OptionField("Placement mode (Режим размещения)", options=PLACEMENT_MODE_OPTIONS, default=PLACEMENT_MODE_OPTIONS[0].value,
+                    description="Первое найденное положение или положение с максимальным отступом от красных линий", flex=80)
+    placement_option = NumberField('Placement option (Вариант размещения)', min=1, max=CLEARANCE_ALTERNATIVES, default=1,
+                    description="Одно из положений здания, упорядоченных по отступу от границ (1 - лучшее), только для режима с максимальным отступом", flex=80)
+    building_count = NumberField('Number of buildings (Кол-во зданий)', min=1, default=1,
+                    description="Несколько копий выбранной вариации на участке, с отступами от красных линий и друг от друга", flex=80)
+    avoid_obstacles = BooleanField("Avoid existing structures (Обходить существующие постройки)", default=False,
+                    description="Здания, навесы, ограды и другие объекты подосновы с отступом от них", flex=80)
     
+    download_ifc = DownloadButton('Download IFC (Скачать IFC), ifcZIP', method='download_ifc', longpoll=True, flex=80)
+
     red_line_polygon = GeoPolygonField('Add red lines to the map (Укажите границы участка на карте)', flex=80)
 
 
@@ -104,121 +166,29 @@ class Controller(ViktorController):
             if not params.bound_file:
                 raise UserError('Please upload the boundaries DWG file (Загрузите границы участка).')
 
-            model_path = Path(__file__).parent / 'data/ifc' / params["input_ifc_file"]
-            bound_file_path = Path(__file__).parent / 'data/bound_dxf' / files_dict[params["bound_file"]][0]
-            elevation_baseline_file_path = Path(__file__).parent / 'data/height_dxf' / files_dict[params["bound_file"]][1]
-            
-            # Extracting the building polygon from the loaded IFC model
-            building_polygon = get_building_polygon(model_path)
-            
-            # Extracting the boundaries of the site
-            red_line_data = extract_red_lines(bound_file_path)
-            
-            # Extracting the internal bounding polygons, if there are any.
-            test_holes = add_holes(red_line_data)
-            
-            if test_holes[0] == 0:
-                print('No lines found')
-                raise UserError('No bounds found (Не смог найти границы участка в файле).')
-
-            elif test_holes[0] == 1:
-                interm_polygon = test_holes[1]
-                main_area_coords = list(interm_polygon.exterior.coords)
-
-            elif test_holes[0] == 2:
-                main_area_coords = list(test_holes[1][0].exterior.coords)
-                holes_coords = []
-
-                for entity in test_holes[2]:
-                    holes_coords.append(list(entity[0].exterior.coords))
-                    interm_polygon = Polygon(shell=main_area_coords, holes=holes_coords)
-                    
-            heights = get_heights_data(elevation_baseline_file_path)
-            
-            area_coords_x = np.array(main_area_coords)[:, 0]
-            area_coords_y = np.array(main_area_coords)[:, 1]
-            
-            moved_area_coords_x, moved_area_coords_y = normalize_vector(area_coords_x)[0], normalize_vector(area_coords_y)[0]
-            area_delta_x, area_delta_y = normalize_vector(area_coords_x)[1], normalize_vector(area_coords_y)[1]
-            
-            heights_coords_x = np.array(heights['coords'])[:, 0] + area_delta_x
-            heights_coords_y = np.array(heights['coords'])[:, 1] + area_delta_y
-            
-            area_polygon_custom = translate(interm_polygon, area_delta_x, area_delta_y)
-            if test_holes[0] == 2:
-                x_holes = None
-                y_holes = None
-
-                for hole in area_polygon_custom.interiors:
-                    hole_x, hole_y = hole.xy
-                    x_holes = list(hole_x)
-                    y_holes = list(hole_y)
-            
-            temp_pic_path = str(Path(__file__).parent)
-            
-            building_polygon_feature = vec_to_features(temp_pic_path, vector=building_polygon, onnx_session=session)
-            
-            k_nearest_indices = tree.query(building_polygon_feature, k=3)[1]
-            
-            for idx, key in enumerate(building_var_dict):
-                building_var_dict[key] = k_nearest_indices[idx]
-                
-            
-            object_x = xy_coords[building_var_dict[params.building_var]][1].tolist()
-            object_y = xy_coords[building_var_dict[params.building_var]][0].tolist()
-            
-            
-            scaled_object = scaling_object(object_x, object_y, target_area=params["building_area"])[0]
-            
-            solution_found, coords_x, coords_y = place_polygon(area_polygon=area_polygon_custom, object_polygon=scaled_object)
-            if not solution_found:
-                raise UserError("Can't place model (Не могу разместить здание, введите другие параметры, возможно стоит уменьшить площадь здания)")
-
-            ground_coordinates = np.array(list(zip(heights_coords_x, heights_coords_y, heights['heights']))).reshape(-1, 3).tolist()
-            raw_wall_arr = np.array(list(zip(coords_x, coords_y)))
-
-            # Array conversion
-            full_wall_arr = np.array([raw_wall_arr[i-1:i+1] for i in range(1, len(raw_wall_arr))])
-            wall_coordinates = np.append(full_wall_arr, [[raw_wall_arr[-1], raw_wall_arr[0]]], axis=0).tolist()
-            # IFC model generation
-            ifc_model = generate_ifc(   ground_coordinates=ground_coordinates, 
-                                        wall_coordinates=wall_coordinates,
-                                        num_floors=params.building_floors, 
-                                        elevation_height=params.elevation_height
-                                    )
-            # Determining the path to save the IFC file
-            ifc_file_path = Path(__file__).parent / 'generated_model.ifc'
-            
-            # Saving a model to a file
-            ifc_model.write(str(ifc_file_path))
-            
-            # Uploading a model to create a File object
-            ifc_file = File.from_path(ifc_file_path)
-            
-            # Plan photo saving
-            figure_path = Path(__file__).parent / 'figure.png'
-            
-            plt.figure()
-            plt.plot(coords_x, coords_y , linestyle='-', color='b')
-            plt.plot(moved_area_coords_x, moved_area_coords_y, linestyle='-', marker='o')
-            if test_holes[0] == 2:
-                plt.plot(x_holes, y_holes, linestyle='-', color='r')
-            plt.xlabel('X')
-            plt.ylabel('Y')
-            plt.grid(True)
-            plt.gca().set_aspect('equal')
-            plt.savefig(figure_path)
+            # The model is served from the job store, concurrent requests never share a file
+            ifc_file = File.from_data(job_artifact(params, 'ifc'))
         except Exception as e:
             raise UserError(e)
         return IFCResult(ifc_file)
 
     @ImageView("Generated Plan view", duration_guess=3, update_label='Update')
     def createPlot(self, params, **kwargs):
-        self.get_ifc_view(self, params, **kwargs)
-        
-        figure_path_1 = Path(__file__).parent / 'figure.png'
+        try:
+            # The plan is ready as soon as the placement is found, before the IFC
+            plan = job_artifact(params, 'plan')
+        except Exception as e:
+            raise UserError(e)
         
-        return ImageResult.from_path(figure_path_1)
+        return ImageResult(BytesIO(plan))
+
+    def download_ifc(self, params, **kwargs):
+        try:
+            # Download requests are long-polled, so they wait for the job to finish
+            ifc_zip = ifc_archive(job_artifact(params, 'ifc', timeout=None))
+        except Exception as e:
+            raise UserError(e)
+        return DownloadResult(file_content=ifc_zip, file_name='generated_model.ifczip')
     
     
     @IFCView('Input IFC model', duration_guess=3)
@@ -240,9 +210,17 @@ class Controller(ViktorController):
             model_path = Path(__file__).parent / 'data/ifc' / params["input_ifc_file"]
             
             # Extracting the building polygon from the loaded IFC model
-            building_polygon = get_building_polygon(model_path)
+            building_polygon = building_footprint(model_path)
             building_zone = MapPolygon([MapPoint(x, y) for x, y in building_polygon])
             
             features.append(building_zone)
         
-        return MapResult(features)
\ No newline at end of file
+        return MapResult(features)
+
+    @WebView('Pipeline trace', duration_guess=1)
+    def get_trace_view(self, params, **kwargs):
+        # Generation jobs and the last finished stages of this worker, newest first
+        jobs = [job.snapshot() for job in get_job_queue().jobs()][::-1]
+        return WebResult(html=f'<html><body style="font-family: monospace; font-size: 12px">'
+                              f'<h3>Jobs</h3>{job_table(jobs)}'
+                              f'<h3>Stages</h3>{trace_table(recent_spans(TRACE_VIEW_ROWS)[::-1])}</body></html>')
\ No newline at end of file
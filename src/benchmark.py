@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tracemalloc
+from pathlib import Path
+from datetime import datetime, timezone
+
+
+DATA_DIR = Path(__file__).parent.parent / 'data'
+BOUND_PREFIX = 'Границы участка '
+HEIGHT_PREFIX = 'Подоснова '
+
+# Footprint area of the placement cases as a share of the site area
+PLACEMENT_HIT_SHARE = 0.1
+PLACEMENT_MISS_SHARE = 0.9
+FLOOR_COUNTS = (3, 10, 30)
+
+
+def site_pairs() -> list:
+    # (name, boundary dxf, survey dxf) for every site that has both files
+    pairs = []
+    for bound_path in sorted((DATA_DIR / 'bound_dxf').glob('*.dxf')):
+        name = bound_path.name[len(BOUND_PREFIX):]
+        height_path = DATA_DIR / 'height_dxf' / f'{HEIGHT_PREFIX}{name}'
+        if height_path.exists():
+            pairs.append((Path(name).stem, bound_path, height_path))
+    return pairs
+
+
+def measure(func, repeat: int, reset=None, memory: bool = True) -> tuple:
+    # Cold timings: reset() drops every cache before each run. Peak memory comes from one extra traced run,
+    # tracemalloc slows the code down too much to time it at the same time.
+    wall_times, cpu_times = [], []
+    result = None
+    for _ in range(repeat):
+        if reset:
+            reset()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = func()
+        wall_times.append(time.perf_counter() - wall_start)
+        cpu_times.append(time.process_time() - cpu_start)
+
+    measurement = {
+        'repeat': repeat,
+        'wall_min': min(wall_times),
+        'wall_median': statistics.median(wall_times),
+        'wall_mean': statistics.fmean(wall_times),
+        'cpu_median': statistics.median(cpu_times),
+    }
+    if memory:
+        if reset:
+            reset()
+        tracemalloc.start()
+        try:
+            func()
+            measurement['peak_python_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return measurement, result
+
+
+class Benchmark:
+
+    def __init__(self, repeat: int, floors=FLOOR_COUNTS, memory: bool = True, stages=None):
+        self.repeat = repeat
+        self.floors = floors
+        self.memory = memory
+        self.stages = stages
+        self.results = []
+
+    def run(self, stage: str, case: str, func, reset=None, repeat: int = None, **info):
+        if self.stages and stage not in self.stages:
+            return None
+        try:
+            measurement, result = measure(func, repeat or self.repeat, reset, self.memory)
+        except Exception as e:
+            self.skip(stage, case, f'{type(e).__name__}: {e}')
+            return None
+        measurement.update({'stage': stage, 'case': case, **info})
+        self.results.append(measurement)
+        print(f"{stage:<22} {case:<45} {measurement['wall_median'] * 1000:10.1f} ms", file=sys.stderr)
+        return result
+
+    def skip(self, stage: str, case: str, reason: str):
+        if self.stages and stage not in self.stages:
+            return
+        self.results.append({'stage': stage, 'case': case, 'skipped': reason})
+        print(f'{stage:<22} {case:<45} skipped: {reason}', file=sys.stderr)
+
+
+def reset_caches():
+    from src.stage_cache import stage_cache
+
+    stage_cache.clear()
+
+
+def run_benchmarks(bench: Benchmark):
+    from src import pipeline
+    from src.dxf_reader import extract_red_lines, get_heights_data
+    from src.generate_ifc import generate_ifc
+    from src.ifc_plan_extracting import get_building_polygon
+    from src.normalization import scaling_object
+    from src.picture_processing import footprint_tensor, vec_to_features
+    from src.polygon_placing import place_polygon
+    from src.resources import ONNX_MODEL_PATH, XY_COORDS_PATH, VECTOR_INDEX_PATH, KD_VECTORS_PATH
+
+    for bound_path in sorted((DATA_DIR / 'bound_dxf').glob('*.dxf')):
+        bench.run('extract_red_lines', bound_path.stem, lambda: extract_red_lines(bound_path), reset_caches)
+    for height_path in sorted((DATA_DIR / 'height_dxf').glob('*.dxf')):
+        bench.run('get_heights_data', height_path.stem, lambda: get_heights_data(height_path), reset_caches)
+
+    footprints = {}
+    for model_path in sorted((DATA_DIR / 'ifc').glob('*.ifc')):
+        footprints[model_path] = bench.run('get_building_polygon', model_path.stem,
+                                           lambda: get_building_polygon(model_path), reset_caches)
+
+    has_model = ONNX_MODEL_PATH.exists()
+    has_index = (VECTOR_INDEX_PATH / 'meta.json').exists() or KD_VECTORS_PATH.exists()
+    embeddings = {}
+    for model_path, footprint in footprints.items():
+        if footprint is None:
+            continue
+        bench.run('footprint_tensor', model_path.stem, lambda: footprint_tensor(footprint))
+        if has_model:
+            session = pipeline.get_onnx_session()
+            embeddings[model_path] = bench.run('vec_to_features', model_path.stem,
+                                               lambda: vec_to_features(footprint, session))
+        else:
+            bench.skip('vec_to_features', model_path.stem, f'no ONNX model at {ONNX_MODEL_PATH}')
+
+    for model_path, embedding in embeddings.items():
+        if has_index and embedding is not None:
+            index = pipeline.get_vector_index()
+            bench.run('knn_query', model_path.stem, lambda: index.query(embedding, k=pipeline.KNN_VARIANTS))
+        else:
+            bench.skip('knn_query', model_path.stem, f'no vector index at {VECTOR_INDEX_PATH}')
+    if not embeddings:
+        bench.skip('knn_query', '-', 'no query embeddings')
+
+    # Placement of the first catalog footprint, scaled to a small (found early) and a too large (full search) area
+    catalog_entry = None
+    if XY_COORDS_PATH.exists():
+        with open(XY_COORDS_PATH, 'rb') as file:
+            catalog_entry = next(iter(pickle.load(file).values()))
+
+    for name, bound_path, height_path in site_pairs():
+        site = pipeline.load_site(bound_path)
+        area_polygon = site['area_polygon']
+
+        if catalog_entry is not None:
+            for case, share in (('hit', PLACEMENT_HIT_SHARE), ('miss', PLACEMENT_MISS_SHARE)):
+                object_ring = scaling_object(catalog_entry[1], catalog_entry[0], area_polygon.area * share)[0]
+                result = bench.run('place_polygon', f'{name} {case}', lambda: place_polygon(area_polygon, object_ring))
+                if result is not None:
+                    bench.results[-1]['found'] = bool(result[0])
+        else:
+            bench.skip('place_polygon', name, f'no footprint catalog at {XY_COORDS_PATH}')
+
+        # A rectangle of a fifth of the site, in the middle of it
+        center = area_polygon.representative_point()
+        side = (area_polygon.area / 5) ** 0.5 / 2
+        outline_x = [center.x - side, center.x + side, center.x + side, center.x - side]
+        outline_y = [center.y - side, center.y - side, center.y + side, center.y + side]
+        walls = pipeline.wall_coordinates(outline_x, outline_y)
+        terrain = pipeline.site_terrain(bound_path, height_path)
+
+        for floors in bench.floors:
+            model = bench.run('generate_ifc', f'{name} {floors} floors',
+                              lambda: generate_ifc(terrain['vertices'].tolist(), walls, num_floors=floors,
+                                                   ground_triangles=terrain['triangles']))
+            if model is not None:
+                bench.results[-1].update({'entities': len(list(model)), 'bytes': len(model.to_string())})
+
+        for model_path in footprints:
+            if has_model and has_index:
+                def end_to_end():
+                    placements = pipeline.place_building_variants(bound_path, model_path, area_polygon.area * PLACEMENT_HIT_SHARE)
+                    found = [placement for placement in placements if placement['found']]
+                    if found:
+                        pipeline.building_ifc(bound_path, height_path, model_path, found[0], num_floors=3, elevation_height=3.0)
+                    return placements
+
+                bench.run('end_to_end', f'{name} {model_path.stem}', end_to_end, reset_caches)
+            else:
+                bench.skip('end_to_end', f'{name} {model_path.stem}', 'needs the ONNX model and the vector index')
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).parent, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list, baseline_path):
+    # Median wall time against a previous report, > 1 means slower now
+    with open(baseline_path) as file:
+        baseline = {(item['stage'], item['case']): item for item in json.load(file)['results'] if 'skipped' not in item}
+
+    # Printed to stderr like the progress lines, stdout may carry the JSON report
+    print(f"{'stage':<22} {'case':<45} {'before ms':>10} {'after ms':>10} {'ratio':>7}", file=sys.stderr)
+    for item in results:
+        before = baseline.get((item['stage'], item['case']))
+        if before is None or 'skipped' in item:
+            continue
+        ratio = item['wall_median'] / before['wall_median'] if before['wall_median'] else float('nan')
+        print(f"{item['stage']:<22} {item['case']:<45} {before['wall_median'] * 1000:10.1f} "
+              f"{item['wall_median'] * 1000:10.1f} {ratio:7.2f}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every pipeline stage on the bundled sites and models')
+    parser.add_argument('--output', '-o', default=None, help='JSON report path, stdout by default')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case')
+    parser.add_argument('--floors', default=','.join(map(str, FLOOR_COUNTS)), help='floor counts for generate_ifc')
+    parser.add_argument('--stages', default=None, help='comma separated stages to run, all by default')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced run that records peak memory')
+    parser.add_argument('--warm', action='store_true', help='keep the disk caches, times cached loads instead of parsing')
+    parser.add_argument('--compare', default=None, metavar='REPORT', help='print the change against an earlier report to stderr')
+    args = parser.parse_args()
+
+    # Cold runs parse every file, the disk tiers are switched off before the modules read the setting
+    if not args.warm:
+        os.environ['STAGE_CACHE_DISK'] = '0'
+
+    bench = Benchmark(repeat=args.repeat, floors=tuple(int(value) for value in args.floors.split(',')),
+                      memory=not args.no_memory, stages=set(args.stages.split(',')) if args.stages else None)
+    start = time.perf_counter()
+    run_benchmarks(bench)
+
+    report = {
+        'revision': git_revision(),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'warm': args.warm,
+        'total_seconds': time.perf_counter() - start,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'results': bench.results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+    else:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+
+    if args.compare:
+        compare(bench.results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
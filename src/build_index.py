@@ -0,0 +1,153 @@
+import os
+import pickle
+import argparse
+import tempfile
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from src.picture_processing import footprint_tensor, run_onnx
+from src.resources import create_onnx_session
+from src.vector_index import VectorIndex, footprint_area
+
+
+MODELS_DIR = Path(__file__).parent.parent / 'models'
+
+# ONNX session of the current process (main process or pool worker)
+_session = None
+
+
+def _init_session(onnx_model_path, intra_op_threads: int = 0):
+    global _session
+    _session = create_onnx_session(onnx_model_path, intra_op_threads=intra_op_threads)
+
+
+def footprint_vector(entry) -> list:
+    # Catalog entries keep Y first and X second, the same way app.py reads them
+    return list(zip(entry[1], entry[0]))
+
+
+def embed_batch(entries: list) -> np.ndarray:
+    images = np.concatenate([footprint_tensor(footprint_vector(entry)) for entry in entries])
+
+    # Models exported with a fixed batch dimension are fed in chunks of that size
+    batch_dim = _session.get_inputs()[0].shape[0]
+    step = batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else len(images)
+
+    features = [np.asarray(run_onnx(images[i:i + step], _session)[0]).reshape(len(images[i:i + step]), -1)
+                for i in range(0, len(images), step)]
+    return np.concatenate(features).astype(np.float32)
+
+
+def embed_catalog(entries: list, onnx_model_path, batch_size: int = 32, workers: int = None) -> np.ndarray:
+    batches = [entries[i:i + batch_size] for i in range(0, len(entries), batch_size)]
+    if not batches:
+        return np.empty((0, 0), dtype=np.float32)
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(batches) == 1:
+        _init_session(onnx_model_path)
+        return np.concatenate([embed_batch(batch) for batch in batches])
+
+    # Each worker owns a session with a share of the cores instead of oversubscribing them
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_session, initargs=(onnx_model_path, threads)) as executor:
+        return np.concatenate(list(executor.map(embed_batch, batches)))
+
+
+def atomic_pickle(obj, path: Path):
+    # Readers see either the old or the new file, never a partially written one
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'.{path.name}.', delete=False) as file:
+        pickle.dump(obj, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(file.name, path)
+
+
+def build_index(input_path, out_dir=MODELS_DIR, onnx_model_path=None, append: bool = False,
+                batch_size: int = 32, workers: int = None, dtype=np.float32, ivf_lists: int = None):
+    out_dir = Path(out_dir)
+    onnx_model_path = onnx_model_path or out_dir / 'resnet50.onnx'
+    index_path = out_dir / 'footprint_index'
+    xy_coords_path = out_dir / 'xy_coords.pkl'
+
+    with open(input_path, 'rb') as file:
+        new_coords = pickle.load(file)
+
+    catalog = {}
+    index = None
+    if append:
+        with open(xy_coords_path, 'rb') as file:
+            catalog = pickle.load(file)
+        index = VectorIndex.open(index_path)
+        if len(index) != len(catalog):
+            raise ValueError(f'Index has {len(index)} vectors but the catalog has {len(catalog)} footprints')
+
+    # Catalog keys are the row numbers of the index
+    entries = list(new_coords.values())
+    new_vectors = embed_catalog(entries, onnx_model_path, batch_size=batch_size, workers=workers)
+    new_areas = np.array([footprint_area(entry) for entry in entries])
+    for entry in entries:
+        catalog[len(catalog)] = entry
+
+    if index is None or len(index) == 0:
+        index = VectorIndex.from_vectors(new_vectors, {'area': new_areas}, dtype=dtype)
+    else:
+        index = index.append(new_vectors, {'area': new_areas})
+
+    if ivf_lists:
+        index.build_ivf(ivf_lists)
+
+    index.save(index_path)
+    atomic_pickle(catalog, xy_coords_path)
+
+    return index
+
+
+def convert_kdtree(out_dir=MODELS_DIR, dtype=np.float32):
+    # One-off migration of kd_vectors.pkl to the memory-mapped index
+    out_dir = Path(out_dir)
+    with open(out_dir / 'xy_coords.pkl', 'rb') as file:
+        catalog = pickle.load(file)
+
+    index = VectorIndex.from_kdtree(out_dir / 'kd_vectors.pkl', catalog)
+    index = VectorIndex.from_vectors(index.vectors, index.metadata, dtype=dtype)
+    index.save(out_dir / 'footprint_index')
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Embed building footprints and build the k-NN index')
+    parser.add_argument('input', nargs='?', help='pickle with footprints in the xy_coords.pkl format')
+    parser.add_argument('--out-dir', default=str(MODELS_DIR), help='directory with footprint_index/ and xy_coords.pkl')
+    parser.add_argument('--model', default=None, help='ONNX model, resnet50.onnx from the output directory by default')
+    parser.add_argument('--append', action='store_true', help='embed only the new footprints and add them to the index')
+    parser.add_argument('--from-kdtree', action='store_true', help='convert the pickled kd_vectors.pkl instead of embedding')
+    parser.add_argument('--float16', action='store_true', help='store vectors as float16')
+    parser.add_argument('--ivf', type=int, default=None, metavar='NLIST', help='build an IVF layer with NLIST lists')
+    parser.add_argument('--nprobe', type=int, default=8, help='lists probed when reporting the IVF recall')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    dtype = np.float16 if args.float16 else np.float32
+    if args.from_kdtree:
+        index = convert_kdtree(out_dir=args.out_dir, dtype=dtype)
+        if args.ivf:
+            index.build_ivf(args.ivf)
+            index.save(Path(args.out_dir) / 'footprint_index')
+    elif args.input:
+        index = build_index(args.input, out_dir=args.out_dir, onnx_model_path=args.model, append=args.append,
+                            batch_size=args.batch_size, workers=args.workers, dtype=dtype, ivf_lists=args.ivf)
+    else:
+        parser.error('input is required unless --from-kdtree is given')
+
+    print(f'Index size {len(index)}, dimension {index.vectors.shape[1]}, {index.vectors.dtype}')
+    if index.has_ivf:
+        sample = np.random.default_rng(0).choice(len(index), size=min(len(index), 200), replace=False)
+        queries = np.asarray(index.vectors[np.sort(sample)], dtype=np.float32)
+        print(f'IVF recall@3 with nprobe={args.nprobe}: {index.recall(queries, k=3, nprobe=args.nprobe):.3f}')
+
+
+if __name__ == '__main__':
+    main()
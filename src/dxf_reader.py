@@ -1,90 +1,205 @@
+import os
 import re
+import shutil
+import logging
+import tempfile
 import numpy as np
 import ezdxf
+from pathlib import Path
 from typing import List, Dict
+from scipy.spatial import cKDTree
 
+from src.stage_cache import CACHE_DIR, DISK_ENABLED, file_digest
+from src.tracing import traced, annotate
+
+
+# Pattern for finding heights among text
+HEIGHT_PATTERN = r"^\d+\.\d+$"
+# Largest offset of a height label from its survey marker
+HEIGHT_MARKER_TOLERANCE = 14e-1
+
+# Entity types the pipeline reads, everything else in the modelspace is skipped while parsing
+ENTITY_TYPES = ('LWPOLYLINE', 'TEXT', 'INSERT', 'LINE')
+# Parsed columns are kept under CACHE_DIR/dxf/<version>-<file sha256>/, bump the version when the layout changes
+COLUMNS_VERSION = 2
+COLUMNS_DIR = CACHE_DIR / 'dxf'
+
+logger = logging.getLogger(__name__)
+
+
+def iter_entities(dxf_file, types=ENTITY_TYPES):
+    # Streams the modelspace entity by entity, so only one entity of a large file is in memory at a time.
+    # Files iterdxf cannot seek through (binary DXF, broken section layout) are loaded as a whole document.
+    from ezdxf.addons import iterdxf
+
+    try:
+        yield from iterdxf.modelspace(str(dxf_file), types=types)
+    except ezdxf.DXFStructureError:
+        doc = ezdxf.readfile(dxf_file)
+        yield from doc.modelspace().query(' '.join(types))
+
+
+@traced('dxf.parse')
+def parse_columns(dxf_file) -> Dict[str, np.ndarray]:
+    polyline_handles, polyline_layers, polyline_linetypes = [], [], []
+    polyline_colors, polyline_lineweights, polyline_closed, polyline_sizes, polyline_points = [], [], [], [], []
+    text_values, text_inserts = [], []
+    insert_inserts = []
+    line_layers, line_colors, line_starts, line_ends = [], [], [], []
+
+    for entity in iter_entities(dxf_file):
+        dxftype = entity.dxftype()
+        if dxftype == 'LWPOLYLINE':
+            points = entity.get_points()
+            polyline_handles.append(entity.dxf.handle)
+            polyline_layers.append(entity.dxf.layer)
+            polyline_linetypes.append(entity.dxf.linetype)
+            polyline_colors.append(entity.dxf.color)
+            polyline_lineweights.append(entity.dxf.lineweight)
+            polyline_closed.append(entity.closed)
+            polyline_sizes.append(len(points))
+            polyline_points.extend(points)
+        elif dxftype == 'TEXT':
+            text_values.append(entity.dxf.text)
+            text_inserts.append(tuple(entity.dxf.insert))
+        elif dxftype == 'INSERT':
+            insert_inserts.append(tuple(entity.dxf.insert))
+        elif dxftype == 'LINE':
+            line_layers.append(entity.dxf.layer)
+            line_colors.append(entity.dxf.color)
+            line_starts.append(tuple(entity.dxf.start))
+            line_ends.append(tuple(entity.dxf.end))
+
+    annotate(file=Path(dxf_file).name, lwpolylines=len(polyline_sizes), texts=len(text_values),
+             inserts=len(insert_inserts), lines=len(line_starts))
+
+    def strings(values):
+        return np.array(values, dtype=str)
+
+    def points(values, width):
+        return np.array(values, dtype=np.float64).reshape(-1, width)
+
+    # Points of all polylines are stored in one (x, y, start_width, end_width, bulge) array,
+    # polyline i owns the rows offsets[i]:offsets[i + 1]
+    return {
+        'lwpolyline_handle': strings(polyline_handles),
+        'lwpolyline_layer': strings(polyline_layers),
+        'lwpolyline_linetype': strings(polyline_linetypes),
+        'lwpolyline_color': np.array(polyline_colors, dtype=np.int32),
+        'lwpolyline_lineweight': np.array(polyline_lineweights, dtype=np.int32),
+        'lwpolyline_closed': np.array(polyline_closed, dtype=bool),
+        'lwpolyline_offsets': np.concatenate([[0], np.cumsum(polyline_sizes, dtype=np.int64)]),
+        'lwpolyline_points': points(polyline_points, 5),
+        'text_value': strings(text_values),
+        'text_insert': points(text_inserts, 3),
+        'insert_insert': points(insert_inserts, 3),
+        'line_layer': strings(line_layers),
+        'line_color': np.array(line_colors, dtype=np.int32),
+        'line_start': points(line_starts, 3),
+        'line_end': points(line_ends, 3),
+    }
+
+
+def _save_columns(columns: Dict[str, np.ndarray], path: Path):
+    # Columns are written next to the final directory and moved in with one rename
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(tempfile.mkdtemp(dir=path.parent, prefix=f'.{path.name}.'))
+    try:
+        for name, values in columns.items():
+            np.save(tmp_path / f'{name}.npy', values)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another process has written the same file in the meantime
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not path.exists():
+            raise
 
-def extract_red_lines(dxf_file) -> List:
 
-    doc = ezdxf.readfile(dxf_file)
-    msp = doc.modelspace()
-    lwpolyline_data = []  
-    # Iterate over all entities in the model space
-    for entity in msp:
-        # Checking if the entity is LWPOLYLINE and if it is red
-        if entity.dxftype() == 'LWPOLYLINE' and entity.dxf.color == 1:
-            # Extracting data
-            lwpolyline_info = {
-                'handle': entity.dxf.handle,
-                'layer': entity.dxf.layer,
-                'points': entity.get_points(),
-                'linetype': entity.dxf.linetype,
-                'color': entity.dxf.color,
-                'lineweight': entity.dxf.lineweight
-            }
-            lwpolyline_data.append(lwpolyline_info)
+def load_columns(dxf_file, cache: bool = DISK_ENABLED) -> Dict[str, np.ndarray]:
+    # Parsed entities of a DXF file as NumPy columns, memory-mapped from the cache after the first parse
+    if not cache:
+        return parse_columns(dxf_file)
+
+    path = COLUMNS_DIR / f'{COLUMNS_VERSION}-{file_digest(dxf_file)}'
+    if path.is_dir():
+        return {file.stem: np.load(file, mmap_mode='r') for file in path.glob('*.npy')}
+
+    columns = parse_columns(dxf_file)
+    try:
+        _save_columns(columns, path)
+    except OSError as e:
+        logger.warning('Parsed %s was not written to the cache: %s', dxf_file, e)
+    return columns
+
+
+def extract_red_lines(dxf_file) -> List:
+    columns = load_columns(dxf_file)
+    offsets = columns['lwpolyline_offsets']
+    lwpolyline_data = []
+    # Checking if the entity is LWPOLYLINE and if it is red
+    for i in np.flatnonzero(columns['lwpolyline_color'] == 1):
+        # Extracting data
+        lwpolyline_info = {
+            'handle': str(columns['lwpolyline_handle'][i]),
+            'layer': str(columns['lwpolyline_layer'][i]),
+            'points': [tuple(point) for point in columns['lwpolyline_points'][offsets[i]:offsets[i + 1]].tolist()],
+            'linetype': str(columns['lwpolyline_linetype'][i]),
+            'color': int(columns['lwpolyline_color'][i]),
+            'lineweight': int(columns['lwpolyline_lineweight'][i])
+        }
+        lwpolyline_data.append(lwpolyline_info)
     return lwpolyline_data 
 
 
-def extract_all_entities_data(dxf_file) -> List:
-    doc = ezdxf.readfile(dxf_file)
-    msp = doc.modelspace()
-    all_entities_data = []
-    # Iterate over all entities in the model space
-    for entity in msp:
-        entity_data = {}
-        if entity.dxftype() == 'TEXT':
-            entity_data['text'] = entity.dxf.text
-            entity_data['coords'] = entity.dxf.insert
-        elif  entity.dxftype() == 'INSERT':
-            entity_data['coords'] = entity.dxf.insert
-        elif entity.dxftype() == 'LINE':
-            entity_data['start'] = entity.dxf.get('start')
-            entity_data['end'] = entity.dxf.end
-        elif entity.dxftype() == 'LWPOLYLINE':
-            entity_data['points'] = entity.get_points()
-        # Add entity type
-        entity_data['type'] = entity.dxftype()
-        if entity_data:
-            all_entities_data.append(entity_data)
-    return all_entities_data
-
-
-
-def find_close_vec(text_entity, entities_list: List):
-    text_coords = text_entity['coords']
-    
-    # Throughout the list we look for one point close to the text
-    for entity in entities_list:
-        # Select entities of type INSERT (usually points)
-        if entity['type'] == 'INSERT':
-            ins_coords = entity['coords']
-            # Вetermine whether the INSERT entity is at a certain distance
-            state = text_coords.isclose(ins_coords, abs_tol=14e-1)
-            if state:
-                return entity
-    return None
+def match_markers(label_coords: np.ndarray, marker_coords: np.ndarray,
+                  tolerance: float = HEIGHT_MARKER_TOLERANCE) -> np.ndarray:
+    # Index of the nearest marker within the tolerance for every label, -1 if there is none.
+    # Distance is the largest coordinate difference, a square box of the tolerance around the label.
+    if len(label_coords) == 0 or len(marker_coords) == 0:
+        return np.full(len(label_coords), -1, dtype=np.int64)
+
+    tree = cKDTree(marker_coords)
+    distances, indices = tree.query(label_coords, p=np.inf, distance_upper_bound=tolerance)
+    return np.where(np.isfinite(distances), indices, -1)
+
+
+def get_height_markers(file) -> Dict[str, np.ndarray]:
+    columns = load_columns(file)
+
+    texts = columns['text_value']
+    is_label = np.array([re.match(HEIGHT_PATTERN, text) is not None for text in texts.tolist()], dtype=bool)
+
+    heights = np.array([float(text.replace(',', '.')) for text in texts[is_label].tolist()])
+    label_xyz = np.asarray(columns['text_insert'])[is_label]
+    marker_xyz = np.asarray(columns['insert_insert'])
+
+    marker_indices = match_markers(label_xyz, marker_xyz)
+    matched = marker_indices >= 0
+
+    # Labels without a marker nearby get NaN as the marker position
+    marker_xy = np.full((len(heights), 2), np.nan)
+    marker_xy[matched] = marker_xyz[marker_indices[matched], :2]
+
+    return {'heights': heights,
+            'label_xy': label_xyz[:, :2],
+            'marker_xy': marker_xy}
 
 
 def get_heights_data(file):
-    all_data = extract_all_entities_data(file)
-    # Pattern for finding heights among text
-    pattern = r"^\d+\.\d+$" 
-    # Get the coordinates of the heights and points near them
-    height_coords = []
-    height_coords_with_inserts = []
-    
-    for entity_data in all_data:
-        if entity_data['type'] == 'TEXT':
-            if re.match(pattern, entity_data['text']):
-                height_coords.append((entity_data['text'],entity_data['coords']))
-                close_entity = find_close_vec(entity_data, all_data)
-                if close_entity:
-                    height_coords_with_inserts.append((entity_data['text'],entity_data['coords'], close_entity['coords']))
-    heights = np.array([float(point[0].replace(',', '.')) for point in height_coords])
-    heights = (heights[heights > 100]) - heights.mean()
-    
+    markers = get_height_markers(file)
+
+    # The terrain point is the survey marker, not the text label written next to it.
+    # A label without a marker is the best guess of its point.
+    heights = markers['heights']
+    matched = ~np.isnan(markers['marker_xy'][:, 0])
+    coords = np.where(matched[:, None], markers['marker_xy'], markers['label_xy'])
+
+    # Numbers below the threshold are not elevations, they are dropped together with their points.
+    # Heights are centred on the mean of all labels, the dropped ones included, as they always were
+    valid = heights > 100
+    heights, coords = heights[valid] - heights.mean(), coords[valid]
+
     result_points = {   'heights': heights.tolist(),
-                        'coords': [(point[1].x, point[1].y) for point in height_coords],
+                        'coords': [tuple(point) for point in coords.tolist()],
                     }
-    return result_points
\ No newline at end of file
+    return result_points
@@ -2,14 +2,23 @@ import uuid
 import numpy as np
 import triangle as tr
 import ifcopenshell
+import ifcopenshell.util.unit
 from ifcopenshell.api import run
 from ifcopenshell.util.shape_builder import ShapeBuilder, V
 
+from src.tracing import traced, annotate
+
 
 create_guid = lambda: ifcopenshell.guid.compress(uuid.uuid1().hex)
 
 
-def generate_ifc(ground_coordinates, wall_coordinates, num_floors=3, elevation_height=3.0):
+@traced('ifc.generate')
+def generate_ifc(ground_coordinates, wall_coordinates, num_floors=3, elevation_height=3.0, instancing=True,
+                 ground_triangles=None):
+    # instancing=True builds the geometry of a typical storey once and references it from every floor,
+    # instancing=False creates every wall, window and slab separately through the API.
+    # ground_triangles are vertex indices of a prepared terrain TIN, without them all ground points are triangulated.
+    # wall_coordinates are the walls of one building or a list of such outlines, each becomes its own IfcBuilding
     # Create a blank model
     model = ifcopenshell.file()
 
@@ -28,17 +37,24 @@ def generate_ifc(ground_coordinates, wall_coordinates, num_floors=3, elevation_h
 
     # Create a site, building, and floors. Many hierarchies are possible.
     site = run("root.create_entity", model, ifc_class="IfcSite", name="My Site")
-    building = run("root.create_entity", model, ifc_class="IfcBuilding", name="Building A")
-    floors = []
+    if np.ndim(wall_coordinates[0]) == 2:
+        wall_coordinates = [wall_coordinates]
+    buildings = []
+
+    for b, _ in enumerate(wall_coordinates):
+        name = f"Building {chr(ord('A') + b)}" if b < 26 else f"Building {b+1}"
+        building = run("root.create_entity", model, ifc_class="IfcBuilding", name=name)
+        floors = []
 
-    for i in range(0, num_floors):
-        floor = run("root.create_entity", model, ifc_class="IfcBuildingStorey", name=f"Floor {i+1}")
-        floors.append(floor)
+        for i in range(0, num_floors):
+            floor = run("root.create_entity", model, ifc_class="IfcBuildingStorey", name=f"Floor {i+1}")
+            floors.append(floor)
+        run("aggregate.assign_object", model, relating_object=building, products=floors)
+        buildings.append((building, floors))
 
     # Since the site is our top level location, assign it to the project
     run("aggregate.assign_object", model, relating_object=project, products=[site])
-    run("aggregate.assign_object", model, relating_object=site, products=[building])
-    run("aggregate.assign_object", model, relating_object=building, products=floors)
+    run("aggregate.assign_object", model, relating_object=site, products=[building for building, _ in buildings])
 
     context = model.by_type("IfcGeometricRepresentationContext")[0]
 
@@ -73,11 +89,52 @@ def generate_ifc(ground_coordinates, wall_coordinates, num_floors=3, elevation_h
             ReflectanceMethod="PLASTIC"
         )
         surface_style = ifcfile.createIfcSurfaceStyle(
-            Name=None, Side="BOTH", Styles=[surface_style_rendering]
+            Name=name, Side="BOTH", Styles=[surface_style_rendering]
         )
-        pres_style = ifcfile.createIfcPresentationStyleAssignment([surface_style])
-        style = ifcfile.createIfcStyledItem(None, [pres_style], None)
-        return material, style
+        # The style belongs to the material, so every product associated with it is drawn in its colour
+        run("style.assign_material_style", ifcfile, material=material, style=surface_style, context=body)
+        return material, surface_style
+
+    # Materials are created once per (name, colour) and associated with all their products in one relationship
+    materials = {}
+    material_products = {}
+
+    def assign_material(products, name, color):
+        if (name, color) not in materials:
+            materials[(name, color)] = create_material_and_style(model, name, color)
+            material_products[(name, color)] = []
+        material_products[(name, color)].extend(products)
+        return materials[(name, color)]
+
+    def associate_materials():
+        for key, products in material_products.items():
+            model.createIfcRelAssociatesMaterial(create_guid(), None, None, None, products, materials[key][0])
+
+    # All windows share one type, its geometry is stored once and referenced through mapped items
+    window_width = 1
+    window_height = 1.5
+    window_sill_height = 0.4
+    window_type = None
+    window_shape = None
+    windows = []
+    unit_scale = ifcopenshell.util.unit.calculate_unit_scale(model)
+
+    def get_window_type():
+        nonlocal window_type, window_shape
+        if window_type is None:
+            window_type = run("root.create_entity", model, ifc_class="IfcWindowType", name="Window")
+            window_representation = run("geometry.add_wall_representation", model, context=body, length=window_width, height=window_height, thickness=-0.02)
+            run("geometry.assign_representation", model, product=window_type, representation=window_representation)
+            # Add color to the window
+            assign_material([window_type], "Window Material", (0.1, 0.1, 0.8))  # Blue color
+
+            # The mapped representation has no per-window data, so one shape is shared by all occurrences
+            representation_map = window_type.RepresentationMaps[0]
+            mapped_item = model.createIfcMappedItem(representation_map, model.createIfcCartesianTransformationOperator3D(
+                LocalOrigin=model.createIfcCartesianPoint((0.0, 0.0, 0.0))))
+            window_shape = model.createIfcProductDefinitionShape(Representations=[model.createIfcShapeRepresentation(
+                body, body.ContextIdentifier, "MappedRepresentation", [mapped_item])])
+        return window_type
 
 
     # Function to create transformation matrix
@@ -90,37 +147,30 @@ def generate_ifc(ground_coordinates, wall_coordinates, num_floors=3, elevation_h
 
     # Function to add windows to a wall based on its length
     def add_windows_to_wall(model, wall, start_point, end_point, length, angle, context, body, elevation):
-        window_width = 1
-        window_height = 1.5
-        window_sill_height = 0.4
         num_windows = max(1, length // 3)
         window_spacing = length / (num_windows + 1)
-        
+        get_window_type()
+
+        wall_windows = []
         for i in range(int(num_windows)):
             window_x = (i + 1) * window_spacing
-            if angle % 180 == 0:
-                window_position = (start_point[0] + window_x * np.cos(np.radians(angle)),
-                                start_point[1] + window_x * np.sin(np.radians(angle)))
-            else:
-                window_position = (start_point[0] + window_x * np.cos(np.radians(angle)),
-                                start_point[1] + window_x * np.sin(np.radians(angle)))
-
-            window = run("root.create_entity", model, ifc_class="IfcWindow", name=f"Window {i+1}")
-            window_matrix = create_matrix(window_position[0], window_position[1], elevation + window_sill_height, rotation_angle=angle)
-            run("geometry.edit_object_placement", model, product=window, matrix=window_matrix, is_si=True)
-            window_representation = run("geometry.add_wall_representation", model, context=body, length=window_width, height=window_height, thickness=-0.02)
-            run("geometry.assign_representation", model, product=window, representation=window_representation)
-            run("spatial.assign_container", model, relating_structure=floor, products=[window])
-            run("aggregate.assign_object", model, relating_object=wall, products=[window])
 
-            # Add color to the window
-            window_material, window_style = create_material_and_style(model, "Window Material", (0.1, 0.1, 0.8))  # Blue color
-            model.createIfcRelAssociatesMaterial(create_guid(), None, None, None, [window], window_material)
-            model.createIfcStyledItem(window_representation, [window_style], None)
+            # Windows are placed along the wall in its own placement, which already has the elevation and the angle
+            window_location = model.createIfcCartesianPoint((window_x / unit_scale, 0.0, window_sill_height / unit_scale))
+            window_placement = model.createIfcLocalPlacement(wall.ObjectPlacement, model.createIfcAxis2Placement3D(window_location))
+            window = model.createIfcWindow(create_guid(), None, f"Window {i+1}", ObjectPlacement=window_placement,
+                                           Representation=window_shape)
+            wall_windows.append(window)
+
+        # Placements are already relative to the wall, the API call would recompute each of them
+        model.createIfcRelAggregates(create_guid(), None, None, None, wall, wall_windows)
+        windows.extend(wall_windows)
             
 
-    def create_walls_and_slab(floor, floor_index, elevation_height, create_walls=True):
+    def create_walls_and_slab(floor, floor_index, elevation_height, wall_coordinates, create_walls=True):
         elevation = floor_index * elevation_height
+        # Everything built for the floor is put into the storey with one call
+        floor_products = []
         
         # Create walls based on the provided coordinates
         if floor_index == 0:
@@ -132,12 +182,10 @@ def generate_ifc(ground_coordinates, wall_coordinates, num_floors=3, elevation_h
                 run("geometry.edit_object_placement", model, product=wall, matrix=matrix, is_si=True)
                 representation = run("geometry.add_wall_representation", model, context=body, length=wall_length, height=-2, thickness=0.4)
                 run("geometry.assign_representation", model, product=wall, representation=representation)
-                run("spatial.assign_container", model, relating_structure=floor, products=[wall])
+                floor_products.append(wall)
                 
                 # Add color to the wall
-                wall_material, wall_style = create_material_and_style(model, "Wall Material", (0.5, 0.5, 0.5))
-                model.createIfcRelAssociatesMaterial(create_guid(), None, None, None, [wall], wall_material)
-                model.createIfcStyledItem(representation, [wall_style], None)
+                assign_material([wall], "Wall Material", (0.5, 0.5, 0.5))
         
         if create_walls:
             for i, ((x1, y1), (x2, y2)) in enumerate(wall_coordinates):
@@ -148,12 +196,10 @@ def generate_ifc(ground_coordinates, wall_coordinates, num_floors=3, elevation_h
                 run("geometry.edit_object_placement", model, product=wall, matrix=matrix, is_si=True)
                 representation = run("geometry.add_wall_representation", model, context=body, length=wall_length, height=elevation_height, thickness=0.2)
                 run("geometry.assign_representation", model, product=wall, representation=representation)
-                run("spatial.assign_container", model, relating_structure=floor, products=[wall])
+                floor_products.append(wall)
                 
                 # Add color to the wall
-                wall_material, wall_style = create_material_and_style(model, "Wall Material", (0.8, 0.3, 0.3))  # Red color
-                model.createIfcRelAssociatesMaterial(create_guid(), None, None, None, [wall], wall_material)
-                model.createIfcStyledItem(representation, [wall_style], None)
+                assign_material([wall], "Wall Material", (0.8, 0.3, 0.3))  # Red color
                 
                 # Add windows to the wall based on its length
                 add_windows_to_wall(model, wall, (x1, y1), (x2, y2), wall_length, angle, context, body, elevation)
@@ -166,12 +212,10 @@ def generate_ifc(ground_coordinates, wall_coordinates, num_floors=3, elevation_h
                 run("geometry.edit_object_placement", model, product=wall, matrix=matrix, is_si=True)
                 representation = run("geometry.add_wall_representation", model, context=body, length=wall_length, height=3/3, thickness=0.2)
                 run("geometry.assign_representation", model, product=wall, representation=representation)
-                run("spatial.assign_container", model, relating_structure=floor, products=[wall])
+                floor_products.append(wall)
                 
                 # Add color to the wall
-                wall_material, wall_style = create_material_and_style(model, "Wall Material", (0.8, 0.3, 0.3))  # Red color
-                model.createIfcRelAssociatesMaterial(create_guid(), None, None, None, [wall], wall_material)
-                model.createIfcStyledItem(representation, [wall_style], None)
+                assign_material([wall], "Wall Material", (0.8, 0.3, 0.3))  # Red color
                 
         # Create slab (floor) based on wall coordinates
         builder = ShapeBuilder(model)
@@ -189,18 +233,111 @@ def generate_ifc(ground_coordinates, wall_coordinates, num_floors=3, elevation_h
         slab.Representation = product_definition_shape
         slab_matrix = create_matrix(0, 0, elevation)
         run("geometry.edit_object_placement", model, product=slab, matrix=slab_matrix, is_si=True)
-        run("spatial.assign_container", model, relating_structure=floor, products=[slab])
+        floor_products.append(slab)
+        run("spatial.assign_container", model, relating_structure=floor, products=floor_products)
+
+
+    def create_storeys_instanced(wall_coordinates, floors):
+        # Geometry of the basement, the typical storey and the parapet is built once per wall and kept in
+        # representation maps. Storeys only get placements and products referencing the shared shapes,
+        # created directly without the API layer.
+        z_axis = model.createIfcDirection((0.0, 0.0, 1.0))
+        origin = model.createIfcAxis2Placement3D(model.createIfcCartesianPoint((0.0, 0.0, 0.0)))
+        identity = model.createIfcCartesianTransformationOperator3D(LocalOrigin=origin.Location)
+        get_window_type()
+
+        def mapped_shape(representation):
+            representation_map = model.createIfcRepresentationMap(origin, representation)
+            return model.createIfcProductDefinitionShape(Representations=[model.createIfcShapeRepresentation(
+                body, body.ContextIdentifier, "MappedRepresentation", [model.createIfcMappedItem(representation_map, identity)])])
+
+        def storey_placement(elevation):
+            location = model.createIfcCartesianPoint((0.0, 0.0, elevation / unit_scale))
+            return model.createIfcLocalPlacement(None, model.createIfcAxis2Placement3D(location))
 
+        walls = []
+        for (x1, y1), (x2, y2) in wall_coordinates:
+            wall_length = ((x2 - x1)**2 + (y2 - y1)**2)**0.5
+            angle = np.arctan2(y2 - y1, x2 - x1)
+            num_windows = max(1, wall_length // 3)
+            window_spacing = wall_length / (num_windows + 1)
+            walls.append({
+                'axes': model.createIfcAxis2Placement3D(model.createIfcCartesianPoint((x1 / unit_scale, y1 / unit_scale, 0.0)),
+                                                        z_axis, model.createIfcDirection((np.cos(angle), np.sin(angle), 0.0))),
+                'window_axes': [model.createIfcAxis2Placement3D(model.createIfcCartesianPoint(
+                    ((i + 1) * window_spacing / unit_scale, 0.0, window_sill_height / unit_scale))) for i in range(int(num_windows))],
+                'length': wall_length,
+            })
 
-    def create_ground(model, context, ground_coordinates, elevation):
+        def wall_shapes(height, thickness):
+            return [mapped_shape(run("geometry.add_wall_representation", model, context=body, length=wall['length'],
+                                     height=height, thickness=thickness)) for wall in walls]
+
+        # Create slab (floor) based on wall coordinates
+        builder = ShapeBuilder(model)
+        vertices = [(x *1000, y*1000) for (x, y), _ in wall_coordinates]
+        vertices.append(vertices[0])  # Closing the loop
+        slab_solid = builder.extrude(builder.profile(builder.polyline([V(x, y) for x, y in vertices])), 200, V(0, 0, 1))
+        slab_shape = mapped_shape(builder.get_representation(context=body, items=[slab_solid]))
+
+        def add_walls(floor_index, placement, shapes, color, with_windows):
+            products = []
+            for i, (wall, shape) in enumerate(zip(walls, shapes)):
+                wall_placement = model.createIfcLocalPlacement(placement, wall['axes'])
+                product = model.createIfcWall(create_guid(), None, f"Wall {i+1} Floor {floor_index+1}",
+                                              ObjectPlacement=wall_placement, Representation=shape)
+                products.append(product)
+
+                if with_windows:
+                    wall_windows = [model.createIfcWindow(create_guid(), None, f"Window {j+1}",
+                                                          ObjectPlacement=model.createIfcLocalPlacement(wall_placement, axes),
+                                                          Representation=window_shape)
+                                    for j, axes in enumerate(wall['window_axes'])]
+                    model.createIfcRelAggregates(create_guid(), None, None, None, product, wall_windows)
+                    windows.extend(wall_windows)
+            assign_material(products, "Wall Material", color)
+            return products
+
+        def add_slab(floor_index, placement):
+            return model.createIfcSlab(create_guid(), None, f"Slab Floor {floor_index+1}",
+                                       ObjectPlacement=model.createIfcLocalPlacement(placement, origin),
+                                       Representation=slab_shape)
+
+        typical_shapes = wall_shapes(elevation_height, 0.2)
+        for floor_index, floor in enumerate(floors):
+            elevation = floor_index * elevation_height
+            placement = storey_placement(elevation)
+            floor.ObjectPlacement = placement
+            floor.Elevation = elevation / unit_scale
+
+            floor_products = []
+            if floor_index == 0:
+                floor_products += add_walls(floor_index, placement, wall_shapes(-2, 0.4), (0.5, 0.5, 0.5), False)
+            floor_products += add_walls(floor_index, placement, typical_shapes, (0.8, 0.3, 0.3), True)  # Red color
+            floor_products.append(add_slab(floor_index, placement))
+
+            # Parapet and roof slab on top of the last floor
+            if floor_index == num_floors - 1:
+                roof_placement = model.createIfcLocalPlacement(placement, model.createIfcAxis2Placement3D(
+                    model.createIfcCartesianPoint((0.0, 0.0, elevation_height / unit_scale))))
+                floor_products += add_walls(num_floors, roof_placement, wall_shapes(3/3, 0.2), (0.8, 0.3, 0.3), False)
+                floor_products.append(add_slab(num_floors, roof_placement))
+
+            model.createIfcRelContainedInSpatialStructure(create_guid(), None, None, None, floor_products, floor)
+
+
+    def create_ground(model, context, ground_coordinates, elevation, container):
         ground = run("root.create_entity", model, ifc_class="IfcSlab", name=f"Ground Surface")
         vertices = [(x, y, z*0.3 - elevation) for (x, y, z) in ground_coordinates]
 
-        # Perform Delaunay triangulation
-        A = np.array(vertices)[:, :2]
-        B = {'vertices': A}
-        triangulation = tr.triangulate(B)
-        faces = triangulation['triangles'].tolist()
+        if ground_triangles is not None:
+            faces = np.asarray(ground_triangles).tolist()
+        else:
+            # Perform Delaunay triangulation
+            A = np.array(vertices)[:, :2]
+            B = {'vertices': A}
+            triangulation = tr.triangulate(B)
+            faces = triangulation['triangles'].tolist()
 
         edges = []
 
@@ -208,20 +345,31 @@ def generate_ifc(ground_coordinates, wall_coordinates, num_floors=3, elevation_h
         run("geometry.assign_representation", model, product=ground, representation=ground_representation)
         
         # Add color to the ground
-        ground_material, ground_style = create_material_and_style(model, "Ground Material", (0.2, 0.8, 0.2))  # Green color
-        model.createIfcRelAssociatesMaterial(create_guid(), None, None, None, [ground], ground_material)
-        model.createIfcStyledItem(ground_representation, [ground_style], None)
+        assign_material([ground], "Ground Material", (0.2, 0.8, 0.2))  # Green color
         
         # Since we are not placing it within a building storey, let's create a placement
         placement = run("geometry.edit_object_placement", model, product=ground, matrix=np.eye(4).tolist(), is_si=True)
-        run("spatial.assign_container", model, relating_structure=floors[0], products=[ground])
+        run("spatial.assign_container", model, relating_structure=container, products=[ground])
 
     # Create walls and slabs for each floor
-    for i, floor in enumerate(floors):
-        create_walls_and_slab(floor, i, elevation_height)
+    for building_walls, (building, floors) in zip(wall_coordinates, buildings):
+        if instancing:
+            create_storeys_instanced(building_walls, floors)
+        else:
+            for i, floor in enumerate(floors):
+                create_walls_and_slab(floor, i, elevation_height, building_walls)
+
+            create_walls_and_slab(floors[-1], num_floors, elevation_height, building_walls, create_walls=False)
+
+    # The ground stays in the first floor of the first building
+    create_ground(model, context, ground_coordinates, elevation=1.2, container=buildings[0][1][0])
+
+    # Windows already carry the mapped geometry of the type
+    if windows:
+        run("type.assign_type", model, related_objects=windows, relating_type=window_type, should_map_representations=False)
+    associate_materials()
 
-    create_walls_and_slab(floors[-1], num_floors, elevation_height, create_walls=False)
-    
-    create_ground(model, context, ground_coordinates, elevation=1.2)
+    annotate(buildings=len(buildings), floors=num_floors, walls=sum(map(len, wall_coordinates)), windows=len(windows),
+             ground_points=len(ground_coordinates), instancing=instancing)
 
     return model
\ No newline at end of file
@@ -0,0 +1,104 @@
+import numpy as np
+import shapely
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class Ring:
+    # Closed polygon outline kept in one contiguous float64 (n + 1, 2) array, the last row repeats the first.
+    # Transforms work in place on that array, so every view (vertices, coords, edges) stays in sync.
+
+    __slots__ = ('_coords',)
+
+    def __init__(self, coords, copy: bool = True):
+        coords = (np.array if copy else np.ascontiguousarray)(coords, dtype=np.float64).reshape(-1, 2)
+        if len(coords) and not np.array_equal(coords[0], coords[-1]):
+            coords = np.concatenate([coords, coords[:1]])
+        self._coords = coords
+
+    @classmethod
+    def from_xy(cls, x, y) -> 'Ring':
+        return cls(np.column_stack((x, y)), copy=False)
+
+    @classmethod
+    def from_shapely(cls, geometry) -> 'Ring':
+        # Exterior of a polygon or a linear ring, read in one call
+        ring = geometry.exterior if hasattr(geometry, 'exterior') else geometry
+        return cls(shapely.get_coordinates(ring), copy=False)
+
+    def __len__(self) -> int:
+        return len(self._coords) - 1
+
+    @property
+    def coords(self) -> np.ndarray:
+        # Closed ring, the layout shapely and the plan expect
+        return self._coords
+
+    @property
+    def vertices(self) -> np.ndarray:
+        return self._coords[:-1]
+
+    @property
+    def x(self) -> np.ndarray:
+        return self._coords[:, 0]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self._coords[:, 1]
+
+    @property
+    def area(self) -> float:
+        # Shoelace formula, positive for counter-clockwise rings
+        x, y = self._coords[:, 0], self._coords[:, 1]
+        return float(abs(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2)
+
+    @property
+    def centroid(self) -> np.ndarray:
+        # Area centroid, taken relative to the first vertex like GEOS does to keep precision far from the origin
+        origin = self._coords[0]
+        x, y = (self._coords - origin).T
+        cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+        total = 3 * cross.sum()
+        return origin + np.array([np.dot(x[:-1] + x[1:], cross), np.dot(y[:-1] + y[1:], cross)]) / total
+
+    @property
+    def bounds(self) -> tuple:
+        minx, miny = self._coords.min(axis=0)
+        maxx, maxy = self._coords.max(axis=0)
+        return (float(minx), float(miny), float(maxx), float(maxy))
+
+    def edges(self) -> np.ndarray:
+        # (n, 2, 2) read-only view of the segments: edges()[i] is [[x1, y1], [x2, y2]]; zero-length edges
+        # (repeated vertices) would turn into empty walls, so a ring with them gets a compacted copy first
+        if (np.diff(self._coords, axis=0) == 0).all(axis=1).any():
+            keep = np.r_[True, (np.diff(self._coords, axis=0) != 0).any(axis=1)]
+            return Ring(self._coords[keep]).edges()
+        return sliding_window_view(self._coords, 2, axis=0).swapaxes(1, 2)
+
+    def translate(self, dx: float = 0.0, dy: float = 0.0) -> 'Ring':
+        self._coords += (dx, dy)
+        return self
+
+    def scale(self, factor: float, origin=(0.0, 0.0)) -> 'Ring':
+        self._coords -= origin
+        self._coords *= factor
+        self._coords += origin
+        return self
+
+    def rotate(self, angle: float, origin=(0.0, 0.0)) -> 'Ring':
+        # Counter-clockwise, in degrees
+        theta = np.radians(angle)
+        cos, sin = np.cos(theta), np.sin(theta)
+        self._coords -= origin
+        self._coords[:] = self._coords @ np.array([[cos, sin], [-sin, cos]])
+        self._coords += origin
+        return self
+
+    def copy(self) -> 'Ring':
+        return Ring(self._coords)
+
+    def to_shapely(self) -> shapely.Polygon:
+        return shapely.polygons(self._coords)
+
+    def to_lists(self) -> tuple:
+        # coords_x, coords_y as stored in placements
+        return self._coords[:, 0].tolist(), self._coords[:, 1].tolist()
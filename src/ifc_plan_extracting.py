@@ -1,114 +1,128 @@
 import ifcopenshell
-import matplotlib.pyplot as plt
 import numpy as np
+from pathlib import Path
 from shapely.geometry import Polygon, MultiPoint
-from shapely.ops import unary_union, polygonize
-from typing import List, Optional, Tuple, Any
+from typing import List, Optional, Tuple, Any, Dict
 
+from src.stage_cache import stage_cache, file_digest, cache_key
+from src.tracing import trace, traced, annotate
 
 
-def get_building_polygon(model_path):
-    model = ifcopenshell.open(model_path)
-    levels = model.by_type("IfcBuildingStorey")
+def get_local_transform(placement, transforms: Dict[int, np.ndarray]) -> np.ndarray:
+    # Walls of one model share a handful of placements, each is converted to a matrix once
+    placement_id = placement.id()
+    local_transform = transforms.get(placement_id)
+    if local_transform is None:
+        local_transform = np.identity(4)
+        if placement.is_a('IfcLocalPlacement'):
+            rel_placement = placement.RelativePlacement
+            if rel_placement.is_a('IfcAxis2Placement3D'):
+                location = np.array(rel_placement.Location.Coordinates)
+                local_transform[:3, 3] = location
+                if rel_placement.RefDirection:
+                    direction1 = np.array(rel_placement.RefDirection.DirectionRatios)
+                    local_transform[:3, 0] = direction1
+                if rel_placement.Axis:
+                    direction2 = np.array(rel_placement.Axis.DirectionRatios)
+                    local_transform[:3, 2] = direction2
+        transforms[placement_id] = local_transform
+    return local_transform
+
+
+def get_global_transform(instance, transforms: Dict[int, np.ndarray]) -> np.ndarray:
+    # Product of the local placements along the decomposition chain, memoized per instance
+    key = ('instance', instance.id())
+    transform = transforms.get(key)
+    if transform is None:
+        transform = np.identity(4)
+        if instance.ObjectPlacement:
+            transform = get_local_transform(instance.ObjectPlacement, transforms)
+        if instance.Decomposes:
+            transform = np.dot(get_global_transform(instance.Decomposes[0].RelatingObject, transforms), transform)
+        transforms[key] = transform
+    return transform
+
+
+def transform_coordinates(coords, transform):
+    if coords.shape[1] != 3:
+        raise ValueError("Input coordinates must have 3 columns (x, y, z).")
+    coords_homogeneous = np.hstack((coords, np.ones((coords.shape[0], 1))))
+    transformed_coords = transform.dot(coords_homogeneous.T).T
+    return transformed_coords[:, :3]
 
-    # Level that captures the -100 mark
-    target_elevation = -100
-    selected_level = None
 
-    # Sort the levels by height
+def _to_3d(points: np.ndarray) -> np.ndarray:
+    if points.shape[1] == 2:
+        points = np.hstack((points, np.zeros((points.shape[0], 1))))
+    return points
+
+
+def get_wall_points(wall, transforms: Dict[int, np.ndarray]) -> Optional[np.ndarray]:
+    ifc_representation = wall.Representation
+    if ifc_representation:
+        for representation in ifc_representation.Representations:
+            points = None
+            if representation.RepresentationType in ['Curve2D', 'Curve3D']:
+                for item in representation.Items:
+                    if item.is_a('IfcIndexedPolyCurve'):
+                        points = np.array(item.Points.CoordList)
+                        break
+                    if item.is_a('IfcPolyline'):
+                        points = _to_3d(np.array([pt.Coordinates for pt in item.Points]))
+                        break
+            elif representation.RepresentationType == 'SweptSolid':
+                for item in representation.Items:
+                    if item.is_a('IfcExtrudedAreaSolid'):
+                        profile = item.SweptArea
+                        if profile.is_a('IfcArbitraryClosedProfileDef'):
+                            outer_curve = profile.OuterCurve
+                            if outer_curve.is_a('IfcPolyline'):
+                                points = _to_3d(np.array([point.Coordinates for point in outer_curve.Points]))
+                                break
+            if points is not None:
+                global_coords = transform_coordinates(points, get_global_transform(wall, transforms))
+                return global_coords[:, :2]
+    return None
+
+
+@traced('ifc.footprint')
+def extract_building_polygon(model) -> Optional[List[Tuple[float, float]]]:
+    levels = model.by_type("IfcBuildingStorey")
+
+    # Sort the levels by height, only the first level that has walls is read
     selected_levels = sorted(levels, key=lambda x: x.Elevation)
-    result_building_polygon = None
-    
+    transforms = {}
+
     for selected_level in selected_levels:
-        if not selected_level:
-            continue
-        else:
-            # Find all walls belonging to the selected level
-            walls_on_selected_level = []
-
-            for rel in selected_level.ContainsElements:
-                for element in rel.RelatedElements:
-                    if element.is_a("IfcWall") or element.is_a("IfcWallStandardCase"):
-                        walls_on_selected_level.append(element)
-
-            def get_global_transform(instance):
-                transform = np.identity(4)
-                while instance:
-                    if instance.ObjectPlacement:
-                        placement = instance.ObjectPlacement
-                        if placement.is_a('IfcLocalPlacement'):
-                            rel_placement = placement.RelativePlacement
-                            if rel_placement.is_a('IfcAxis2Placement3D'):
-                                location = np.array(rel_placement.Location.Coordinates)
-                                local_transform = np.identity(4)
-                                local_transform[:3, 3] = location
-                                if rel_placement.RefDirection:
-                                    direction1 = np.array(rel_placement.RefDirection.DirectionRatios)
-                                    local_transform[:3, 0] = direction1
-                                if rel_placement.Axis:
-                                    direction2 = np.array(rel_placement.Axis.DirectionRatios)
-                                    local_transform[:3, 2] = direction2
-                                transform = np.dot(local_transform, transform)
-                    instance = instance.Decomposes[0].RelatingObject if instance.Decomposes else None
-                return transform
-
-            def transform_coordinates(coords, transform):
-                if coords.shape[1] != 3:
-                    raise ValueError("Input coordinates must have 3 columns (x, y, z).")
-                coords_homogeneous = np.hstack((coords, np.ones((coords.shape[0], 1))))
-                transformed_coords = transform.dot(coords_homogeneous.T).T
-                return transformed_coords[:, :3]
-
-            def get_wall_coordinates(wall):
-                ifc_representation = wall.Representation
-                if ifc_representation:
-                    for representation in ifc_representation.Representations:
-                        if representation.RepresentationType in ['Curve2D', 'Curve3D']:
-                            for item in representation.Items:
-                                if item.is_a('IfcIndexedPolyCurve'):
-                                    points_list = item.Points
-                                    points = np.array(points_list.CoordList)
-                                    transform = get_global_transform(wall)
-                                    global_coords = transform_coordinates(points, transform)
-                                    coordinates = [(coord[0], coord[1]) for coord in global_coords]
-                                    return coordinates
-                                if item.is_a('IfcPolyline'):
-                                    points = [pt.Coordinates for pt in item.Points]
-                                    points = np.array(points)
-                                    if points.shape[1] == 2:
-                                        points = np.hstack((points, np.zeros((points.shape[0], 1))))
-                                    transform = get_global_transform(wall)
-                                    global_coords = transform_coordinates(points, transform)
-                                    coordinates = [(coord[0], coord[1]) for coord in global_coords]
-                                    return coordinates
-                        elif representation.RepresentationType == 'SweptSolid':
-                            for item in representation.Items:
-                                if item.is_a('IfcExtrudedAreaSolid'):
-                                    profile = item.SweptArea
-                                    if profile.is_a('IfcArbitraryClosedProfileDef'):
-                                        outer_curve = profile.OuterCurve
-                                        if outer_curve.is_a('IfcPolyline'):
-                                            points = np.array([point.Coordinates for point in outer_curve.Points])
-                                            if points.shape[1] == 2:
-                                                points = np.hstack((points, np.zeros((points.shape[0], 1))))
-                                            transform = get_global_transform(wall)
-                                            global_coords = transform_coordinates(points, transform)
-                                            coordinates = [(coord[0], coord[1]) for coord in global_coords]
-                                            return coordinates
-                return None
-
-            wall_coordinates_list = []
-
-            for wall in walls_on_selected_level:
-                coordinates = get_wall_coordinates(wall)
-                if coordinates:
-                    wall_coordinates_list.append(coordinates)
-            if wall_coordinates_list:
-                all_points = [point for line in wall_coordinates_list for point in line]
-                multipoint = MultiPoint(all_points)
-                merged_polygon = unary_union(multipoint)
-                exterior = merged_polygon.convex_hull.exterior
-                result_building_polygon = list(exterior.coords)
-                break
-            
-    return result_building_polygon
+        # Find all walls belonging to the selected level
+        walls_on_selected_level = []
+
+        for rel in selected_level.ContainsElements:
+            for element in rel.RelatedElements:
+                if element.is_a("IfcWall"):
+                    walls_on_selected_level.append(element)
+
+        wall_points = []
+        for wall in walls_on_selected_level:
+            points = get_wall_points(wall, transforms)
+            if points is not None and len(points):
+                wall_points.append(points)
+
+        if wall_points:
+            annotate(storeys=len(selected_levels), walls=len(walls_on_selected_level))
+            multipoint = MultiPoint(np.vstack(wall_points))
+            exterior = multipoint.convex_hull.exterior
+            return list(exterior.coords)
+
+    return None
+
+
+def get_building_polygon(model_path):
+    # The footprint is persisted by file content, the model is only opened on a cache miss
+    def compute():
+        with trace('ifc.open', file=Path(model_path).name):
+            model = ifcopenshell.open(str(model_path))
+        return extract_building_polygon(model)
+
+    key = cache_key('footprint', file_digest(model_path))
+    return stage_cache.get_or_compute('footprint', key, compute)
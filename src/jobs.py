@@ -0,0 +1,232 @@
+import os
+import time
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, BrokenExecutor
+
+from src.stage_cache import cache_key, file_digest
+
+
+# Generations run in a local thread pool of the web worker; finished jobs keep their artifacts in memory,
+# the oldest finished jobs are dropped above JOB_STORE_ITEMS
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_STORE_ITEMS = int(os.environ.get('JOB_STORE_ITEMS', 64))
+# How long a view waits for a job before it reports the progress instead
+JOB_VIEW_WAIT = float(os.environ.get('JOB_VIEW_WAIT', 2.0))
+# Failures that may not repeat (I/O, memory, a broken process pool); any other failure depends only on the inputs.
+# A missing file or a denied access is I/O too, but it stays the same until someone fixes the deployment.
+TRANSIENT_ERRORS = (OSError, MemoryError, BrokenExecutor)
+PERMANENT_ERRORS = (FileNotFoundError, PermissionError)
+
+STAGE_LABELS = {
+    'queued': 'Queued (В очереди)',
+    'running': 'Started (Запущено)',
+    'site': 'Site parsed (Участок прочитан)',
+    'terrain': 'Terrain built (Рельеф построен)',
+    'variants': 'Variants retrieved (Варианты подобраны)',
+    'placement': 'Placement found (Размещение найдено)',
+    'plan': 'Plan drawn (План построен)',
+    'ifc': 'IFC written (IFC сформирован)',
+}
+
+logger = logging.getLogger(__name__)
+
+
+def is_transient(error: Exception) -> bool:
+    return isinstance(error, TRANSIENT_ERRORS) and not isinstance(error, PERMANENT_ERRORS)
+
+
+class Job:
+
+    def __init__(self, job_id: str, kind: str, inputs: dict):
+        self.id = job_id
+        self.kind = kind
+        self.inputs = inputs
+        self.status = 'queued'
+        self.stage = 'queued'
+        # (stage, seconds since the job was submitted)
+        self.stages = []
+        self.artifacts = {}
+        self.error = None
+        self.transient = False
+        self.created = time.time()
+        self.finished = None
+        self._changed = threading.Condition()
+
+    def report(self, stage: str, **artifacts):
+        # Called by the running job after every finished stage, artifacts become readable at once
+        with self._changed:
+            self.stage = stage
+            self.stages.append((stage, time.time() - self.created))
+            self.artifacts.update(artifacts)
+            self._changed.notify_all()
+
+    def _start(self):
+        with self._changed:
+            self.status = 'running'
+        self.report('running')
+
+    def _finish(self, status: str, error: str = None, transient: bool = False):
+        with self._changed:
+            self.status = status
+            self.error = error
+            self.transient = transient
+            self.finished = time.time()
+            self._changed.notify_all()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def wait(self, timeout: float = None, artifact: str = None) -> bool:
+        # True when the job has finished, or has produced the given artifact, within the timeout
+        ready = (lambda: artifact in self.artifacts or self.done) if artifact else (lambda: self.done)
+        with self._changed:
+            return self._changed.wait_for(ready, timeout)
+
+    def progress(self) -> str:
+        return STAGE_LABELS.get(self.stage, self.stage)
+
+    def snapshot(self) -> dict:
+        with self._changed:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'stage': self.stage,
+                'stages': list(self.stages),
+                'artifacts': sorted(self.artifacts),
+                'error': self.error,
+                'transient': self.transient,
+                'seconds': (self.finished or time.time()) - self.created,
+            }
+
+
+class JobQueue:
+    # Jobs are keyed by their inputs, files by their content: a request identical to a queued, running or finished
+    # job gets that job. A failed job is returned as well, it is only started again after a transient error
+    # or with retry=True
+
+    def __init__(self, workers: int = JOB_WORKERS, max_items: int = JOB_STORE_ITEMS):
+        self.max_items = max_items
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, inputs: dict, run, retry: bool = False) -> Job:
+        # run(job, **inputs) does the work and reports its stages through job.report
+        job_id = cache_key(kind, sorted((name, file_digest(value) if isinstance(value, Path) else value)
+                                        for name, value in inputs.items()))
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and not (job.status == 'failed' and (retry or job.transient)):
+                self._jobs.move_to_end(job_id)
+                return job
+
+            job = Job(job_id, kind, inputs)
+            self._jobs[job_id] = job
+            self._evict()
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> list:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _evict(self):
+        # Only finished jobs are dropped, the pending ones are still referenced by their submitters
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_items)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: Job, run):
+        job._start()
+        try:
+            run(job, **job.inputs)
+        except Exception as e:
+            logger.warning('Job %s (%s) failed: %s', job.id, job.kind, e)
+            job._finish('failed', str(e), transient=is_transient(e))
+        else:
+            job._finish('done')
+
+
+def generate_variant(job: Job, bound_file_path, elevation_baseline_file_path, model_path, building_area: float,
+                     placement_mode: str, variant: int, num_floors: int, elevation_height: float,
+                     avoid_obstacles: bool = False, buildings: int = 1, option: int = 1):
+    # The steps of the IFC view, reporting after each of them; the plan is available before the IFC.
+    # option picks one of the ranked positions of a single building (1 is the best one).
+    # With buildings > 1 copies of the variant are packed on the site, the artifacts show all placed copies
+    from src import pipeline
+    from src.polygon_placing import max_building_area
+    from src.variants import select_alternative
+
+    obstacles_file_path = elevation_baseline_file_path if avoid_obstacles else None
+
+    site = pipeline.load_site(bound_file_path)
+    job.report('site')
+    pipeline.site_terrain(bound_file_path, elevation_baseline_file_path)
+    job.report('terrain')
+    variants = pipeline.find_building_variants(model_path)
+    job.report('variants')
+
+    def max_area() -> float:
+        # The hint is bisected under the constraints of the request: mode, obstacles and, for packing, the count
+        obstacles = (pipeline.site_obstacles(bound_file_path, elevation_baseline_file_path)
+                     if obstacles_file_path else None)
+        _, object_x, object_y = variants[variant]
+        return max_building_area(site['area_polygon'], object_x, object_y, obstacles=obstacles,
+                                 placement_mode=placement_mode, count=buildings, below=building_area)[0]
+
+    if buildings > 1:
+        packed = pipeline.pack_building_variants(bound_file_path, model_path, building_area, buildings,
+                                                 obstacles_file_path=obstacles_file_path, variant=variant)
+        placed = [item for item in packed if item['found']]
+        if not placed:
+            area = max_area()
+            raise ValueError(f"Can't place {buildings} buildings, each of them fits up to {area:.0f} m2 "
+                             f"(Не могу разместить {buildings} зданий, площадь каждого - не больше {area:.0f} м2)")
+
+        # A partial pack is kept, the warning tells how many buildings the model has
+        warning = None
+        if len(placed) < buildings:
+            area = max_area()
+            warning = (f'Placed {len(placed)} of {buildings} buildings, all of them fit up to {area:.0f} m2 each '
+                       f'(Размещено {len(placed)} из {buildings} зданий, все помещаются при площади каждого '
+                       f'до {area:.0f} м2)')
+        job.report('placement', placement=placed, warning=warning)
+        job.report('plan', plan=pipeline.site_plan_image(bound_file_path, placed))
+        job.report('ifc', ifc=pipeline.site_ifc(bound_file_path, elevation_baseline_file_path, placed,
+                                                num_floors=num_floors, elevation_height=elevation_height))
+        return
+
+    placement = pipeline.place_building_variants(bound_file_path, model_path, building_area, placement_mode,
+                                                 obstacles_file_path=obstacles_file_path)[variant]
+    if not placement['found']:
+        area = max_area()
+        raise ValueError(f"Can't place model, maximum building area is {area:.0f} m2 "
+                         f"(Не могу разместить здание, максимальная площадь для размещения {area:.0f} м2)")
+
+    placement = select_alternative(placement, option)
+    job.report('placement', placement=placement)
+    job.report('plan', plan=pipeline.plan_image(bound_file_path, placement))
+    job.report('ifc', ifc=pipeline.building_ifc(bound_file_path, elevation_baseline_file_path, model_path, placement,
+                                                num_floors=num_floors, elevation_height=elevation_height))
+
+
+# Queue shared by the whole process, created on first use
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -1,16 +1,13 @@
 import numpy as np
 
-from shapely import Polygon
+from src.geometry import Ring
 
 def scaling_object(x_array, y_array, target_area: int):
 
-    object_polygon = Polygon(list(zip(x_array, y_array)))
-    original_object_area = object_polygon.area
-    scale_coeff = np.sqrt(target_area / original_object_area)
-
-    new_object_x = [x*scale_coeff for x in x_array]
-    new_object_y = [y*scale_coeff for y in y_array]
-    new_object = Polygon(list(zip(new_object_x, new_object_y)))
+    # The outline is scaled in place in its own array, the placement functions take the Ring as it is
+    ring = Ring.from_xy(x_array, y_array)
+    scale_coeff = np.sqrt(target_area / ring.area)
+    new_object = ring.scale(scale_coeff)
 
     return (new_object, new_object.area)
 
@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import shapely
+from typing import Dict
+
+
+def _names(value: str) -> tuple:
+    return tuple(name.strip() for name in value.split(',') if name.strip())
+
+
+# Survey layers with existing structures and utilities; OBSTACLE_OPEN_LAYERS are kept as lines only, so a
+# fence around a yard does not block the yard itself. Other layers also block the areas their lines enclose.
+OBSTACLE_LAYERS = _names(os.environ.get('OBSTACLE_LAYERS', 'Здания,Части зданий,Навесы,Павильоны,Крыльца,Ограды,'
+                                                           'Выгребные ямы,Люки,Фонтаны,Вентиляторы'))
+OBSTACLE_OPEN_LAYERS = _names(os.environ.get('OBSTACLE_OPEN_LAYERS', 'Ограды'))
+# ACI colours to keep, empty for any colour
+OBSTACLE_COLORS = tuple(int(color) for color in _names(os.environ.get('OBSTACLE_COLORS', '')))
+# Distance kept from every obstacle, in site units
+OBSTACLE_SETBACK = float(os.environ.get('OBSTACLE_SETBACK', 3.0))
+
+
+class ObstacleIndex:
+    # Buffered obstacles in an STRtree. A candidate test is one tree query, logarithmic in the number of
+    # obstacles, and only the few obstacles whose boxes overlap the candidate are tested exactly.
+
+    def __init__(self, geometries):
+        self.geometries = np.asarray(geometries, dtype=object).reshape(-1)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    def __reduce__(self):
+        # The tree is rebuilt after unpickling (stage cache, process pool workers)
+        return (ObstacleIndex, (self.geometries,))
+
+    def __len__(self) -> int:
+        return len(self.geometries)
+
+    def blocked(self, geometries) -> np.ndarray:
+        # Whether each geometry touches an obstacle
+        geometries = np.asarray(geometries, dtype=object).reshape(-1)
+        result = np.zeros(len(geometries), dtype=bool)
+        if len(self.geometries) and len(geometries):
+            result[self.tree.query(geometries, predicate='intersects')[0]] = True
+        return result
+
+    def blocked_xy(self, x, y) -> np.ndarray:
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        return self.blocked(shapely.points(x.ravel(), y.ravel())).reshape(x.shape)
+
+    def distance(self, geometry) -> float:
+        # Distance to the nearest obstacle, infinite when there are none
+        if not len(self.geometries):
+            return float('inf')
+        return float(self.tree.query_nearest(geometry, return_distance=True)[1][0])
+
+    def translate(self, dx: float, dy: float) -> 'ObstacleIndex':
+        return ObstacleIndex(shapely.transform(self.geometries, lambda xy: xy + (dx, dy)))
+
+
+def obstacle_geometries(columns: Dict[str, np.ndarray], layers=OBSTACLE_LAYERS, open_layers=OBSTACLE_OPEN_LAYERS,
+                        colors=OBSTACLE_COLORS, setback: float = OBSTACLE_SETBACK) -> np.ndarray:
+    # LWPOLYLINE and LINE entities of the survey on the obstacle layers, buffered by the setback.
+    # Outlines of buildings are often split into several polylines, so the enclosed areas come from
+    # polygonizing all lines of a layer group rather than from single closed polylines.
+    def selected(layer, color):
+        keep = np.isin(layer, layers)
+        if colors:
+            keep &= np.isin(color, colors)
+        return keep
+
+    offsets = columns['lwpolyline_offsets']
+    points = np.asarray(columns['lwpolyline_points'])[:, :2]
+    polylines = np.flatnonzero(selected(columns['lwpolyline_layer'], columns['lwpolyline_color'])
+                               & (np.diff(offsets) >= 2))
+    lines = list(shapely.linestrings(points[offsets[i]:offsets[i + 1]]) for i in polylines)
+    line_layers = list(columns['lwpolyline_layer'][polylines])
+
+    segments = np.flatnonzero(selected(columns['line_layer'], columns['line_color']))
+    if len(segments):
+        ends = np.stack([np.asarray(columns['line_start'])[segments, :2], np.asarray(columns['line_end'])[segments, :2]], axis=1)
+        lines += list(shapely.linestrings(ends))
+        line_layers += list(columns['line_layer'][segments])
+
+    lines = np.array(lines, dtype=object)
+    line_layers = np.array(line_layers, dtype=str)
+    if len(lines) == 0:
+        return np.empty(0, dtype=object)
+
+    # Noding the linework first lets polylines that meet end to end close an area
+    closing = lines[~np.isin(line_layers, open_layers)]
+    areas = shapely.get_parts(shapely.polygonize(shapely.get_parts(shapely.union_all(closing)))) if len(closing) else []
+
+    obstacles = np.concatenate([np.asarray(areas, dtype=object), lines])
+    obstacles = obstacles[~shapely.is_empty(obstacles)]
+    return shapely.buffer(obstacles, setback) if setback > 0 else obstacles
+
+
+def build_obstacles(columns: Dict[str, np.ndarray], **options) -> ObstacleIndex:
+    return ObstacleIndex(obstacle_geometries(columns, **options))
@@ -1,39 +1,73 @@
-import uuid
-import os
 import numpy as np
-import onnxruntime as ort
-import matplotlib.pyplot as plt
 from PIL import Image
+from typing import TYPE_CHECKING
 
+from src.tracing import traced
 
-def image_features_onnx(path, onnx_session: ort.InferenceSession):
+if TYPE_CHECKING:
+    import onnxruntime as ort
 
-    input_name = onnx_session.get_inputs()[0].name
-    output_name = onnx_session.get_outputs()[0].name
 
-    image = Image.open(path)
+# The catalog embeddings were computed from the default pyplot figure: 6.4 x 4.8 inches at 100 dpi,
+# default axes box, 5% data margins and a 1.5 pt blue line. The direct rasterizer rebuilds this frame and Agg's
+# stroke without matplotlib, its pixels stay within RENDER_TOLERANCE grey levels of the Agg picture.
+FIGURE_SIZE = (640, 480)
+AXES_BOX = (0.125, 0.11, 0.9, 0.88)
+AXES_MARGIN = 0.05
+LINE_WIDTH = 1.5 * 100 / 72
+LINE_COLOR = np.array([0, 0, 255])
+RENDER_TOLERANCE = 3
+
+# Agg and matplotlib path handling the direct rasterizer follows
+INNER_MITER_LIMIT = 1.01
+SNAP_MAX_VERTICES = 1024
+SIMPLIFY_MIN_VERTICES = 128
+
+# Renderer used for queries and for the catalog; 'direct' draws the line with numpy,
+# 'agg' draws the same figure with matplotlib
+DEFAULT_RENDERER = 'direct'
+
+IMAGE_SIZE = 224
+MEAN = np.array([0.485, 0.456, 0.406])
+STD = np.array([0.229, 0.224, 0.225])
+
+
+def preprocess_image(image: Image.Image) -> np.ndarray:
+    # Shared by the file and the in-memory paths, so both produce the same tensor for the same picture
     image = image.convert('RGB')
 
-    image = image.resize((224, 224))
+    image = image.resize((IMAGE_SIZE, IMAGE_SIZE))
     image = np.array(image) / 255.0
 
-    mean = np.array([0.485, 0.456, 0.406])
-    std = np.array([0.229, 0.224, 0.225])
-    image = (image - mean) / std
+    image = (image - MEAN) / STD
 
     image = image.astype(np.float32)
 
     image = np.transpose(image, (2, 0, 1))
     image = np.expand_dims(image, axis=0)
 
+    return image
+
+
+@traced('embedding.onnx')
+def run_onnx(image: np.ndarray, onnx_session: 'ort.InferenceSession'):
+
+    input_name = onnx_session.get_inputs()[0].name
+    output_name = onnx_session.get_outputs()[0].name
+
     result = onnx_session.run([output_name], {input_name: image})
 
     return result
 
 
-def vec_to_features(temp_pic_path: str, vector: list, onnx_session: ort.InferenceSession):
+def image_features_onnx(path, onnx_session: 'ort.InferenceSession'):
+
+    image = preprocess_image(Image.open(path))
+
+    return run_onnx(image, onnx_session)
 
-    uid = str(uuid.uuid4())
+
+def normalize_footprint(vector: list):
 
     x = np.array(vector)[:, 0]
     y = np.array(vector)[:, 1]
@@ -41,15 +75,196 @@ def vec_to_features(temp_pic_path: str, vector: list, onnx_session: ort.Inferenc
     x_scaled = (x - np.min(x)) / (np.max(x) - np.min(x)) + 1
     y_scaled = (y - np.min(y)) / (np.max(y) - np.min(y)) + 1
 
-    plt.figure()
-    ax = plt.gca()
-    plt.axis('off')
-    plt.plot(x_scaled, y_scaled, linestyle='-', color='b')
-    plt.savefig(f"{temp_pic_path}/temp_pic/pic_{uid}.png")
+    return x_scaled, y_scaled
 
-    raw_features = image_features_onnx(path=f"{temp_pic_path}/temp_pic/pic_{uid}.png", onnx_session=onnx_session)
-    feature_scipy = np.array(raw_features).flatten()
 
-    os.remove(f"{temp_pic_path}/temp_pic/pic_{uid}.png")
+def _to_pixels(vector: list):
+    x_scaled, y_scaled = normalize_footprint(vector)
+    width, height = FIGURE_SIZE
+    left, bottom, right, top = AXES_BOX
+
+    # Data to pixel transform of the default axes, rows counted from the top of the image
+    def to_pixels(values, start, end):
+        span = values.max() - values.min()
+        data_min = values.min() - AXES_MARGIN * span
+        data_max = values.max() + AXES_MARGIN * span
+        return start + (values - data_min) / (data_max - data_min) * (end - start)
+
+    px = to_pixels(x_scaled, left * width, right * width)
+    py = height - to_pixels(y_scaled, bottom * height, top * height)
+
+    # Agg snaps a path made only of horizontal and vertical segments to the pixel grid
+    dx, dy = np.abs(np.diff(px)), np.abs(np.diff(py))
+    if len(px) <= SNAP_MAX_VERTICES and ((dx < 1e-4) | (dy < 1e-4)).all():
+        px, py = np.floor(px + 0.5), np.floor(py + 0.5)
+
+    points = np.column_stack([px, py])
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.hypot(*np.diff(points, axis=0).T) > 1e-14
+    return points[keep]
+
+
+def _stroke_outline(points: np.ndarray, half_width: float) -> np.ndarray:
+    # Outline of an open polyline as Agg's stroker builds it: square caps, round outer joins and
+    # mitred inner joins. Where the outline overlaps itself the fill counts both layers, as Agg does.
+    outline = []
+    arc_step = 2 * np.arccos(half_width / (half_width + 0.125))
+
+    def offsets(v0, v1):
+        length = np.hypot(*(v1 - v0))
+        return half_width * (v1[1] - v0[1]) / length, half_width * (v1[0] - v0[0]) / length
+
+    def intersection(a, b, c, d):
+        denominator = (b[0] - a[0]) * (d[1] - c[1]) - (b[1] - a[1]) * (d[0] - c[0])
+        if abs(denominator) < 1e-14:
+            return None
+        r = ((a[1] - c[1]) * (d[0] - c[0]) - (a[0] - c[0]) * (d[1] - c[1])) / denominator
+        return a + r * (b - a)
+
+    def cap(v0, v1):
+        dx, dy = offsets(v0, v1)
+        outline.append((v0[0] - dx - dy, v0[1] + dy - dx))
+        outline.append((v0[0] + dx - dy, v0[1] - dy - dx))
+
+    def join(v0, v1, v2):
+        dx1, dy1 = offsets(v0, v1)
+        dx2, dy2 = offsets(v1, v2)
+        first, second = np.array([dx1, -dy1]), np.array([dx2, -dy2])
+        cross = (v2[0] - v1[0]) * (v1[1] - v0[1]) - (v2[1] - v1[1]) * (v1[0] - v0[0])
+        if cross > 0:
+            # Inner side: the offset lines meet at the miter point unless it lies too far back
+            limit = max(min(np.hypot(*(v1 - v0)), np.hypot(*(v2 - v1))) / half_width, INNER_MITER_LIMIT)
+            point = intersection(v0 + first, v1 + first, v1 + second, v2 + second)
+            if point is None:
+                outline.append(v1 + first)
+            elif np.hypot(*(point - v1)) <= half_width * limit:
+                outline.append(point)
+            else:
+                outline.extend([v1 + first, v1 + second])
+            return
+
+        if half_width - np.hypot(*(first + second)) / 2 < half_width / 1024:
+            point = intersection(v0 + first, v1 + first, v1 + second, v2 + second)
+            outline.append(v1 + first if point is None else point)
+            return
+
+        start, end = np.arctan2(first[1], first[0]), np.arctan2(second[1], second[0])
+        if start > end:
+            end += 2 * np.pi
+        count = int((end - start) / arc_step)
+        angles = start + (end - start) / (count + 1) * np.arange(1, count + 1)
+        outline.append(v1 + first)
+        outline.extend(v1 + half_width * np.column_stack([np.cos(angles), np.sin(angles)]))
+        outline.append(v1 + second)
+
+    cap(points[0], points[1])
+    for i in range(1, len(points) - 1):
+        join(points[i - 1], points[i], points[i + 1])
+    cap(points[-1], points[-2])
+    for i in range(len(points) - 2, 0, -1):
+        join(points[i + 1], points[i], points[i - 1])
+
+    return np.array(outline)
+
+
+def _coverage(outline: np.ndarray, width: int, height: int) -> np.ndarray:
+    # Exact area coverage of every pixel with the non-zero rule, on Agg's 1/256 subpixel grid:
+    # each edge is cut at the pixel borders, every piece adds its signed area to the cells it crosses,
+    # and a running sum along the rows turns the cell contributions into coverage
+    outline = np.round(outline * 256) / 256
+    x0, y0 = outline.T
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+
+    edges = np.arange(len(x0))
+    cuts, owners = [np.zeros(len(x0)), np.ones(len(x0))], [edges, edges]
+    for start, end in ((x0, x1), (y0, y1)):
+        first = np.floor(np.minimum(start, end)) + 1
+        count = np.maximum(0, np.ceil(np.maximum(start, end)) - first).astype(int)
+        owner = np.repeat(edges, count)
+        border = first[owner] + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        cuts.append((border - start[owner]) / (end[owner] - start[owner]))
+        owners.append(owner)
+
+    t, owner = np.concatenate(cuts), np.concatenate(owners)
+    order = np.lexsort((t, owner))
+    t, owner = t[order], owner[order]
+    same = owner[1:] == owner[:-1]
+    ta, tb, owner = t[:-1][same], t[1:][same], owner[:-1][same]
+
+    dx, dy = x1[owner] - x0[owner], y1[owner] - y0[owner]
+    mid_x = x0[owner] + (ta + tb) / 2 * dx
+    mid_y = y0[owner] + (ta + tb) / 2 * dy
+    col, row = np.floor(mid_x).astype(int), np.floor(mid_y).astype(int)
+    inside = (row >= 0) & (row < height)
+    col, row, mid_x = np.clip(col[inside], -1, width), row[inside], mid_x[inside]
+    piece = ((tb - ta) * dy)[inside]
+    fraction = np.clip(mid_x - col, 0, 1)
+
+    cells = np.zeros((height, width + 3))
+    np.add.at(cells, (row, col + 1), piece * (1 - fraction))
+    np.add.at(cells, (row, col + 2), piece * fraction)
+
+    return np.minimum(np.abs(np.cumsum(cells, axis=1)[:, 1:width + 1]), 1)
+
+
+# Pixel colour for every alpha, Agg's integer blend of LINE_COLOR over white
+_ALPHA = np.arange(256)[:, None]
+_BLEND = np.where(LINE_COLOR == 255, 255, 65025 * (256 - _ALPHA) // (65280 + _ALPHA)).astype(np.uint8)
+
+
+def render_footprint(vector: list) -> np.ndarray:
+    # Matplotlib simplifies long paths before drawing, that is left to the Agg renderer
+    if len(vector) >= SIMPLIFY_MIN_VERTICES:
+        return render_footprint_agg(vector)
+
+    points = _to_pixels(vector)
+    if len(points) < 2:
+        return render_footprint_agg(vector)
+
+    # Only the pixels around the outline are rasterized, the rest of the figure stays white
+    width, height = FIGURE_SIZE
+    outline = _stroke_outline(points, LINE_WIDTH / 2)
+    left, top = np.clip(np.floor(outline.min(axis=0)).astype(int) - 1, 0, [width, height])
+    right, bottom = np.clip(np.ceil(outline.max(axis=0)).astype(int) + 1, 0, [width, height])
+    coverage = _coverage(outline - [left, top], right - left, bottom - top)
+
+    # Alpha as Agg computes it from the cell area, then the line colour blended over the white background
+    alpha = np.zeros((height, width), dtype=np.uint8)
+    alpha[top:bottom, left:right] = np.minimum(np.ceil(coverage * 256 - 1e-9), 255)
+
+    return np.take(_BLEND, alpha, axis=0)
+
+
+def render_footprint_agg(vector: list) -> np.ndarray:
+    # Reference renderer: the same figure pyplot used to save, drawn on an Agg canvas in memory
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    x_scaled, y_scaled = normalize_footprint(vector)
+
+    figure = Figure()
+    canvas = FigureCanvasAgg(figure)
+    ax = figure.gca()
+    ax.axis('off')
+    ax.plot(x_scaled, y_scaled, linestyle='-', color='b')
+    canvas.draw()
+
+    return np.asarray(canvas.buffer_rgba())[..., :3].copy()
+
+
+@traced('embedding.render')
+def footprint_tensor(vector: list, renderer: str = DEFAULT_RENDERER) -> np.ndarray:
+    if renderer == 'agg':
+        image = render_footprint_agg(vector)
+    else:
+        image = render_footprint(vector)
+
+    return preprocess_image(Image.fromarray(image))
+
+
+def vec_to_features(vector: list, onnx_session: 'ort.InferenceSession', renderer: str = DEFAULT_RENDERER):
+
+    raw_features = run_onnx(footprint_tensor(vector, renderer=renderer), onnx_session)
+    feature_scipy = np.array(raw_features).flatten()
 
-    return feature_scipy
\ No newline at end of file
+    return feature_scipy
@@ -0,0 +1,535 @@
+import os
+import csv
+import json
+import time
+import zipfile
+import argparse
+import multiprocessing
+import numpy as np
+from io import BytesIO
+from pathlib import Path
+from itertools import repeat
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from shapely import Polygon
+from shapely.affinity import translate
+
+from src.geometry import Ring
+from src.normalization import normalize_vector
+from src.polygon_placing import add_holes
+from src.resources import VECTOR_INDEX_PATH, get_onnx_session, get_vector_index, get_footprint_catalog
+from src.stage_cache import STAGE_VERSIONS, stage_cache, file_digest, cache_key
+from src.tracing import traced, annotate
+from src.variants import PLACEMENT_START_METHOD, place_variants, pack_variants, select_alternative
+
+
+# Number of nearest catalog footprints offered as building variants
+KNN_VARIANTS = 3
+
+
+def index_version() -> tuple:
+    # Opening the index first converts a deployment that only has the legacy kd_vectors.pkl.
+    # Rebuilding or appending to the index rewrites meta.json last, which changes the row count or its mtime
+    index = get_vector_index()
+    stat = (VECTOR_INDEX_PATH / 'meta.json').stat()
+    return (len(index), stat.st_mtime_ns)
+
+
+def site_key(bound_file_path) -> str:
+    return cache_key('site', file_digest(bound_file_path))
+
+
+@traced('pipeline.load_site')
+def load_site(bound_file_path) -> dict:
+    return stage_cache.get_or_compute('site', site_key(bound_file_path), lambda: _load_site(bound_file_path))
+
+
+def _load_site(bound_file_path) -> dict:
+    from src.dxf_reader import extract_red_lines
+
+    # Extracting the boundaries of the site
+    red_line_data = extract_red_lines(bound_file_path)
+
+    # Extracting the internal bounding polygons, if there are any.
+    test_holes = add_holes(red_line_data)
+
+    if test_holes[0] == 0:
+        raise ValueError('No bounds found (Не смог найти границы участка в файле).')
+
+    elif test_holes[0] == 1:
+        interm_polygon = test_holes[1]
+        main_area_coords = list(interm_polygon.exterior.coords)
+
+    elif test_holes[0] == 2:
+        main_area_coords = list(test_holes[1][0].exterior.coords)
+        holes_coords = []
+
+        for entity in test_holes[2]:
+            holes_coords.append(list(entity[0].exterior.coords))
+            interm_polygon = Polygon(shell=main_area_coords, holes=holes_coords)
+
+    area_coords_x = np.array(main_area_coords)[:, 0]
+    area_coords_y = np.array(main_area_coords)[:, 1]
+
+    moved_area_coords_x, area_delta_x = normalize_vector(area_coords_x)
+    moved_area_coords_y, area_delta_y = normalize_vector(area_coords_y)
+
+    area_polygon_custom = translate(interm_polygon, area_delta_x, area_delta_y)
+    x_holes = None
+    y_holes = None
+    if test_holes[0] == 2:
+        for hole in area_polygon_custom.interiors:
+            hole_x, hole_y = hole.xy
+            x_holes = list(hole_x)
+            y_holes = list(hole_y)
+
+    return {
+        'area_polygon': area_polygon_custom,
+        'area_coords_x': moved_area_coords_x,
+        'area_coords_y': moved_area_coords_y,
+        'x_holes': x_holes,
+        'y_holes': y_holes,
+        'area_delta': (area_delta_x, area_delta_y),
+    }
+
+
+def heights_key(elevation_baseline_file_path) -> str:
+    from src.dxf_reader import HEIGHT_MARKER_TOLERANCE
+
+    # The TIN and terrain keys are built from this one, so a new heights version reaches them as well
+    return cache_key('heights', file_digest(elevation_baseline_file_path), 'markers', HEIGHT_MARKER_TOLERANCE,
+                     STAGE_VERSIONS['heights'])
+
+
+@traced('pipeline.load_heights')
+def load_heights(elevation_baseline_file_path) -> dict:
+    from src.dxf_reader import get_heights_data
+
+    key = heights_key(elevation_baseline_file_path)
+    return stage_cache.get_or_compute('heights', key, lambda: get_heights_data(elevation_baseline_file_path))
+
+
+def ground_coordinates(site: dict, heights: dict) -> list:
+    # Survey points moved into the same local system as the site
+    area_delta_x, area_delta_y = site['area_delta']
+    heights_coords_x = np.array(heights['coords'])[:, 0] + area_delta_x
+    heights_coords_y = np.array(heights['coords'])[:, 1] + area_delta_y
+
+    return np.array(list(zip(heights_coords_x, heights_coords_y, heights['heights']))).reshape(-1, 3).tolist()
+
+
+@traced('pipeline.survey_tin')
+def survey_tin(elevation_baseline_file_path) -> dict:
+    from src.terrain import build_tin
+
+    # Full TIN of the survey in its own coordinates, built once per survey file
+    def compute():
+        heights = load_heights(elevation_baseline_file_path)
+        return build_tin(np.column_stack([np.array(heights['coords']).reshape(-1, 2), heights['heights']]))
+
+    key = cache_key('tin', heights_key(elevation_baseline_file_path))
+    tin = stage_cache.get_or_compute('tin', key, compute)
+    annotate(points=len(tin['vertices']), triangles=len(tin['triangles']))
+    return tin
+
+
+def terrain_key(bound_file_path, elevation_baseline_file_path) -> str:
+    from src.terrain import TERRAIN_BUFFER, TERRAIN_MAX_TRIANGLES, TERRAIN_TOLERANCE
+
+    return cache_key('terrain', file_digest(bound_file_path), heights_key(elevation_baseline_file_path),
+                     TERRAIN_BUFFER, TERRAIN_MAX_TRIANGLES, TERRAIN_TOLERANCE)
+
+
+@traced('pipeline.site_terrain')
+def site_terrain(bound_file_path, elevation_baseline_file_path) -> dict:
+    from src.terrain import clip_tin, decimate_tin, TERRAIN_BUFFER, TERRAIN_MAX_TRIANGLES, TERRAIN_TOLERANCE
+
+    # Survey TIN moved into the local system of the site, clipped around it and decimated
+    def compute():
+        site = load_site(bound_file_path)
+        tin = survey_tin(elevation_baseline_file_path)
+        vertices = tin['vertices'] + np.array([*site['area_delta'], 0.0])
+        tin = clip_tin({'vertices': vertices, 'triangles': tin['triangles']}, site['area_polygon'], TERRAIN_BUFFER)
+        return decimate_tin(tin, TERRAIN_MAX_TRIANGLES, TERRAIN_TOLERANCE)
+
+    terrain = stage_cache.get_or_compute('terrain', terrain_key(bound_file_path, elevation_baseline_file_path), compute)
+    annotate(triangles=len(terrain['triangles']))
+    return terrain
+
+
+def building_base_height(bound_file_path, elevation_baseline_file_path, placement: dict) -> float:
+    from src.terrain import terrain_elevation
+
+    # Lowest terrain point under the building outline
+    xy = np.column_stack([placement['coords_x'], placement['coords_y']])
+    return float(terrain_elevation(site_terrain(bound_file_path, elevation_baseline_file_path), xy).min())
+
+
+def building_footprint(model_path) -> list:
+    from src.ifc_plan_extracting import get_building_polygon
+
+    # Extracting the building polygon from the loaded IFC model, persisted by get_building_polygon itself
+    return get_building_polygon(model_path)
+
+
+@traced('pipeline.footprint_embedding')
+def footprint_embedding(model_path) -> np.ndarray:
+    from src.picture_processing import vec_to_features, DEFAULT_RENDERER
+
+    key = cache_key('embedding', file_digest(model_path), DEFAULT_RENDERER)
+    return stage_cache.get_or_compute('embedding', key, lambda: vec_to_features(vector=building_footprint(model_path),
+                                                                                 onnx_session=get_onnx_session()))
+
+
+@traced('pipeline.find_building_variants')
+def find_building_variants(model_path, k: int = KNN_VARIANTS) -> tuple:
+    def compute():
+        k_nearest_indices = get_vector_index().query(footprint_embedding(model_path), k=k)[1]
+
+        xy_coords = get_footprint_catalog()
+        return tuple((int(idx), xy_coords[idx][1].tolist(), xy_coords[idx][0].tolist()) for idx in k_nearest_indices)
+
+    key = cache_key('knn', file_digest(model_path), index_version(), k)
+    annotate(k=k)
+    return stage_cache.get_or_compute('knn', key, compute)
+
+
+def obstacles_key(bound_file_path, elevation_baseline_file_path) -> str:
+    from src.dxf_reader import COLUMNS_VERSION
+    from src.obstacles import OBSTACLE_LAYERS, OBSTACLE_OPEN_LAYERS, OBSTACLE_COLORS, OBSTACLE_SETBACK
+
+    return cache_key('obstacles', site_key(bound_file_path), file_digest(elevation_baseline_file_path), COLUMNS_VERSION,
+                     OBSTACLE_LAYERS, OBSTACLE_OPEN_LAYERS, OBSTACLE_COLORS, OBSTACLE_SETBACK)
+
+
+@traced('pipeline.site_obstacles')
+def site_obstacles(bound_file_path, elevation_baseline_file_path):
+    # Existing structures of the survey, buffered and moved into the local system of the site
+    def compute():
+        from src.dxf_reader import load_columns
+        from src.obstacles import build_obstacles
+
+        area_delta_x, area_delta_y = load_site(bound_file_path)['area_delta']
+        return build_obstacles(load_columns(elevation_baseline_file_path)).translate(area_delta_x, area_delta_y)
+
+    obstacles = stage_cache.get_or_compute('obstacles', obstacles_key(bound_file_path, elevation_baseline_file_path),
+                                           compute)
+    annotate(obstacles=len(obstacles))
+    return obstacles
+
+
+def placement_key(bound_file_path, model_path, building_area: float, placement_mode: str = 'first',
+                  k: int = KNN_VARIANTS, obstacles_file_path=None) -> str:
+    obstacles = obstacles_key(bound_file_path, obstacles_file_path) if obstacles_file_path else None
+    return cache_key('placement', file_digest(bound_file_path), file_digest(model_path), index_version(), k,
+                     float(building_area), placement_mode, obstacles)
+
+
+@traced('pipeline.place_building_variants')
+def place_building_variants(bound_file_path, model_path, building_area: float, placement_mode: str = 'first',
+                            k: int = KNN_VARIANTS, max_workers: int = None, obstacles_file_path=None) -> list:
+    # All k variants are scaled and placed at once, so switching the variant is a cache lookup.
+    # With obstacles_file_path (the survey DXF) the footprints also keep clear of the existing structures.
+    def compute():
+        site = load_site(bound_file_path)
+        variants = find_building_variants(model_path, k)
+        obstacles = site_obstacles(bound_file_path, obstacles_file_path) if obstacles_file_path else None
+        return place_variants(site['area_polygon'], variants, target_area=building_area, placement_mode=placement_mode,
+                              max_workers=max_workers, obstacles=obstacles)
+
+    key = placement_key(bound_file_path, model_path, building_area, placement_mode, k, obstacles_file_path)
+    placements = stage_cache.get_or_compute('placement', key, compute)
+    annotate(variants=len(placements), found=sum(bool(placement['found']) for placement in placements))
+    return placements
+
+
+@traced('pipeline.pack_building_variants')
+def pack_building_variants(bound_file_path, model_path, building_area: float, count: int, mix: bool = False,
+                           spacing: float = None, setback: float = None, k: int = KNN_VARIANTS,
+                           obstacles_file_path=None, variant: int = 0) -> list:
+    # Several buildings on one site, of one variant (0-based) or of all k variants in turn
+    from src.polygon_placing import PACKING_SPACING, PACKING_SETBACK
+
+    spacing = PACKING_SPACING if spacing is None else spacing
+    setback = PACKING_SETBACK if setback is None else setback
+
+    def compute():
+        site = load_site(bound_file_path)
+        variants = find_building_variants(model_path, k)
+        obstacles = site_obstacles(bound_file_path, obstacles_file_path) if obstacles_file_path else None
+        return pack_variants(site['area_polygon'], variants, building_area, count, mix, spacing, setback, obstacles,
+                             variant=variant)
+
+    key = cache_key('packing', file_digest(bound_file_path), file_digest(model_path), index_version(), k,
+                    float(building_area), int(count), bool(mix), int(variant), float(spacing), float(setback),
+                    obstacles_key(bound_file_path, obstacles_file_path) if obstacles_file_path else None)
+    placements = stage_cache.get_or_compute('packing', key, compute)
+    annotate(buildings=count, found=sum(bool(placement['found']) for placement in placements))
+    return placements
+
+
+def wall_coordinates(coords_x: list, coords_y: list) -> np.ndarray:
+    # (n, 2, 2) segments of the closed outline, a view over the ring array that generate_ifc iterates directly
+    return Ring.from_xy(coords_x, coords_y).edges()
+
+
+@traced('pipeline.building_ifc')
+def building_ifc(bound_file_path, elevation_baseline_file_path, model_path, placement: dict,
+                 num_floors: int, elevation_height: float) -> str:
+    # Serialized IFC of one placed variant
+    def compute():
+        from src.generate_ifc import generate_ifc
+
+        terrain = site_terrain(bound_file_path, elevation_baseline_file_path)
+
+        # IFC model generation
+        ifc_model = generate_ifc(ground_coordinates=terrain['vertices'].tolist(),
+                                 wall_coordinates=wall_coordinates(placement['coords_x'], placement['coords_y']),
+                                 num_floors=num_floors,
+                                 elevation_height=elevation_height,
+                                 ground_triangles=terrain['triangles'])
+        return ifc_model.to_string()
+
+    key = cache_key('ifc', terrain_key(bound_file_path, elevation_baseline_file_path),
+                    tuple(placement['coords_x']), tuple(placement['coords_y']), int(num_floors), float(elevation_height))
+    ifc_string = stage_cache.get_or_compute('ifc', key, compute)
+    # Every entity instance starts a line with its #id
+    annotate(floors=num_floors, entities=ifc_string.count('\n#'), bytes=len(ifc_string))
+    return ifc_string
+
+
+@traced('pipeline.site_ifc')
+def site_ifc(bound_file_path, elevation_baseline_file_path, placements: list, num_floors: int,
+             elevation_height: float) -> str:
+    # Serialized IFC with one IfcBuilding for every placed footprint
+    placements = [placement for placement in placements if placement['found']]
+    if not placements:
+        raise ValueError('No building could be placed (Не удалось разместить ни одного здания).')
+
+    def compute():
+        from src.generate_ifc import generate_ifc
+
+        terrain = site_terrain(bound_file_path, elevation_baseline_file_path)
+        return generate_ifc(ground_coordinates=terrain['vertices'].tolist(),
+                            wall_coordinates=[wall_coordinates(placement['coords_x'], placement['coords_y'])
+                                              for placement in placements],
+                            num_floors=num_floors,
+                            elevation_height=elevation_height,
+                            ground_triangles=terrain['triangles']).to_string()
+
+    key = cache_key('ifc', terrain_key(bound_file_path, elevation_baseline_file_path),
+                    tuple((tuple(placement['coords_x']), tuple(placement['coords_y'])) for placement in placements),
+                    int(num_floors), float(elevation_height))
+    ifc_string = stage_cache.get_or_compute('ifc', key, compute)
+    annotate(buildings=len(placements), entities=ifc_string.count('\n#'), bytes=len(ifc_string))
+    return ifc_string
+
+
+def ifc_archive(ifc_string: str, name: str = 'generated_model.ifc') -> bytes:
+    # ifcZIP is a deflated zip archive with the single IFC file inside
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(name, ifc_string)
+    return buffer.getvalue()
+
+
+@traced('pipeline.plan_image')
+def plan_image(bound_file_path, placement: dict, image_format: str = 'png', dpi: int = None,
+               preview: bool = False) -> bytes:
+    # Encoded plan of one placed variant
+    def compute():
+        from src.plan_view import render_plan
+
+        return render_plan(load_site(bound_file_path), [placement], image_format, dpi=dpi, preview=preview)
+
+    key = cache_key('plan', file_digest(bound_file_path), tuple(placement['coords_x']), tuple(placement['coords_y']),
+                    image_format, dpi, preview)
+    image = stage_cache.get_or_compute('plan', key, compute)
+    annotate(format=image_format, preview=preview, bytes=len(image))
+    return image
+
+
+@traced('pipeline.site_plan_image')
+def site_plan_image(bound_file_path, placements: list, image_format: str = 'png', dpi: int = None,
+                    preview: bool = False) -> bytes:
+    # Encoded plan with every placed footprint, the counterpart of site_ifc
+    placements = [placement for placement in placements if placement['found']]
+
+    def compute():
+        from src.plan_view import render_plan
+
+        return render_plan(load_site(bound_file_path), placements, image_format, dpi=dpi, preview=preview)
+
+    key = cache_key('plan', file_digest(bound_file_path),
+                    tuple((tuple(placement['coords_x']), tuple(placement['coords_y'])) for placement in placements),
+                    image_format, dpi, preview)
+    image = stage_cache.get_or_compute('plan', key, compute)
+    annotate(buildings=len(placements), format=image_format, bytes=len(image))
+    return image
+
+
+# Batch mode: python -m src.pipeline manifest.csv -o out/
+MANIFEST_DEFAULTS = {'floors': 3, 'storey_height': 3.0, 'variant': 1, 'placement_mode': 'first', 'option': 1,
+                     'avoid_obstacles': False, 'buildings': 1}
+RESULT_COLUMNS = ['name', 'status', 'site', 'survey', 'model', 'area', 'floors', 'storey_height', 'variant',
+                  'placement_mode', 'option', 'avoid_obstacles', 'buildings', 'catalog_index', 'placed', 'placed_area', 'max_area',
+                  'ifc', 'plan', 'seconds', 'error']
+
+
+def read_manifest(manifest_path) -> list:
+    # CSV with a header or a JSON list of objects; site, survey and model paths are relative to the manifest
+    manifest_path = Path(manifest_path)
+    if manifest_path.suffix.lower() == '.json':
+        with open(manifest_path, encoding='utf-8') as file:
+            rows = json.load(file)
+    else:
+        with open(manifest_path, newline='', encoding='utf-8-sig') as file:
+            rows = list(csv.DictReader(file))
+
+    jobs = []
+    for number, row in enumerate(rows, start=1):
+        row = {key: value for key, value in row.items() if value not in (None, '')}
+        missing = {'site', 'survey', 'model', 'area'} - row.keys()
+        if missing:
+            raise ValueError(f'Manifest row {number} has no {", ".join(sorted(missing))}')
+
+        job = {**MANIFEST_DEFAULTS, **row}
+        jobs.append({
+            'name': str(job.get('name') or f'job_{number:04d}'),
+            'site': manifest_path.parent / job['site'],
+            'survey': manifest_path.parent / job['survey'],
+            'model': manifest_path.parent / job['model'],
+            'area': float(job['area']),
+            'floors': int(job['floors']),
+            'storey_height': float(job['storey_height']),
+            'variant': int(job['variant']),
+            'placement_mode': job['placement_mode'],
+            'option': int(job['option']),
+            'avoid_obstacles': str(job['avoid_obstacles']).lower() in ('1', 'true', 'yes'),
+            'buildings': int(job['buildings']),
+        })
+    return jobs
+
+
+def prepare_jobs(jobs: list) -> list:
+    # Sites, terrains and placements are computed once in this process for every distinct input,
+    # the workers get them through their cache and only generate the IFC and the plan
+    from src.polygon_placing import max_building_area
+
+    seeds = {}
+    for job in jobs:
+        try:
+            site, survey = job['site'], job['survey']
+            seeds[('site', site_key(site))] = load_site(site)
+            seeds[('terrain', terrain_key(site, survey))] = site_terrain(site, survey)
+
+            obstacles_file_path = survey if job['avoid_obstacles'] else None
+            if not 1 <= job['variant'] <= KNN_VARIANTS:
+                raise ValueError(f"Variant {job['variant']} is out of 1..{KNN_VARIANTS}")
+            if job['buildings'] > 1:
+                # Several copies of the variant packed on the site, the first one is placed on the empty site
+                packed = pack_building_variants(site, job['model'], job['area'], job['buildings'],
+                                                obstacles_file_path=obstacles_file_path, variant=job['variant'] - 1)
+                placement = packed[0]
+                job['packed'] = packed
+            else:
+                placements = place_building_variants(site, job['model'], job['area'], job['placement_mode'],
+                                                     obstacles_file_path=obstacles_file_path)
+                placement = placements[job['variant'] - 1]
+                if placement['found']:
+                    placement = select_alternative(placement, job['option'])
+            job.update({'catalog_index': placement['index'], 'placement': placement})
+            placed = sum(item['found'] for item in job.get('packed', [placement]))
+            if placed < job['buildings']:
+                # Same constraints as the placement: mode, obstacles and, for packing, the number of buildings
+                obstacles = site_obstacles(site, survey) if obstacles_file_path else None
+                job['max_area'] = max_building_area(load_site(site)['area_polygon'], placement['object_x'],
+                                                    placement['object_y'], obstacles=obstacles,
+                                                    placement_mode=job['placement_mode'], count=job['buildings'],
+                                                    below=job['area'])[0]
+        except Exception as e:
+            job['error'] = f'{type(e).__name__}: {e}'
+    return [(stage, key, value) for (stage, key), value in seeds.items()]
+
+
+def _init_batch_worker(seeds: list):
+    stage_cache.preload(seeds)
+
+
+def run_job(job: dict, output_dir, plan_format: str = 'png', zipped: bool = False) -> dict:
+    result = {column: job.get(column) for column in RESULT_COLUMNS}
+    placement = job.get('placement')
+    if job.get('error'):
+        return {**result, 'status': 'error'}
+    if not placement['found']:
+        return {**result, 'status': 'not placed'}
+
+    start = time.perf_counter()
+    output_dir = Path(output_dir)
+    placed = [item for item in job.get('packed', [placement]) if item['found']]
+    try:
+        if 'packed' in job:
+            ifc_string = site_ifc(job['site'], job['survey'], placed, num_floors=job['floors'],
+                                  elevation_height=job['storey_height'])
+        else:
+            ifc_string = building_ifc(job['site'], job['survey'], job['model'], placement,
+                                      num_floors=job['floors'], elevation_height=job['storey_height'])
+        if zipped:
+            ifc_path = output_dir / f"{job['name']}.ifczip"
+            ifc_path.write_bytes(ifc_archive(ifc_string, f"{job['name']}.ifc"))
+        else:
+            ifc_path = output_dir / f"{job['name']}.ifc"
+            ifc_path.write_text(ifc_string, encoding='utf-8')
+
+        plan_path = output_dir / f"{job['name']}.{plan_format}"
+        plan_path.write_bytes(site_plan_image(job['site'], placed, image_format=plan_format) if 'packed' in job
+                              else plan_image(job['site'], placement, image_format=plan_format))
+    except Exception as e:
+        return {**result, 'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+
+    return {**result, 'status': 'ok' if len(placed) == job['buildings'] else 'partial', 'placed': len(placed), 'placed_area': sum(item['area'] for item in placed),
+            'ifc': ifc_path.name, 'plan': plan_path.name, 'seconds': round(time.perf_counter() - start, 3)}
+
+
+def run_batch(jobs: list, output_dir, workers: int = None, plan_format: str = 'png', zipped: bool = False) -> list:
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    seeds = prepare_jobs(jobs)
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        results = [run_job(job, output_dir, plan_format, zipped) for job in jobs]
+    else:
+        # prepare_jobs may have started the placement pool and its threads, so this pool is not forked either
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(seeds,),
+                                 mp_context=multiprocessing.get_context(PLACEMENT_START_METHOD)) as executor:
+            results = list(executor.map(run_job, jobs, repeat(output_dir), repeat(plan_format), repeat(zipped)))
+
+    with open(output_dir / 'results.csv', 'w', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate IFC models and plans for a manifest of jobs')
+    parser.add_argument('manifest', help='CSV or JSON with site, survey, model, area and optionally name, floors, '
+                                         'storey_height, variant (1..k), placement_mode (first or clearance), '
+                                         'avoid_obstacles (1 or true to keep clear of structures in the survey), '
+                                         'buildings (copies of the variant packed on the site)')
+    parser.add_argument('--output', '-o', default='output', help='directory for the IFC files, plans and results.csv')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, one per core by default')
+    parser.add_argument('--plan-format', default='png', help='plan image format: png, svg, pdf, jpg')
+    parser.add_argument('--zip', action='store_true', help='write ifcZIP archives instead of plain IFC files')
+    args = parser.parse_args()
+
+    jobs = read_manifest(args.manifest)
+    results = run_batch(jobs, args.output, workers=args.workers, plan_format=args.plan_format, zipped=args.zip)
+
+    statuses = Counter(result['status'] for result in results)
+    print(f"{len(results)} jobs: " + ', '.join(f'{count} {status}' for status, count in sorted(statuses.items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import os
+from io import BytesIO
+
+
+# Plan image size in inches and resolution; the preview drops markers, grid and labels and is drawn at a low dpi
+PLAN_SIZE = (6.4, 4.8)
+PLAN_DPI = int(os.environ.get('PLAN_DPI', 100))
+PREVIEW_DPI = int(os.environ.get('PLAN_PREVIEW_DPI', 40))
+
+
+def render_plan(site: dict, placements: list, image_format: str = 'png', dpi: int = None, preview: bool = False) -> bytes:
+    # Plan of the site and the placed buildings, encoded straight into memory.
+    # Every call draws on its own Agg canvas, nothing is registered in pyplot, so the figure is freed
+    # with the last reference and calls from several threads do not share state.
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    dpi = dpi or (PREVIEW_DPI if preview else PLAN_DPI)
+
+    figure = Figure(figsize=PLAN_SIZE, dpi=dpi)
+    canvas = FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+
+    for placement in placements:
+        ax.plot(placement['coords_x'], placement['coords_y'], linestyle='-', color='b')
+    ax.plot(site['area_coords_x'], site['area_coords_y'], linestyle='-', marker=None if preview else 'o')
+    if site['x_holes'] is not None:
+        ax.plot(site['x_holes'], site['y_holes'], linestyle='-', color='r')
+    ax.set_aspect('equal')
+    if preview:
+        ax.axis('off')
+    else:
+        ax.set_xlabel('X')
+        ax.set_ylabel('Y')
+        ax.grid(True)
+
+    buffer = BytesIO()
+    canvas.print_figure(buffer, format=image_format, dpi=dpi)
+    return buffer.getvalue()
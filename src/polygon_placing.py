@@ -1,6 +1,34 @@
 import math
 import numpy as np
+import shapely
 from shapely import Polygon
+from typing import NamedTuple, List, Dict, TYPE_CHECKING
+
+from src.geometry import Ring
+from src.tracing import traced, annotate
+
+if TYPE_CHECKING:
+    from src.obstacles import ObstacleIndex
+
+
+# Search space of the placement: spiral points around the site centroid times rotation angles
+SPIRAL_POINTS = 500
+SPIRAL_TURNS = 10
+ANGLE_STEP = 1.0
+# Number of spiral points whose transforms are tested in one vectorized batch
+BATCH_POINTS = 25
+
+# Clearance-map placement: raster resolution (cells along the longer site side), orientation step
+# and number of ranked placements returned, the best one included
+CLEARANCE_GRID_SIZE = 128
+CLEARANCE_ANGLE_STEP = 5.0
+CLEARANCE_ALTERNATIVES = 5
+
+# Packing of several buildings: distance from the red lines and between buildings (site units);
+# candidate positions are a grid with a step of the footprint size divided by PACKING_GRID_DIVISIONS
+PACKING_SETBACK = 3.0
+PACKING_SPACING = 6.0
+PACKING_GRID_DIVISIONS = 8
 
 
 def rotatePolygon(polygon, theta, center=(0, 0)):
@@ -17,70 +45,416 @@ def rotatePolygon(polygon, theta, center=(0, 0)):
     return rotatedPolygon
 
 
-def place_polygon(area_polygon: Polygon, object_polygon: Polygon):
+class PreparedSite(NamedTuple):
+    polygon: Polygon
+    center: np.ndarray
+    spiral_x: np.ndarray
+    spiral_y: np.ndarray
+    cos: np.ndarray
+    sin: np.ndarray
+
+
+def prepare_site(area_polygon: Polygon, num_points: int = SPIRAL_POINTS, num_turns: int = SPIRAL_TURNS,
+                 angle_step: float = ANGLE_STEP) -> PreparedSite:
+    # Everything here depends only on the site, so it can be reused for any number of footprints
+    shapely.prepare(area_polygon)
+
     area_center = area_polygon.centroid
-    area_center_x = area_center.x
-    area_center_y = area_center.y
-    area_x_array = list(area_polygon.exterior.coords.xy[0])
-    area_y_array = list(area_polygon.exterior.coords.xy[1])
+    center = np.array([area_center.x, area_center.y])
 
-    object_center = object_polygon.centroid
-    object_center_x = object_center.x
-    object_center_y = object_center.y
-    object_x_array = list(object_polygon.exterior.coords.xy[0])
-    object_y_array = list(object_polygon.exterior.coords.xy[1])
+    area_x_array = np.asarray(area_polygon.exterior.coords.xy[0])
+    interval = area_x_array.max() - area_x_array.min()
+    spiral_theta = np.linspace(0, 2.*np.pi*num_turns, num_points)
+    r = np.sqrt(1.0 + interval*spiral_theta)
+    spiral_x = r * np.cos(spiral_theta) + center[0]
+    spiral_y = r * np.sin(spiral_theta) + center[1]
 
-    d_vector = np.array([area_center_x, area_center_y]) - np.array([object_center_x, object_center_y])
-    object_shifted = np.array(list(zip(object_x_array, object_y_array))) + d_vector
-    object_shifted_x, object_shifted_y = list(object_shifted[:, 0]), list(object_shifted[:, 1])
+    # Rotation angles in the order of the original search: 1, 2, ..., 360 degrees
+    angles = np.radians(np.arange(1, int(round(360 / angle_step)) + 1) * angle_step)
 
-    if area_polygon.contains(Polygon(list(zip(object_shifted_x, object_shifted_y)))):
-        # print('From the first pass')
+    return PreparedSite(area_polygon, center, spiral_x, spiral_y, np.cos(angles), np.sin(angles))
 
-        return (True, object_shifted_x, object_shifted_y)
-    
-    else:
-        interval = max(area_polygon.exterior.coords.xy[0]) - min(area_polygon.exterior.coords.xy[0])
-        num_points = 500
-        num_turns = 10
-        spiral_theta = np.linspace(0, 2.*np.pi*num_turns, num_points)
-        r = np.sqrt(1.0 + interval*spiral_theta)
-
-        spiral_x, spiral_y = area_center_x, area_center_y
-        x_spiral_points = r * np.cos(spiral_theta) + spiral_x
-        y_spiral_points = r * np.sin(spiral_theta) + spiral_y
-
-        solution_found = False
-        solution_x = None
-        solution_y = None
-
-        for i in range(num_points):
-            # print(f'Try for the point {i}')
-            if solution_found == True:
+
+def _first_contained(site: PreparedSite, candidates_x: np.ndarray, candidates_y: np.ndarray,
+                     obstacles: 'ObstacleIndex' = None):
+    # Cheap vertex test first: a contained polygon must have all of its vertices in the site
+    vertices_inside = shapely.intersects_xy(site.polygon, candidates_x, candidates_y).all(axis=1)
+    survivors = np.flatnonzero(vertices_inside)
+    if survivors.size == 0:
+        return None
+
+    polygons = shapely.polygons(np.stack((candidates_x[survivors], candidates_y[survivors]), axis=-1))
+    contained = np.flatnonzero(shapely.contains(site.polygon, polygons))
+    if obstacles is not None and contained.size:
+        contained = contained[~obstacles.blocked(polygons[contained])]
+    if contained.size == 0:
+        return None
+    return survivors[contained[0]]
+
+
+@traced('placement.search')
+def find_placement(site: PreparedSite, object_ring: Ring, batch_points: int = BATCH_POINTS,
+                   obstacles: 'ObstacleIndex' = None):
+    # obstacles: optional index of existing structures the footprint must not touch
+    object_xy = object_ring.coords
+    object_shifted = object_xy + (site.center - object_ring.centroid)
+
+    centered = shapely.polygons(object_shifted)
+    if site.polygon.contains(centered) and (obstacles is None or not obstacles.blocked([centered])[0]):
+        annotate(spiral_points=0, found=True)
+        return (True, object_shifted[:, 0].tolist(), object_shifted[:, 1].tolist())
+
+    num_points = len(site.spiral_x)
+    pivots = np.column_stack((site.spiral_x, site.spiral_y))
+    cos = site.cos[None, :, None]
+    sin = site.sin[None, :, None]
+
+    # Candidates are checked in growing batches of spiral points, so the first hit in the original
+    # (point, angle) order is returned without building every transform up front
+    start, batch_size = 0, 1
+    while start < num_points:
+        batch_pivots = pivots[start:start + batch_size]
+        start += batch_size
+        batch_size = min(2 * batch_size, batch_points)
+
+        # The footprint is moved by (center - pivot) and then rotated around the pivot
+        relative = object_shifted[None, :, :] + (site.center - 2 * batch_pivots)[:, None, :]
+        rel_x = relative[:, None, :, 0]
+        rel_y = relative[:, None, :, 1]
+        rotated_x = cos * rel_x - sin * rel_y + batch_pivots[:, None, None, 0]
+        rotated_y = sin * rel_x + cos * rel_y + batch_pivots[:, None, None, 1]
+
+        num_vertices = object_xy.shape[0]
+        rotated_x = rotated_x.reshape(-1, num_vertices)
+        rotated_y = rotated_y.reshape(-1, num_vertices)
+
+        hit = _first_contained(site, rotated_x, rotated_y, obstacles)
+        if hit is not None:
+            annotate(spiral_points=min(start, num_points), found=True)
+            return (True, rotated_x[hit].tolist(), rotated_y[hit].tolist())
+
+    annotate(spiral_points=num_points, found=False)
+    return (False, None, None)
+
+
+def place_polygon(area_polygon: Polygon, object_ring: Ring, obstacles: 'ObstacleIndex' = None):
+    site = prepare_site(area_polygon)
+    return find_placement(site, object_ring, obstacles=obstacles)
+
+
+def max_building_area(area_polygon: Polygon, x_array, y_array, rel_tol: float = 0.01, max_iterations: int = 30,
+                      obstacles: 'ObstacleIndex' = None, placement_mode: str = 'first', count: int = 1,
+                      spacing: float = PACKING_SPACING, setback: float = PACKING_SETBACK, below: float = None):
+    # Bisection over the scale coefficient of scaling_object, every step placed the way placement_mode places
+    # the building, so the answer is an area that mode can actually place. With count > 1 it is the area of each
+    # of count copies that pack_polygons places all together with the given spacing and setback. Greedy packing
+    # is not monotonic in the area, below (the area that failed) keeps the answer under it.
+    # For first-fit the prepared site and the candidate transforms are built once and shared by every iteration
+    site = prepare_site(area_polygon)
+    object_ring = Ring.from_xy(x_array, y_array)
+    original_area = object_ring.area
+
+    def try_scale(scale_coeff):
+        if count > 1:
+            packed = pack_polygons(area_polygon, [object_ring.copy().scale(scale_coeff)] * count, spacing=spacing,
+                                   setback=setback, obstacles=obstacles)
+            return (all(found for found, _, _ in packed), packed[0][1], packed[0][2])
+        if placement_mode == 'clearance':
+            return place_polygon_by_clearance(area_polygon, object_ring.copy().scale(scale_coeff), num_alternatives=1,
+                                              obstacles=obstacles)
+        return find_placement(site, object_ring.copy().scale(scale_coeff), obstacles=obstacles)
+
+    # The footprints can never be larger than the site itself
+    upper = np.sqrt(site.polygon.area / count / original_area)
+    if below is not None:
+        upper = min(upper, np.sqrt(below / original_area))
+    lower = upper / 2
+    solution = try_scale(lower)
+    iteration = 1
+    while not solution[0]:
+        if iteration >= max_iterations:
+            return (0.0, 0.0, None, None)
+        upper, lower = lower, lower / 2
+        solution = try_scale(lower)
+        iteration += 1
+
+    # Area grows with the square of the scale, hence half of the relative tolerance
+    while (upper - lower) / upper > rel_tol / 2 and iteration < max_iterations:
+        middle = (upper + lower) / 2
+        attempt = try_scale(middle)
+        if attempt[0]:
+            lower, solution = middle, attempt
+        else:
+            upper = middle
+        iteration += 1
+
+    return (original_area * lower ** 2, lower, solution[1], solution[2])
+
+
+def rasterize_site(area_polygon: Polygon, cell_size: float = None, obstacles: 'ObstacleIndex' = None):
+    # scipy is only needed by the clearance mode and takes a second to import, so it is loaded here
+    from scipy import ndimage
+
+    minx, miny, maxx, maxy = area_polygon.bounds
+    if cell_size is None:
+        cell_size = max(maxx - minx, maxy - miny) / CLEARANCE_GRID_SIZE
+
+    # One empty cell around the site, so the distance transform always sees the outside
+    nx = int(np.ceil((maxx - minx) / cell_size)) + 2
+    ny = int(np.ceil((maxy - miny) / cell_size)) + 2
+    origin = np.array([minx - cell_size, miny - cell_size])
+    grid_x = origin[0] + (np.arange(nx) + 0.5) * cell_size
+    grid_y = origin[1] + (np.arange(ny) + 0.5) * cell_size
+
+    # Rows go along Y, columns along X; holes of the polygon and obstacles are outside as well
+    inside = shapely.contains_xy(area_polygon, *np.meshgrid(grid_x, grid_y))
+    if obstacles is not None and len(obstacles):
+        rows, cols = np.nonzero(inside)
+        inside[rows, cols] = ~obstacles.blocked_xy(grid_x[cols], grid_y[rows])
+    clearance = ndimage.distance_transform_edt(inside) * cell_size
+
+    return inside, clearance, origin, cell_size
+
+
+def _footprint_kernel(object_relative: Polygon, cell_size: float):
+    # Odd-sized kernel centred on the cell holding the footprint centroid
+    from scipy import ndimage
+
+    minx, miny, maxx, maxy = object_relative.bounds
+    radius = int(np.ceil(max(abs(minx), abs(miny), abs(maxx), abs(maxy)) / cell_size))
+    offsets = np.arange(-radius, radius + 1) * cell_size
+    filled = shapely.intersects_xy(object_relative, *np.meshgrid(offsets, offsets))
+    boundary = filled & ~ndimage.binary_erosion(filled)
+    return filled, boundary, radius
+
+
+def _separated(values: np.ndarray, rows: np.ndarray, cols: np.ndarray, separation: float, count: int):
+    # Non-maximum suppression: the best cells at least separation cells apart, best first
+    order = np.argsort(values)[::-1]
+    values, rows, cols = values[order], rows[order], cols[order]
+    free = np.ones(values.size, dtype=bool)
+    picked = []
+    while len(picked) < count and free.any():
+        i = int(np.argmax(free))
+        picked.append(i)
+        free[i] = False
+        free &= (rows - rows[i]) ** 2 + (cols - cols[i]) ** 2 >= separation ** 2
+    return values[picked], rows[picked], cols[picked]
+
+
+@traced('placement.clearance')
+def place_polygon_by_clearance(area_polygon: Polygon, object_ring: Ring, cell_size: float = None,
+                               angle_step: float = CLEARANCE_ANGLE_STEP, num_alternatives: int = CLEARANCE_ALTERNATIVES,
+                               min_separation: float = None, obstacles: 'ObstacleIndex' = None):
+    from scipy import signal
+
+    inside, clearance, origin, cell_size = rasterize_site(area_polygon, cell_size, obstacles)
+    outside = (~inside).astype(np.float64)
+    annotate(grid=inside.shape, angles=len(np.arange(0, 360, angle_step)))
+
+    object_relative = object_ring.copy().translate(*-object_ring.centroid)
+    if min_separation is None:
+        min_separation = np.sqrt(object_ring.area) / 2
+    keep_per_angle = 2 * num_alternatives + 2
+
+    candidates = []
+    for angle in np.arange(0, 360, angle_step):
+        rotated = object_relative.copy().rotate(angle)
+        filled, boundary, radius = _footprint_kernel(rotated.to_shapely(), cell_size)
+
+        # Feasible region: reference cells where the footprint covers no outside cell
+        outside_count = signal.fftconvolve(outside, filled[::-1, ::-1].astype(np.float64), mode='same')
+        rows, cols = np.nonzero(outside_count < 0.5)
+        keep = ((rows >= radius) & (rows < inside.shape[0] - radius)
+                & (cols >= radius) & (cols < inside.shape[1] - radius))
+        rows, cols = rows[keep], cols[keep]
+        if rows.size == 0:
+            continue
+
+        # Clearance of a placement is the distance map minimum over the footprint outline.
+        # A few outline cells give an upper bound, so the full minimum is only taken for the best cells
+        d_rows, d_cols = np.nonzero(boundary)
+        d_rows, d_cols = d_rows - radius, d_cols - radius
+        sample = np.linspace(0, d_rows.size - 1, min(d_rows.size, 8)).astype(int)
+        upper_bound = clearance[rows[:, None] + d_rows[sample], cols[:, None] + d_cols[sample]].min(axis=1)
+        order = np.argsort(upper_bound)[::-1]
+
+        # The best cells of one orientation are neighbours, so they are thinned out to separated positions
+        # here; otherwise the separation test below would leave only one of them
+        evaluated = np.empty(0, dtype=np.intp)
+        exact = np.empty(0)
+        best = (exact, rows[:0], cols[:0])
+        for start in range(0, order.size, 256):
+            chunk = order[start:start + 256]
+            if best[0].size >= keep_per_angle and upper_bound[chunk[0]] <= best[0][-1]:
                 break
-            else:
+            evaluated = np.concatenate([evaluated, chunk])
+            exact = np.concatenate([exact, clearance[rows[chunk, None] + d_rows, cols[chunk, None] + d_cols].min(axis=1)])
+            best = _separated(exact, rows[evaluated], cols[evaluated], min_separation / cell_size, keep_per_angle)
+
+        for placement_clearance, row, col in zip(*best):
+            candidates.append((placement_clearance, angle, row, col, rotated))
+
+    shapely.prepare(area_polygon)
+    candidates.sort(key=lambda item: item[0], reverse=True)
+
+    ranked = []
+    for placement_clearance, angle, row, col, rotated in candidates:
+        position = origin + (np.array([col, row]) + 0.5) * cell_size
+        if any(np.hypot(*(position - item['position'])) < min_separation for item in ranked):
+            continue
+
+        # The raster is approximate, every placement is confirmed on the exact geometry
+        placed = rotated.coords + position
+        placed_polygon = shapely.polygons(placed)
+        if not area_polygon.contains(placed_polygon):
+            continue
+        if obstacles is not None and obstacles.blocked([placed_polygon])[0]:
+            continue
+
+        # Raster clearance is measured between cell centres and overstates the real one by up to a few cells
+        placement_clearance = area_polygon.boundary.distance(placed_polygon)
+        if obstacles is not None:
+            placement_clearance = min(placement_clearance, obstacles.distance(placed_polygon))
 
-                move_vector = np.array([area_center_x, area_center_y]) - np.array([x_spiral_points[i], y_spiral_points[i]])
-                object_moved = np.array(list(zip(object_shifted_x, object_shifted_y))) + move_vector
-                object_moved_x, object_moved_y = list(object_moved[:, 0]), list(object_moved[:, 1])
-                new_position = list(zip(object_moved_x, object_moved_y))
+        ranked.append({
+            'coords_x': placed[:, 0].tolist(),
+            'coords_y': placed[:, 1].tolist(),
+            'position': position,
+            'angle': float(angle),
+            'clearance': float(placement_clearance),
+        })
+        if len(ranked) >= num_alternatives:
+            break
 
-                for _ in range(360):
+    annotate(candidates=len(candidates), found=bool(ranked))
+    if not ranked:
+        return (False, None, None, [])
+    ranked.sort(key=lambda item: item['clearance'], reverse=True)
+    return (True, ranked[0]['coords_x'], ranked[0]['coords_y'], ranked)
+
+
+def packing_angles(area_polygon: Polygon) -> np.ndarray:
+    # Along and across the sides of the minimum rotated rectangle of the site, in degrees
+    rectangle = np.asarray(shapely.minimum_rotated_rectangle(area_polygon).exterior.coords)
+    edge = rectangle[1] - rectangle[0]
+    return (np.degrees(np.arctan2(edge[1], edge[0])) + np.arange(4) * 90.0) % 360
+
+
+def _packing_positions(usable, angle: float, step: float) -> np.ndarray:
+    # Grid over the site in the frame of its main direction, row by row from the bottom left corner
+    cos, sin = np.cos(angle), np.sin(angle)
+    xy = shapely.get_coordinates(usable)
+    u = xy[:, 0] * cos + xy[:, 1] * sin
+    v = -xy[:, 0] * sin + xy[:, 1] * cos
+    grid_v, grid_u = np.meshgrid(np.arange(v.min(), v.max() + step, step), np.arange(u.min(), u.max() + step, step),
+                                 indexing='ij')
+    grid_u, grid_v = grid_u.ravel(), grid_v.ravel()
+    positions = np.column_stack((grid_u * cos - grid_v * sin, grid_u * sin + grid_v * cos))
+
+    # A footprint inside the site has its centroid inside the convex hull of the site
+    return positions[shapely.intersects_xy(usable.convex_hull, positions[:, 0], positions[:, 1])]
+
+
+def _first_free(usable, placed, spacing: float, candidates_x: np.ndarray, candidates_y: np.ndarray,
+                anchors: np.ndarray, obstacles: 'ObstacleIndex' = None):
+    vertices_inside = shapely.intersects_xy(usable, candidates_x, candidates_y).all(axis=1)
+    if placed is not None:
+        # An anchor is a point inside the footprint, near a placed building the whole footprint is too close.
+        # Point queries are much cheaper than polygon distances and reject most candidates in occupied areas
+        near = placed.query(shapely.points(anchors), predicate='dwithin', distance=spacing)[0]
+        vertices_inside[near] = False
+    survivors = np.flatnonzero(vertices_inside)
+    if survivors.size == 0:
+        return None
+
+    polygons = shapely.polygons(np.stack((candidates_x[survivors], candidates_y[survivors]), axis=-1))
+    if placed is not None:
+        # Candidates closer than the spacing to any placed building, found through the tree of placed footprints
+        free = np.ones(len(polygons), dtype=bool)
+        free[placed.query(polygons, predicate='dwithin', distance=spacing)[0]] = False
+        survivors, polygons = survivors[free], polygons[free]
+    if obstacles is not None:
+        free = ~obstacles.blocked(polygons)
+        survivors, polygons = survivors[free], polygons[free]
+
+    contained = np.flatnonzero(shapely.contains(usable, polygons))
+    if contained.size == 0:
+        return None
+    return survivors[contained[0]]
+
+
+@traced('placement.pack')
+def pack_polygons(area_polygon: Polygon, object_rings: List[Ring], spacing: float = PACKING_SPACING,
+                  setback: float = PACKING_SETBACK, angles=None, grid_step: float = None,
+                  batch_points: int = 256, obstacles: 'ObstacleIndex' = None) -> List[tuple]:
+    # Footprints are placed one after another at the first free grid position (bottom left first), at least
+    # setback from the red lines and the holes and spacing from each other. Returns (found, coords_x, coords_y)
+    # for every footprint, in the order given.
+    # A setback may split a narrow site into several parts, all of them are used
+    usable = area_polygon.buffer(-setback, join_style='mitre') if setback > 0 else area_polygon
+    if usable.is_empty:
+        return [(False, None, None)] * len(object_rings)
+    shapely.prepare(usable)
+
+    angles = np.radians(packing_angles(area_polygon) if angles is None else np.asarray(angles, dtype=np.float64))
+    cos, sin = np.cos(angles)[:, None], np.sin(angles)[:, None]
+
+    placed = []
+    tree = None
+    # Placed buildings only take space, so a footprint that did not fit will not fit later either,
+    # and the next copy of a placed footprint can resume the search where the previous one was found
+    failed = set()
+    resume = {}
+    grids = {}
+    results = []
+    for object_ring in object_rings:
+        signature = object_ring.coords.tobytes()
+        if signature in failed:
+            results.append((False, None, None))
+            continue
+
+        object_center = object_ring.centroid
+        relative = object_ring.coords - object_center
+        rotated_x = cos * relative[:, 0] - sin * relative[:, 1]
+        rotated_y = sin * relative[:, 0] + cos * relative[:, 1]
+        anchor = shapely.get_coordinates(object_ring.to_shapely().point_on_surface())[0] - object_center
+        anchors = np.column_stack((cos[:, 0] * anchor[0] - sin[:, 0] * anchor[1],
+                                   sin[:, 0] * anchor[0] + cos[:, 0] * anchor[1]))
+
+        step = grid_step or np.sqrt(object_ring.area) / PACKING_GRID_DIVISIONS
+        if step not in grids:
+            grids[step] = _packing_positions(usable, angles[0], step)
+        positions = grids[step]
+
+        # Growing batches, as in find_placement: the free position is usually close to where the search starts
+        placement = None
+        start, batch_size = resume.get(signature, 0), 8
+        while start < len(positions):
+            batch = positions[start:start + batch_size]
+            candidates_x = (batch[:, None, None, 0] + rotated_x[None]).reshape(-1, relative.shape[0])
+            candidates_y = (batch[:, None, None, 1] + rotated_y[None]).reshape(-1, relative.shape[0])
+            hit = _first_free(usable, tree, spacing, candidates_x, candidates_y,
+                              (batch[:, None, :] + anchors[None]).reshape(-1, 2), obstacles)
+            if hit is not None:
+                placement = (candidates_x[hit], candidates_y[hit])
+                resume[signature] = start + hit // len(angles)
+                break
+            start += batch_size
+            batch_size = min(2 * batch_size, batch_points)
 
-                    rotated_polygon = rotatePolygon(new_position, theta=1, center=(x_spiral_points[i], y_spiral_points[i]))
-                    rotated_x = [item[0] for item in rotated_polygon]
-                    rotated_y = [item[1] for item in rotated_polygon]
-                    rotated_object = Polygon(list(zip(rotated_x, rotated_y)))
+        if placement is None:
+            failed.add(signature)
+            results.append((False, None, None))
+            continue
 
-                    if area_polygon.contains(rotated_object):
-                        solution_found = True
-                        solution_x = rotated_x
-                        solution_y = rotated_y
-                        break
-                    else:
-                        new_position = list(zip(rotated_x, rotated_y))
+        placed.append(shapely.polygons(np.column_stack(placement)))
+        # STRtree is immutable, so it is rebuilt for every new building; collision queries stay logarithmic
+        tree = shapely.STRtree(placed)
+        results.append((True, placement[0].tolist(), placement[1].tolist()))
 
-        return (solution_found, solution_x, solution_y)
+    annotate(buildings=len(object_rings), placed=len(placed))
+    return results
 
 
 def add_holes(red_lines: list):
@@ -88,9 +462,7 @@ def add_holes(red_lines: list):
     objects = []
 
     for entity_data in red_lines:
-        coords_x = np.array(entity_data['points'])[:, 0]
-        coords_y = np.array(entity_data['points'])[:, 1]
-        polygon_to_check = Polygon(list(zip(coords_x, coords_y)))
+        polygon_to_check = Ring(np.asarray(entity_data['points'])[:, :2]).to_shapely()
         objects.append((polygon_to_check, polygon_to_check.area))
 
     if len(objects) == 0:
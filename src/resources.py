@@ -0,0 +1,102 @@
+import os
+import time
+import pickle
+import logging
+import threading
+import numpy as np
+from pathlib import Path
+
+
+MODELS_DIR = Path(__file__).parent.parent / 'models'
+ONNX_MODEL_PATH = MODELS_DIR / 'resnet50.onnx'
+XY_COORDS_PATH = MODELS_DIR / 'xy_coords.pkl'
+VECTOR_INDEX_PATH = MODELS_DIR / 'footprint_index'
+KD_VECTORS_PATH = MODELS_DIR / 'kd_vectors.pkl'
+
+# ONNX Runtime settings, 0 threads lets the runtime decide
+ONNX_INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', 0))
+ONNX_INTER_OP_THREADS = int(os.environ.get('ONNX_INTER_OP_THREADS', 0))
+# disable | basic | extended | all
+ONNX_GRAPH_OPTIMIZATION = os.environ.get('ONNX_GRAPH_OPTIMIZATION', 'all')
+
+logger = logging.getLogger(__name__)
+
+# Process-wide singletons, created on first use
+_instances = {}
+_lock = threading.RLock()
+
+
+def _get_or_create(name: str, factory):
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                start = time.perf_counter()
+                instance = factory()
+                _instances[name] = instance
+                logger.info('Loaded %s in %.2f s', name, time.perf_counter() - start)
+    return instance
+
+
+def create_onnx_session(model_path=None, intra_op_threads: int = None, inter_op_threads: int = None,
+                        graph_optimization: str = None):
+    import onnxruntime as ort
+
+    model_path = model_path or ONNX_MODEL_PATH
+    intra_op_threads = ONNX_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+    inter_op_threads = ONNX_INTER_OP_THREADS if inter_op_threads is None else inter_op_threads
+    graph_optimization = graph_optimization or ONNX_GRAPH_OPTIMIZATION
+
+    levels = {
+        'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.graph_optimization_level = levels[graph_optimization]
+
+    return ort.InferenceSession(str(model_path), sess_options=options)
+
+
+def get_onnx_session():
+    return _get_or_create('onnx_session', create_onnx_session)
+
+
+def get_footprint_catalog() -> dict:
+    def load():
+        with open(XY_COORDS_PATH, 'rb') as file:
+            return pickle.load(file)
+
+    return _get_or_create('footprint_catalog', load)
+
+
+def get_vector_index():
+    def load():
+        from src.vector_index import VectorIndex
+
+        # A deployment that only has the old pickled KD-tree is converted once
+        if not (VECTOR_INDEX_PATH / 'meta.json').exists():
+            VectorIndex.from_kdtree(KD_VECTORS_PATH, get_footprint_catalog()).save(VECTOR_INDEX_PATH)
+        return VectorIndex.open(VECTOR_INDEX_PATH)
+
+    return _get_or_create('vector_index', load)
+
+
+def warm_up() -> float:
+    # Loads every model resource and runs one inference, so the first real request of a worker is not the slow one.
+    # Only the first call per process does the work.
+    def run():
+        from src.picture_processing import IMAGE_SIZE, run_onnx
+
+        start = time.perf_counter()
+        session = get_onnx_session()
+        get_footprint_catalog()
+        get_vector_index()
+        run_onnx(np.zeros((1, 3, IMAGE_SIZE, IMAGE_SIZE), dtype=np.float32), session)
+        return time.perf_counter() - start
+
+    return _get_or_create('warm_up', run)
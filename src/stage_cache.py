@@ -0,0 +1,182 @@
+import os
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+from src.tracing import annotate
+
+
+CACHE_DIR = Path(os.environ.get('STAGE_CACHE_DIR', Path(__file__).parent.parent / '.cache'))
+# Number of stage results kept in memory; STAGE_CACHE_DISK=0 turns the disk tier off
+MEMORY_ITEMS = int(os.environ.get('STAGE_CACHE_MEMORY_ITEMS', 128))
+DISK_ENABLED = os.environ.get('STAGE_CACHE_DISK', '1') == '1'
+# Size of the disk tier, the least recently used results are removed above it
+DISK_LIMIT_MB = float(os.environ.get('STAGE_CACHE_DISK_MB', 2048))
+
+# Format of every stage result. Keys only cover the inputs, so a change of the algorithm or of the result layout
+# of a stage must bump its version here; results of other versions are never read and are removed from disk
+STAGE_VERSIONS = {
+    'site': 1,
+    'heights': 2,
+    'tin': 1,
+    'terrain': 1,
+    'footprint': 1,
+    'embedding': 1,
+    'knn': 1,
+    'obstacles': 1,
+    'placement': 2,
+    'packing': 1,
+    'ifc': 1,
+    'plan': 1,
+}
+
+logger = logging.getLogger(__name__)
+
+# (path, size, mtime) -> sha256 of the file content
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path) -> str:
+    path = Path(path)
+    stat = path.stat()
+    signature = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+
+    digest = _digests.get(signature)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        with _digests_lock:
+            _digests[signature] = digest
+    return digest
+
+
+def cache_key(*parts) -> str:
+    # Parts are file digests, keys of upstream stages and plain parameter values
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+class StageCache:
+    # Two-tier cache of pipeline stage results: an in-process LRU and pickles on disk
+
+    def __init__(self, directory=CACHE_DIR, memory_items: int = MEMORY_ITEMS, disk: bool = DISK_ENABLED,
+                 disk_limit_mb: float = DISK_LIMIT_MB):
+        self.directory = Path(directory) / 'stages'
+        self.memory_items = memory_items
+        self.disk = disk
+        self.disk_limit = int(disk_limit_mb * (1 << 20))
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        # Bytes written since the last pruning, None until the first write of the process prunes
+        self._written = None
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.directory / stage / f'v{STAGE_VERSIONS.get(stage, 1)}' / f'{key}.pkl'
+
+    def get(self, stage: str, key: str, default=None):
+        with self._lock:
+            if (stage, key) in self._memory:
+                self._memory.move_to_end((stage, key))
+                return self._memory[(stage, key)]
+
+        if self.disk:
+            try:
+                with open(self._path(stage, key), 'rb') as file:
+                    value = pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                return default
+            try:
+                # The modification time orders the disk tier for eviction
+                os.utime(self._path(stage, key))
+            except OSError:
+                pass
+            self._remember(stage, key, value)
+            return value
+        return default
+
+    def put(self, stage: str, key: str, value):
+        self._remember(stage, key, value)
+
+        if self.disk:
+            path = self._path(stage, key)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'.{key}.', delete=False) as file:
+                    pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(file.name, path)
+            except (OSError, pickle.PicklingError) as e:
+                logger.warning('Stage %s was not written to the disk cache: %s', stage, e)
+                return
+
+            # The directory is scanned again once a tenth of the limit has been written
+            written = path.stat().st_size + (self._written or 0)
+            if self._written is None or written > self.disk_limit / 10:
+                self.prune()
+            else:
+                self._written = written
+
+    def prune(self):
+        # Removes the results of other stage versions, then the least recently used ones above the size limit
+        with self._prune_lock:
+            self._written = 0
+            files = []
+            for path in self.directory.glob('**/*.pkl'):
+                try:
+                    stat = path.stat()
+                    relative = path.relative_to(self.directory).parts
+                    if len(relative) != 3 or relative[1] != f'v{STAGE_VERSIONS.get(relative[0], 1)}':
+                        path.unlink()
+                        continue
+                except OSError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, path))
+
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files, key=lambda item: item[0]):
+                if total <= self.disk_limit:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+            annotate(disk_bytes=total)
+
+    def _remember(self, stage: str, key: str, value):
+        if self.memory_items <= 0:
+            return
+        with self._lock:
+            self._memory[(stage, key)] = value
+            self._memory.move_to_end((stage, key))
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def preload(self, entries):
+        # (stage, key, value) results computed by another process go into the memory tier only
+        for stage, key, value in entries:
+            self._remember(stage, key, value)
+
+    def get_or_compute(self, stage: str, key: str, compute):
+        missing = object()
+        value = self.get(stage, key, missing)
+        annotate(cache='miss' if value is missing else 'hit')
+        if value is missing:
+            value = compute()
+            self.put(stage, key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+
+# Cache shared by the whole process
+stage_cache = StageCache()
@@ -0,0 +1,114 @@
+import csv
+import itertools
+from pathlib import Path
+
+from src.pipeline import (KNN_VARIANTS, load_site, find_building_variants, placement_key, site_obstacles,
+                          building_base_height, building_ifc, plan_image)
+from src.stage_cache import stage_cache
+from src.tracing import traced, annotate
+from src.variants import place_variants_grid
+
+
+SWEEP_COLUMNS = ['option', 'area', 'variant', 'catalog_index', 'found', 'placed_area', 'floors', 'storey_height',
+                 'building_height', 'gross_area', 'base_height']
+
+
+class Sweep:
+    # Matrix of options over areas x floor counts x storey heights for one site and one model.
+    # Site, terrain, footprint, embedding and k-NN are computed once, placement once per area (all variants
+    # and areas in one process pool), and the floors and storey heights only change the IFC, which is
+    # generated on request by ifc(option).
+
+    def __init__(self, bound_file_path, elevation_baseline_file_path, model_path, areas, floors, storey_heights,
+                 variants=None, placement_mode: str = 'first', k: int = KNN_VARIANTS, avoid_obstacles: bool = False):
+        self.bound_file_path = bound_file_path
+        self.elevation_baseline_file_path = elevation_baseline_file_path
+        self.model_path = model_path
+        self.placement_mode = placement_mode
+        self.k = k
+        self.obstacles_file_path = elevation_baseline_file_path if avoid_obstacles else None
+
+        # Variants are numbered from 1, like in the app
+        variants = variants or range(1, k + 1)
+        for variant in variants:
+            if not 1 <= variant <= k:
+                raise ValueError(f'Variant {variant} is out of 1..{k}')
+
+        placements = self._place([float(area) for area in areas])
+
+        self.placements = []
+        self.rows = []
+        for area, variant in itertools.product(areas, variants):
+            placement = placements[float(area)][variant - 1]
+            base_height = (building_base_height(bound_file_path, elevation_baseline_file_path, placement)
+                           if placement['found'] else None)
+
+            for num_floors, storey_height in itertools.product(floors, storey_heights):
+                self.placements.append(placement)
+                self.rows.append({
+                    'option': len(self.rows),
+                    'area': float(area),
+                    'variant': variant,
+                    'catalog_index': placement['index'],
+                    'found': bool(placement['found']),
+                    'placed_area': placement['area'] if placement['found'] else None,
+                    'floors': int(num_floors),
+                    'storey_height': float(storey_height),
+                    'building_height': num_floors * storey_height,
+                    'gross_area': placement['area'] * num_floors if placement['found'] else None,
+                    'base_height': base_height,
+                })
+
+    @traced('sweep.place')
+    def _place(self, areas: list) -> dict:
+        # Areas already placed by earlier sweeps or by the app come from the cache, the rest are placed together
+        # and stored under the same keys as place_building_variants
+        placements, missing = {}, []
+        for area in dict.fromkeys(areas):
+            key = placement_key(self.bound_file_path, self.model_path, area, self.placement_mode, self.k,
+                                self.obstacles_file_path)
+            placements[area] = stage_cache.get('placement', key)
+            if placements[area] is None:
+                missing.append(area)
+        annotate(areas=len(placements), placed=len(missing))
+
+        if missing:
+            site = load_site(self.bound_file_path)
+            variants = find_building_variants(self.model_path, self.k)
+            obstacles = (site_obstacles(self.bound_file_path, self.obstacles_file_path)
+                         if self.obstacles_file_path else None)
+            grid = place_variants_grid(site['area_polygon'], variants, missing, placement_mode=self.placement_mode,
+                                       obstacles=obstacles)
+            for area, area_placements in zip(missing, grid):
+                key = placement_key(self.bound_file_path, self.model_path, area, self.placement_mode, self.k,
+                                    self.obstacles_file_path)
+                stage_cache.put('placement', key, area_placements)
+                placements[area] = area_placements
+        return placements
+
+    def placement(self, option: int) -> dict:
+        return self.placements[option]
+
+    def ifc(self, option: int) -> str:
+        # Serialized IFC of one option, generated on first request and cached afterwards
+        row = self.rows[option]
+        if not row['found']:
+            raise ValueError(f"Option {option} could not be placed")
+        return building_ifc(self.bound_file_path, self.elevation_baseline_file_path, self.model_path,
+                            self.placements[option], num_floors=row['floors'], elevation_height=row['storey_height'])
+
+    def plan(self, option: int, image_format: str = 'png', preview: bool = False) -> bytes:
+        return plan_image(self.bound_file_path, self.placements[option], image_format, preview=preview)
+
+    def to_csv(self, path):
+        with open(Path(path), 'w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=SWEEP_COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+
+def sweep(bound_file_path, elevation_baseline_file_path, model_path, areas, floors, storey_heights,
+          variants=None, placement_mode: str = 'first', k: int = KNN_VARIANTS, avoid_obstacles: bool = False) -> Sweep:
+    # sweep(site, survey, model, areas=[800, 1000], floors=[3, 5, 9], storey_heights=[3.0, 3.3]).rows
+    return Sweep(bound_file_path, elevation_baseline_file_path, model_path, areas, floors, storey_heights,
+                 variants, placement_mode, k, avoid_obstacles)
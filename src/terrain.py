@@ -0,0 +1,122 @@
+import os
+import numpy as np
+import shapely
+from scipy.spatial import Delaunay, ConvexHull, QhullError
+from scipy.interpolate import NearestNDInterpolator
+
+
+# Terrain kept around the site, in site units
+TERRAIN_BUFFER = float(os.environ.get('TERRAIN_BUFFER', 30.0))
+# Decimation stops at this number of triangles or when every dropped point is within the tolerance (height units)
+TERRAIN_MAX_TRIANGLES = int(os.environ.get('TERRAIN_MAX_TRIANGLES', 1000))
+TERRAIN_TOLERANCE = float(os.environ.get('TERRAIN_TOLERANCE', 0.1))
+
+
+def _compact(vertices: np.ndarray, triangles: np.ndarray) -> dict:
+    # Drops the vertices no triangle refers to and renumbers the triangles
+    used, triangles = np.unique(triangles, return_inverse=True)
+    return {'vertices': vertices[used], 'triangles': triangles.reshape(-1, 3)}
+
+
+def build_tin(vertices) -> dict:
+    # Delaunay TIN of the survey points, vertices are (x, y, z) rows
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    return _compact(vertices, Delaunay(vertices[:, :2]).simplices)
+
+
+def clip_tin(tin: dict, polygon, buffer: float = TERRAIN_BUFFER) -> dict:
+    # Triangles touching the buffered polygon are kept
+    vertices, triangles = tin['vertices'], tin['triangles']
+    rings = vertices[triangles][:, :, :2]
+    keep = shapely.intersects(shapely.polygons(np.concatenate([rings, rings[:, :1]], axis=1)), polygon.buffer(buffer))
+
+    # A site outside the survey keeps the whole terrain rather than none
+    if not keep.any():
+        return tin
+    return _compact(vertices, triangles[keep])
+
+
+def decimate_tin(tin: dict, max_triangles: int = TERRAIN_MAX_TRIANGLES, tolerance: float = TERRAIN_TOLERANCE) -> dict:
+    # Greedy insertion: starting from the convex hull, the worst approximated point of every triangle is added
+    # until all points are within the tolerance or the triangle budget is spent
+    vertices = tin['vertices']
+    xy, z = vertices[:, :2], vertices[:, 2]
+    if len(vertices) <= 3 or len(tin['triangles']) <= max_triangles and tolerance <= 0:
+        return tin
+
+    selected = np.zeros(len(vertices), dtype=bool)
+    try:
+        selected[ConvexHull(xy).vertices] = True
+    except QhullError:
+        # Degenerate (collinear) terrain is left as it is
+        return tin
+
+    while True:
+        indices = np.flatnonzero(selected)
+        triangulation = Delaunay(xy[indices])
+        budget = max_triangles - len(triangulation.simplices)
+        if budget <= 0:
+            break
+
+        simplex = triangulation.find_simplex(xy)
+        error = np.abs(_interpolate(xy[indices], triangulation.simplices, z[indices], xy, simplex) - z)
+        error[selected | (simplex < 0)] = 0
+        candidates = np.flatnonzero(error > tolerance)
+        if len(candidates) == 0:
+            break
+
+        # Worst candidate per triangle, the largest errors first; an inserted point adds about two triangles
+        candidates = candidates[np.lexsort((-error[candidates], simplex[candidates]))]
+        first = np.r_[True, simplex[candidates][1:] != simplex[candidates][:-1]]
+        worst = candidates[first]
+        worst = worst[np.argsort(-error[worst])][:max(1, budget // 2)]
+        selected[worst] = True
+
+    indices = np.flatnonzero(selected)
+    triangles = indices[Delaunay(xy[indices]).simplices]
+
+    # The hull of the kept points may span gaps the clipped terrain did not cover
+    centroids = vertices[triangles][:, :, :2].mean(axis=1)
+    return _compact(vertices, triangles[_covered(tin, centroids)])
+
+
+def _interpolate(xy: np.ndarray, triangles: np.ndarray, values: np.ndarray, points: np.ndarray,
+                 simplex: np.ndarray) -> np.ndarray:
+    # Barycentric interpolation of vertex values over the triangle holding each point, NaN where simplex is -1
+    a, b, c = np.moveaxis(xy[triangles[simplex]], 1, 0)
+    ab, ac, ap = b - a, c - a, points - a
+    area = ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        wb = (ap[:, 0] * ac[:, 1] - ap[:, 1] * ac[:, 0]) / area
+        wc = (ab[:, 0] * ap[:, 1] - ab[:, 1] * ap[:, 0]) / area
+    corner_values = values[triangles[simplex]]
+    result = (1 - wb - wc) * corner_values[:, 0] + wb * corner_values[:, 1] + wc * corner_values[:, 2]
+    return np.where(simplex >= 0, result, np.nan)
+
+
+def _locate(tin: dict, points: np.ndarray) -> np.ndarray:
+    # Index of the TIN triangle holding each point, -1 outside the TIN
+    rings = tin['vertices'][tin['triangles']][:, :, :2]
+    triangles = shapely.polygons(np.concatenate([rings, rings[:, :1]], axis=1))
+    tree = shapely.STRtree(triangles)
+    hits = tree.query(shapely.points(points), predicate='intersects')
+    simplex = np.full(len(points), -1)
+    simplex[hits[0]] = hits[1]
+    return simplex
+
+
+def _covered(tin: dict, points: np.ndarray) -> np.ndarray:
+    # Whether each point lies in a triangle of the TIN
+    return _locate(tin, points) >= 0
+
+
+def terrain_elevation(tin: dict, xy) -> np.ndarray:
+    # Terrain height at the given (x, y) points on the triangles of the TIN itself, so the heights match the
+    # ground written to the IFC; the nearest vertex height outside the TIN
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    vertices = tin['vertices']
+    heights = _interpolate(vertices[:, :2], tin['triangles'], vertices[:, 2], xy, _locate(tin, xy))
+    outside = np.isnan(heights)
+    if outside.any():
+        heights[outside] = NearestNDInterpolator(vertices[:, :2], vertices[:, 2])(xy[outside])
+    return heights
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import logging
+import resource
+import threading
+import itertools
+import functools
+import contextvars
+from collections import deque
+
+
+# PIPELINE_TRACING=0 turns the spans into no-ops; the last TRACE_BUFFER_SIZE finished spans are kept in memory
+TRACING_ENABLED = os.environ.get('PIPELINE_TRACING', '1') == '1'
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', 1000))
+
+logger = logging.getLogger(__name__)
+
+_spans = deque(maxlen=TRACE_BUFFER_SIZE)
+_spans_lock = threading.Lock()
+_ids = itertools.count(1)
+# Innermost open span of the current thread or task
+_current = contextvars.ContextVar('span', default=None)
+
+
+def _max_rss() -> int:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _Span:
+
+    def __init__(self, stage: str, attributes: dict):
+        self.stage = stage
+        self.attributes = attributes
+
+    def __enter__(self) -> dict:
+        parent = _current.get()
+        self.record = {
+            'id': next(_ids),
+            'parent': parent['id'] if parent else None,
+            'stage': self.stage,
+            'thread': threading.current_thread().name,
+            **self.attributes,
+        }
+        self._token = _current.set(self.record)
+        self._rss = _max_rss()
+        self._cpu = time.thread_time()
+        self._start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record.update({
+            'wall_s': time.perf_counter() - self._start,
+            'cpu_s': time.thread_time() - self._cpu,
+            # Growth of the process peak while the stage ran, 0 when it stayed below an earlier peak
+            'peak_rss_delta': _max_rss() - self._rss,
+        })
+        if exc_type is not None:
+            self.record['error'] = exc_type.__name__
+        _current.reset(self._token)
+
+        with _spans_lock:
+            _spans.append(self.record)
+        logger.info('trace %s', json.dumps(self.record, default=str, ensure_ascii=False))
+        return False
+
+
+class _NullSpan:
+
+    def __enter__(self) -> dict:
+        # Sizes written by the stage go into a throwaway dict
+        return {}
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def trace(stage: str, **attributes):
+    # with trace('dxf.parse', file=name) as span: ... span['entities'] = count
+    if not TRACING_ENABLED:
+        return _NULL_SPAN
+    return _Span(stage, attributes)
+
+
+def traced(stage: str = None):
+    # Decorator form of trace(), the stage name defaults to module.function
+    def decorator(func):
+        name = stage or f'{func.__module__.rsplit(".", 1)[-1]}.{func.__name__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACING_ENABLED:
+                return func(*args, **kwargs)
+            with _Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**values):
+    # Adds sizes to the innermost open span, if there is one
+    span = _current.get()
+    if span is not None:
+        span.update(values)
+
+
+def recent_spans(limit: int = None) -> list:
+    # Finished spans, the newest last
+    with _spans_lock:
+        spans = list(_spans)
+    return spans[-limit:] if limit else spans
+
+
+def clear_spans():
+    with _spans_lock:
+        _spans.clear()
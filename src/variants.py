@@ -0,0 +1,129 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from shapely import Polygon
+from typing import List, Dict
+
+from src.normalization import scaling_object
+from src.polygon_placing import place_polygon, place_polygon_by_clearance, pack_polygons, PACKING_SPACING, PACKING_SETBACK
+
+
+# Process pool shared by all requests of a worker, created on first use with PLACEMENT_WORKERS processes.
+# It is never resized: callers running at the same time only limit how many tasks they keep in it
+PLACEMENT_WORKERS = int(os.environ.get('PLACEMENT_WORKERS', os.cpu_count() or 1))
+# The web worker runs jobs in threads, forking it could copy a lock held by another thread into the child.
+# The processes are started fresh instead ('spawn' or 'forkserver') and import the task functions of this module
+PLACEMENT_START_METHOD = os.environ.get('PLACEMENT_START_METHOD', 'spawn')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PLACEMENT_WORKERS,
+                                            mp_context=multiprocessing.get_context(PLACEMENT_START_METHOD))
+        return _executor
+
+
+def place_variant(area_polygon: Polygon, object_x: list, object_y: list, target_area: float, placement_mode: str = 'first',
+                  obstacles=None) -> Dict:
+    scaled_object, scaled_area = scaling_object(object_x, object_y, target_area=target_area)
+
+    # alternatives are the positions a user can choose from, best first; first-fit only finds one
+    if placement_mode == 'clearance':
+        solution_found, coords_x, coords_y, ranked = place_polygon_by_clearance(area_polygon=area_polygon,
+                                                                                object_ring=scaled_object,
+                                                                                obstacles=obstacles)
+        alternatives = [{'coords_x': item['coords_x'], 'coords_y': item['coords_y'], 'angle': item['angle'],
+                         'clearance': item['clearance']} for item in ranked]
+    else:
+        solution_found, coords_x, coords_y = place_polygon(area_polygon=area_polygon, object_ring=scaled_object,
+                                                           obstacles=obstacles)
+        alternatives = [{'coords_x': coords_x, 'coords_y': coords_y}] if solution_found else []
+
+    return {
+        'found': solution_found,
+        'coords_x': coords_x,
+        'coords_y': coords_y,
+        'area': scaled_area,
+        'alternatives': alternatives,
+    }
+
+
+def select_alternative(placement: Dict, option: int) -> Dict:
+    # The placement moved to its alternative number option (1 is the best one)
+    alternatives = placement.get('alternatives', [])
+    if not 1 <= option <= max(len(alternatives), 1):
+        raise ValueError(f'Placement option {option} is not available, found {len(alternatives)} '
+                         f'(Вариант размещения {option} недоступен, найдено {len(alternatives)})')
+    if not alternatives:
+        return placement
+    return {**placement, **alternatives[option - 1]}
+
+
+def place_variants(area_polygon: Polygon, variants: List, target_area: float, placement_mode: str = 'first',
+                   max_workers: int = None, obstacles=None) -> List[Dict]:
+    # variants are (catalog index, object_x, object_y) tuples in k-NN order, obstacles an optional ObstacleIndex
+    return place_variants_grid(area_polygon, variants, [target_area], placement_mode, max_workers, obstacles)[0]
+
+
+def place_variants_grid(area_polygon: Polygon, variants: List, target_areas: List[float], placement_mode: str = 'first',
+                        max_workers: int = None, obstacles=None) -> List[List[Dict]]:
+    # Every (area, variant) pair is an independent task, one list of variant placements per target area
+    tasks = [(target_area, object_x, object_y) for target_area in target_areas for _, object_x, object_y in variants]
+    # max_workers limits the tasks of this call running at once, not the size of the shared pool
+    max_workers = min(len(tasks), max_workers or PLACEMENT_WORKERS)
+
+    if max_workers <= 1 or PLACEMENT_WORKERS <= 1:
+        placements = [place_variant(area_polygon, object_x, object_y, target_area, placement_mode, obstacles)
+                      for target_area, object_x, object_y in tasks]
+    else:
+        executor = _get_executor()
+        slots = threading.BoundedSemaphore(max_workers)
+        futures = []
+        for target_area, object_x, object_y in tasks:
+            slots.acquire()
+            future = executor.submit(place_variant, area_polygon, object_x, object_y, target_area, placement_mode,
+                                     obstacles)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+        placements = [future.result() for future in futures]
+
+    results = []
+    for start in range(0, len(placements), len(variants)):
+        area_results = []
+        for (index, object_x, object_y), placement in zip(variants, placements[start:start + len(variants)]):
+            placement.update({'index': index, 'object_x': object_x, 'object_y': object_y})
+            area_results.append(placement)
+        results.append(area_results)
+    return results
+
+
+def pack_variants(area_polygon: Polygon, variants: List, target_area: float, count: int, mix: bool = False,
+                  spacing: float = PACKING_SPACING, setback: float = PACKING_SETBACK, obstacles=None,
+                  variant: int = 0) -> List[Dict]:
+    # count buildings of the given variant (0-based), or of all variants in turn with mix=True
+    scaled = [scaling_object(object_x, object_y, target_area=target_area) for _, object_x, object_y in variants]
+    order = [i % len(variants) if mix else variant for i in range(count)]
+
+    packed = pack_polygons(area_polygon, [scaled[i][0] for i in order], spacing=spacing, setback=setback,
+                           obstacles=obstacles)
+
+    results = []
+    for i, (solution_found, coords_x, coords_y) in zip(order, packed):
+        index, object_x, object_y = variants[i]
+        results.append({
+            'found': solution_found,
+            'coords_x': coords_x,
+            'coords_y': coords_y,
+            'area': scaled[i][1],
+            'index': index,
+            'object_x': object_x,
+            'object_y': object_y,
+        })
+    return results
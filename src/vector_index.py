@@ -0,0 +1,245 @@
+import os
+import json
+import pickle
+import tempfile
+import numpy as np
+from pathlib import Path
+from scipy import sparse
+from typing import Dict, Optional, Tuple
+
+
+# Rows scored at once by the exact search, bounds the temporary distance matrix
+CHUNK_ROWS = 65536
+# Training vectors per IVF centroid
+IVF_TRAIN_PER_LIST = 40
+# Extra candidates per query that the float32 search passes on to the exact float64 re-ranking
+RERANK_CANDIDATES = 32
+
+
+def footprint_area(entry) -> float:
+    # Shoelace area of a catalog footprint (Y first, X second, in catalog units)
+    y, x = np.asarray(entry[0], dtype=np.float64), np.asarray(entry[1], dtype=np.float64)
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+def _atomic_save(path: Path, array: np.ndarray):
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'.{path.name}.', suffix='.npy', delete=False) as file:
+        np.save(file, array)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(file.name, path)
+
+
+def _top_k(distances: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Best k per query row, sorted by distance
+    if distances.shape[1] > k:
+        part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        distances = np.take_along_axis(distances, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1) if ids.ndim == 2 else ids[part]
+    elif ids.ndim == 1:
+        ids = np.broadcast_to(ids, distances.shape)
+    order = np.argsort(distances, axis=1, kind='stable')
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+class VectorIndex:
+    # Euclidean k-NN over a (memory-mapped) float32/float16 matrix with an optional IVF layer.
+    # Row numbers are the keys of the footprint catalog.
+
+    def __init__(self, vectors: np.ndarray, norms: np.ndarray = None, metadata: Dict[str, np.ndarray] = None,
+                 centroids: np.ndarray = None, order: np.ndarray = None, offsets: np.ndarray = None):
+        self.vectors = vectors
+        self.norms = norms if norms is not None else self._squared_norms(vectors)
+        self.metadata = metadata or {}
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def has_ivf(self) -> bool:
+        return self.centroids is not None
+
+    @staticmethod
+    def _squared_norms(vectors: np.ndarray) -> np.ndarray:
+        norms = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), CHUNK_ROWS):
+            chunk = np.asarray(vectors[start:start + CHUNK_ROWS], dtype=np.float32)
+            norms[start:start + CHUNK_ROWS] = np.einsum('ij,ij->i', chunk, chunk)
+        return norms
+
+    @classmethod
+    def from_vectors(cls, vectors: np.ndarray, metadata: Dict[str, np.ndarray] = None, dtype=np.float32) -> 'VectorIndex':
+        vectors = np.ascontiguousarray(vectors, dtype=dtype)
+        return cls(vectors, metadata={key: np.asarray(value) for key, value in (metadata or {}).items()})
+
+    @classmethod
+    def open(cls, path, mmap: bool = True) -> 'VectorIndex':
+        path = Path(path)
+        mmap_mode = 'r' if mmap else None
+        with open(path / 'meta.json') as file:
+            meta = json.load(file)
+
+        # Files are replaced one by one, meta.json last: rows past its count belong to a newer write
+        count = meta['count']
+        vectors = np.load(path / 'vectors.npy', mmap_mode=mmap_mode)[:count]
+        norms = np.load(path / 'norms.npy', mmap_mode=mmap_mode)[:count]
+        metadata = {key: np.load(path / f'meta_{key}.npy', mmap_mode=mmap_mode)[:count] for key in meta['metadata']}
+
+        ivf = {}
+        if meta.get('ivf'):
+            ivf = {name: np.load(path / f'ivf_{name}.npy') for name in ('centroids', 'order', 'offsets')}
+            if ivf['order'].size != count:
+                ivf = {}
+        return cls(vectors, norms, metadata, **ivf)
+
+    @classmethod
+    def from_kdtree(cls, kd_vectors_path, xy_coords: dict = None) -> 'VectorIndex':
+        # Migration from the pickled scipy KD-tree used before
+        with open(kd_vectors_path, 'rb') as file:
+            tree = pickle.load(file)
+        metadata = None
+        if xy_coords is not None:
+            metadata = {'area': np.array([footprint_area(xy_coords[i]) for i in range(len(xy_coords))])}
+        return cls.from_vectors(np.asarray(tree.data), metadata)
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        _atomic_save(path / 'vectors.npy', np.asarray(self.vectors))
+        _atomic_save(path / 'norms.npy', np.asarray(self.norms))
+        for key, values in self.metadata.items():
+            _atomic_save(path / f'meta_{key}.npy', np.asarray(values))
+        if self.has_ivf:
+            for name in ('centroids', 'order', 'offsets'):
+                _atomic_save(path / f'ivf_{name}.npy', getattr(self, name))
+
+        meta = {
+            'count': len(self),
+            'dim': int(self.vectors.shape[1]),
+            'dtype': str(self.vectors.dtype),
+            'metadata': sorted(self.metadata),
+            'ivf': self.has_ivf,
+        }
+        with tempfile.NamedTemporaryFile('w', dir=path, prefix='.meta.json.', delete=False) as file:
+            json.dump(meta, file)
+        os.replace(file.name, path / 'meta.json')
+
+    def append(self, vectors: np.ndarray, metadata: Dict[str, np.ndarray] = None) -> 'VectorIndex':
+        # Existing rows keep their ids; the IVF lists have to be rebuilt afterwards
+        vectors = np.asarray(vectors, dtype=self.vectors.dtype)
+        metadata = metadata or {}
+        merged_metadata = {key: np.concatenate([values, np.asarray(metadata[key])]) for key, values in self.metadata.items()}
+        return VectorIndex(np.concatenate([self.vectors, vectors]),
+                           np.concatenate([self.norms, self._squared_norms(vectors)]),
+                           merged_metadata)
+
+    def build_ivf(self, nlist: int = None, iterations: int = 10, seed: int = 0):
+        # Coarse k-means clustering with one inverted list of row ids per centroid
+        if nlist is None:
+            nlist = max(1, int(np.sqrt(len(self))))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(len(self), size=min(len(self), IVF_TRAIN_PER_LIST * nlist), replace=False))
+        train = np.asarray(self.vectors[sample], dtype=np.float32)
+
+        # Lloyd iterations, both steps done as matrix products
+        self.centroids = train[rng.choice(len(train), size=min(nlist, len(train)), replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._nearest_centroids(train, 1)[:, 0]
+            counts = np.bincount(assignment, minlength=len(self.centroids))
+            members = sparse.csr_matrix((np.ones(len(train), dtype=np.float32), (assignment, np.arange(len(train)))),
+                                        shape=(len(self.centroids), len(train)))
+            sums = members @ train
+            filled = counts > 0
+            self.centroids[filled] = sums[filled] / counts[filled, None]
+
+        assignment = np.concatenate([self._nearest_centroids(np.asarray(self.vectors[start:start + CHUNK_ROWS], dtype=np.float32), 1)[:, 0]
+                                     for start in range(0, len(self), CHUNK_ROWS)])
+        self.order = np.argsort(assignment, kind='stable').astype(np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(self.centroids)))]).astype(np.int64)
+        return self
+
+    def _nearest_centroids(self, queries: np.ndarray, nprobe: int) -> np.ndarray:
+        distances = (np.einsum('ij,ij->i', self.centroids, self.centroids)[None, :] - 2 * queries @ self.centroids.T)
+        nprobe = min(nprobe, len(self.centroids))
+        return _top_k(distances, np.arange(len(self.centroids)), nprobe)[1]
+
+    def _filter_mask(self, ids: np.ndarray, filters: Optional[Dict[str, Tuple[float, float]]]) -> Optional[np.ndarray]:
+        if not filters:
+            return None
+        mask = np.ones(len(ids), dtype=bool)
+        for key, (low, high) in filters.items():
+            values = self.metadata[key][ids]
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        return mask
+
+    def _score(self, queries: np.ndarray, ids: np.ndarray, filters) -> np.ndarray:
+        # Squared Euclidean distances up to the constant |q|^2, through one matrix product: |x|^2 - 2 q.x.
+        # In float32 the subtraction loses the small distances, so this only preselects candidates.
+        vectors = np.asarray(self.vectors[ids], dtype=np.float32)
+        distances = self.norms[ids][None, :] - 2 * queries @ vectors.T
+        mask = self._filter_mask(ids, filters)
+        if mask is not None:
+            distances[:, ~mask] = np.inf
+        return distances
+
+    def _search_exact(self, queries, k, filters):
+        best_distances = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self), CHUNK_ROWS):
+            ids = np.arange(start, min(start + CHUNK_ROWS, len(self)))
+            distances = self._score(queries, ids, filters)
+            best_distances, best_ids = _top_k(np.hstack([best_distances, distances]),
+                                              np.hstack([best_ids, np.broadcast_to(ids, distances.shape)]), k)
+        return best_distances, best_ids
+
+    def _search_ivf(self, queries, k, nprobe, filters):
+        probes = self._nearest_centroids(queries, nprobe)
+        all_distances, all_ids = [], []
+        for query, lists in zip(queries, probes):
+            ids = np.sort(np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists]))
+            distances = self._score(query[None, :], ids, filters)
+            if distances.shape[1] < k:
+                distances = np.hstack([distances, np.full((1, k - distances.shape[1]), np.inf, dtype=np.float32)])
+                ids = np.concatenate([ids, np.full(k - ids.size, len(self), dtype=np.int64)])
+            distances, ids = _top_k(distances, ids, k)
+            all_distances.append(distances[0])
+            all_ids.append(ids[0])
+        return np.array(all_distances), np.array(all_ids)
+
+    def _rerank(self, queries: np.ndarray, distances: np.ndarray, ids: np.ndarray, k: int):
+        # Exact squared distances of the candidates, sum((x - q)^2) in float64, and the best k of them
+        found = np.isfinite(distances)
+        vectors = np.asarray(self.vectors[np.where(found, ids, 0)], dtype=np.float64)
+        exact = np.where(found, ((vectors - queries[:, None, :]) ** 2).sum(axis=2), np.inf)
+        return _top_k(exact, ids, k)
+
+    def query(self, x, k: int = 1, mode: str = 'exact', nprobe: int = 8,
+              filters: Optional[Dict[str, Tuple[float, float]]] = None):
+        # Same contract as scipy's KDTree.query: (distances, indices), 1-D for a single query vector.
+        # Missing neighbours (strict filters) get an infinite distance and the index len(self).
+        queries = np.atleast_2d(np.asarray(x, dtype=np.float32))
+        if mode == 'ivf' and self.has_ivf:
+            distances, ids = self._search_ivf(queries, k + RERANK_CANDIDATES, nprobe, filters)
+        else:
+            distances, ids = self._search_exact(queries, k + RERANK_CANDIDATES, filters)
+
+        distances, ids = self._rerank(np.atleast_2d(np.asarray(x, dtype=np.float64)), distances, ids, k)
+        distances = np.sqrt(distances)
+        ids = np.where(np.isinf(distances), len(self), ids)
+        if np.asarray(x).ndim == 1:
+            return distances[0], ids[0]
+        return distances, ids
+
+    def recall(self, queries, k: int = 3, nprobe: int = 8) -> float:
+        # Share of the exact k nearest neighbours that the IVF search also returns
+        exact_ids = self.query(np.atleast_2d(queries), k=k)[1]
+        approx_ids = self.query(np.atleast_2d(queries), k=k, mode='ivf', nprobe=nprobe)[1]
+        hits = sum(len(set(exact) & set(approx)) for exact, approx in zip(exact_ids, approx_ids))
+        return hits / exact_ids.size
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import shapely
+from shapely import affinity
+
+from src.geometry import Ring
+
+
+@pytest.fixture
+def polygon():
+    # A concave footprint far from the origin, like the site coordinates
+    return shapely.Polygon([(1e5, 2e5), (1e5 + 30, 2e5), (1e5 + 30, 2e5 + 12), (1e5 + 12, 2e5 + 12),
+                            (1e5 + 12, 2e5 + 25), (1e5, 2e5 + 25)])
+
+
+def test_ring_matches_shapely(polygon):
+    ring = Ring.from_shapely(polygon)
+
+    assert len(ring) == 6 and np.array_equal(ring.coords[0], ring.coords[-1])
+    assert ring.area == pytest.approx(polygon.area, rel=1e-12)
+    assert np.allclose(ring.centroid, polygon.centroid.coords[0], rtol=0, atol=1e-9)
+    assert ring.bounds == polygon.bounds
+    assert ring.to_shapely().equals(polygon)
+
+
+def test_ring_closes_the_outline():
+    ring = Ring.from_xy([0, 4, 4, 0], [0, 0, 3, 3])
+
+    assert len(ring) == 4 and len(ring.coords) == 5
+    assert ring.area == 12
+    assert ring.edges().shape == (4, 2, 2)
+
+
+def test_transforms_match_shapely(polygon):
+    ring = Ring.from_shapely(polygon)
+    origin = tuple(ring.centroid)
+
+    ring.translate(5, -3)
+    expected = affinity.translate(polygon, 5, -3)
+    ring.rotate(30, origin)
+    expected = affinity.rotate(expected, 30, origin)
+    ring.scale(1.5, origin)
+    expected = affinity.scale(expected, 1.5, 1.5, origin=origin)
+
+    assert np.allclose(ring.coords, shapely.get_coordinates(expected.exterior), rtol=0, atol=1e-8)
+
+
+def test_copy_is_independent(polygon):
+    ring = Ring.from_shapely(polygon)
+    moved = ring.copy().translate(10, 10)
+
+    assert ring.bounds == polygon.bounds
+    assert moved.bounds == tuple(np.add(polygon.bounds, 10))
+
+
+def test_repeated_vertices_give_no_empty_edges():
+    ring = Ring.from_xy([0, 4, 4, 4, 0], [0, 0, 0, 3, 3])
+    edges = ring.edges()
+
+    assert edges.shape == (4, 2, 2)
+    assert (np.abs(edges[:, 1] - edges[:, 0]).sum(axis=1) > 0).all()
@@ -0,0 +1,96 @@
+import pytest
+
+from src.jobs import JobQueue, is_transient
+
+
+class Run:
+    # Job function that fails with the queued errors first, then succeeds
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, job, **inputs):
+        self.calls += 1
+        job.report('site', inputs=inputs)
+        if self.errors:
+            raise self.errors.pop(0)
+        job.report('placement', result=sum(inputs.values()))
+
+
+@pytest.fixture
+def queue():
+    return JobQueue(workers=1)
+
+
+def test_identical_inputs_give_the_same_job(queue):
+    run = Run()
+    job = queue.submit('test', {'a': 1, 'b': 2}, run)
+    assert job.wait(5)
+
+    assert queue.submit('test', {'b': 2, 'a': 1}, run) is job
+    assert queue.submit('test', {'a': 1, 'b': 3}, run) is not job
+    assert queue.submit('other', {'a': 1, 'b': 2}, run) is not job
+    assert job.status == 'done' and job.artifacts['result'] == 3
+    assert [stage for stage, _ in job.stages] == ['running', 'site', 'placement']
+
+
+def test_transient_error_is_retried(queue):
+    run = Run(OSError('disk is busy'))
+    failed = queue.submit('test', {'a': 1}, run)
+    assert failed.wait(5)
+    assert failed.status == 'failed' and failed.transient
+
+    job = queue.submit('test', {'a': 1}, run)
+    assert job.wait(5)
+
+    assert job is not failed and job.id == failed.id
+    assert job.status == 'done' and run.calls == 2
+    assert queue.get(job.id) is job
+
+
+def test_permanent_error_is_kept_until_retry(queue):
+    run = Run(ValueError('No bounds found'))
+    failed = queue.submit('test', {'a': 1}, run)
+    assert failed.wait(5)
+    assert failed.status == 'failed' and not failed.transient and failed.error == 'No bounds found'
+
+    assert queue.submit('test', {'a': 1}, run) is failed
+    job = queue.submit('test', {'a': 1}, run, retry=True)
+    assert job.wait(5)
+    assert job is not failed and job.status == 'done'
+
+
+@pytest.mark.parametrize('error, transient', [
+    (OSError('disk is busy'), True),
+    (MemoryError(), True),
+    (FileNotFoundError('model.onnx'), False),
+    (PermissionError('model.onnx'), False),
+    (ValueError('No bounds found'), False),
+])
+def test_is_transient(error, transient):
+    assert is_transient(error) == transient
+
+
+def test_files_are_keyed_by_content(queue, tmp_path):
+    first, second = tmp_path / 'first.dxf', tmp_path / 'second.dxf'
+    first.write_bytes(b'site')
+    second.write_bytes(b'site')
+    run = Run()
+
+    job = queue.submit('test', {'path': first}, lambda job, path: run(job))
+    assert queue.submit('test', {'path': second}, lambda job, path: run(job)) is job
+
+    second.write_bytes(b'another site')
+    assert queue.submit('test', {'path': second}, lambda job, path: run(job)) is not job
+
+
+def test_finished_jobs_are_evicted():
+    queue = JobQueue(workers=1, max_items=2)
+    jobs = [queue.submit('test', {'a': value}, Run()) for value in range(4)]
+    for job in jobs:
+        assert job.wait(5)
+    queue.submit('test', {'a': 4}, Run()).wait(5)
+
+    assert len(queue.jobs()) <= 3
+    assert queue.get(jobs[0].id) is None
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.picture_processing import (RENDER_TOLERANCE, SIMPLIFY_MIN_VERTICES, preprocess_image, render_footprint,
+                                    render_footprint_agg)
+from src.resources import get_footprint_catalog
+
+
+def catalog_footprints(step):
+    catalog = get_footprint_catalog()
+    for key in list(catalog)[::step]:
+        x, y = catalog[key]
+        yield np.column_stack((y, x))
+
+
+@pytest.mark.parametrize('vector', list(catalog_footprints(50)), ids=lambda vector: f'{len(vector)}-vertices')
+def test_direct_renderer_matches_agg(vector):
+    reference = render_footprint_agg(vector)
+    image = render_footprint(vector)
+
+    assert image.shape == reference.shape and image.dtype == reference.dtype
+    assert np.abs(image.astype(int) - reference).max() <= RENDER_TOLERANCE
+
+    tensor_difference = np.abs(preprocess_image(Image.fromarray(image)) - preprocess_image(Image.fromarray(reference)))
+    assert tensor_difference.max() <= RENDER_TOLERANCE / 255 / 0.225
+
+
+@pytest.mark.parametrize('vector', [
+    [[0, 0], [0, 10], [20, 10], [20, 0], [0, 0]],
+    [[0, 0], [3.3, 7.1], [12.5, 9.4], [17.2, 2.8], [0, 0]],
+    [[0, 0], [0, 10], [0.001, 10], [20, 10.2], [20, 0], [0, 0]],
+])
+def test_direct_renderer_matches_agg_on_corners(vector):
+    assert np.abs(render_footprint(vector).astype(int) - render_footprint_agg(vector)).max() <= RENDER_TOLERANCE
+
+
+def test_long_paths_use_agg():
+    angles = np.linspace(0, 2 * np.pi, SIMPLIFY_MIN_VERTICES + 1)
+    vector = np.column_stack((np.cos(angles), np.sin(angles)))
+
+    assert np.array_equal(render_footprint(vector), render_footprint_agg(vector))
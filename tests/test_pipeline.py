@@ -0,0 +1,42 @@
+import pickle
+
+import numpy as np
+import pytest
+from scipy.spatial import KDTree
+
+from src import pipeline, resources
+from src.resources import get_footprint_catalog
+from src.sweep import Sweep
+
+
+@pytest.fixture
+def legacy_models(monkeypatch, tmp_path):
+    # A deployment that only has the pickled KD-tree, the vector index is built on first use
+    vectors = np.random.default_rng(0).random((len(get_footprint_catalog()), 8))
+    with open(tmp_path / 'kd_vectors.pkl', 'wb') as file:
+        pickle.dump(KDTree(vectors), file)
+
+    monkeypatch.setattr(resources, 'KD_VECTORS_PATH', tmp_path / 'kd_vectors.pkl')
+    monkeypatch.setattr(resources, 'VECTOR_INDEX_PATH', tmp_path / 'footprint_index')
+    monkeypatch.setattr(pipeline, 'VECTOR_INDEX_PATH', tmp_path / 'footprint_index')
+    monkeypatch.delitem(resources._instances, 'vector_index', raising=False)
+    yield vectors
+    resources._instances.pop('vector_index', None)
+
+
+def test_index_version_migrates_the_kdtree(legacy_models, tmp_path):
+    version = pipeline.index_version()
+
+    meta = tmp_path / 'footprint_index' / 'meta.json'
+    assert meta.exists()
+    assert version == (len(legacy_models), meta.stat().st_mtime_ns)
+    assert np.allclose(resources.get_vector_index().vectors, legacy_models, atol=1e-6)
+    assert pipeline.index_version() == version
+
+
+@pytest.mark.parametrize('variants', [[0], [1, 4], [-1]])
+def test_sweep_rejects_variants_outside_k(variants, monkeypatch):
+    monkeypatch.setattr(Sweep, '_place', lambda self, areas: pytest.fail('placed before the variants were checked'))
+
+    with pytest.raises(ValueError, match='out of 1..3'):
+        Sweep('site.dxf', 'heights.dxf', 'model.ifc', [1000], [9], [3.0], variants=variants, k=3)
@@ -0,0 +1,119 @@
+import math
+from pathlib import Path
+
+import numpy as np
+import pytest
+from shapely import Polygon
+
+from src.geometry import Ring
+from src.pipeline import _load_site
+from src.polygon_placing import (CLEARANCE_ALTERNATIVES, find_placement, max_building_area, pack_polygons,
+                                 place_polygon, place_polygon_by_clearance, prepare_site, rotatePolygon)
+from src.resources import get_footprint_catalog
+
+
+BOUND_DXF_DIR = Path(__file__).parent.parent / 'data' / 'bound_dxf'
+
+
+def load_site(name):
+    return _load_site(BOUND_DXF_DIR / f'Границы участка {name}.dxf')['area_polygon']
+
+
+def footprint(site, index, fraction):
+    catalog = get_footprint_catalog()
+    y, x = catalog[list(catalog)[index]]
+    ring = Ring.from_xy(x, y)
+    return ring.scale(math.sqrt(site.area * fraction / ring.area))
+
+
+def baseline_place_polygon(area_polygon, object_ring):
+    # The original search: spiral points from the site centroid, 360 rotations by one degree around each of them
+    center = np.array([area_polygon.centroid.x, area_polygon.centroid.y])
+    shifted = object_ring.coords + (center - object_ring.centroid)
+    if area_polygon.contains(Polygon(shifted)):
+        return (True, shifted[:, 0].tolist(), shifted[:, 1].tolist())
+
+    interval = max(area_polygon.exterior.coords.xy[0]) - min(area_polygon.exterior.coords.xy[0])
+    theta = np.linspace(0, 2. * np.pi * 10, 500)
+    r = np.sqrt(1.0 + interval * theta)
+    for pivot in zip(r * np.cos(theta) + center[0], r * np.sin(theta) + center[1]):
+        position = list(map(tuple, shifted + (center - pivot)))
+        for _ in range(360):
+            position = rotatePolygon(position, theta=1, center=pivot)
+            if area_polygon.contains(Polygon(position)):
+                return (True, [x for x, _ in position], [y for _, y in position])
+    return (False, None, None)
+
+
+@pytest.mark.parametrize('name, index, fraction', [
+    ('МКСП_ВЕР12Б_К10_КР_П_R21_ДСШ', 2, 0.1),
+    ('МКСП_ВЕР12Б_К10_КР_П_R21_ДСШ', 4, 0.15),
+    ('К01_КР_П_R20', 2, 0.2),
+    ('К01_КР1_П_R20', 2, 0.2),
+    ('85.4_0_КР_R19', 2, 0.1),
+    ('85.4_0_КР_R19', 0, 0.01),
+])
+def test_place_polygon_matches_baseline(name, index, fraction):
+    site = load_site(name)
+    ring = footprint(site, index, fraction)
+
+    expected = baseline_place_polygon(site, ring)
+    found, coords_x, coords_y = place_polygon(site, ring)
+
+    assert expected[0] and found
+    assert np.allclose(coords_x, expected[1], atol=1e-9) and np.allclose(coords_y, expected[2], atol=1e-9)
+
+
+def test_prepared_site_is_reused():
+    site = load_site('К01_КР_П_R20')
+    prepared = prepare_site(site)
+    for index in (0, 2, 4):
+        ring = footprint(site, index, 0.1)
+        assert find_placement(prepared, ring) == place_polygon(site, ring)
+
+
+def test_footprint_larger_than_site_is_not_placed():
+    site = load_site('К01_КР_П_R20')
+    assert place_polygon(site, footprint(site, 2, 1.2)) == (False, None, None)
+
+
+def test_clearance_returns_separate_alternatives():
+    site = load_site('85.4_0_КР_R19')
+    ring = footprint(site, 2, 0.02)
+
+    found, coords_x, coords_y, ranked = place_polygon_by_clearance(site, ring)
+
+    assert found and len(ranked) == CLEARANCE_ALTERNATIVES
+    assert (coords_x, coords_y) == (ranked[0]['coords_x'], ranked[0]['coords_y'])
+    assert [item['clearance'] for item in ranked] == sorted((item['clearance'] for item in ranked), reverse=True)
+    for item in ranked:
+        polygon = Polygon(zip(item['coords_x'], item['coords_y']))
+        assert site.contains(polygon)
+        assert polygon.area == pytest.approx(ring.area, rel=1e-9)
+    assert len(place_polygon_by_clearance(site, ring, num_alternatives=2)[3]) == 2
+
+
+@pytest.mark.parametrize('placement_mode', ['first', 'clearance'])
+def test_max_building_area_is_placeable(placement_mode):
+    site = load_site('К01_КР_П_R20')
+    ring = footprint(site, 2, 0.1)
+
+    area, scale, coords_x, coords_y = max_building_area(site, ring.x, ring.y, placement_mode=placement_mode)
+
+    assert area == pytest.approx(ring.area * scale ** 2)
+    assert site.contains(Polygon(zip(coords_x, coords_y)))
+    assert Polygon(zip(coords_x, coords_y)).area == pytest.approx(area)
+
+
+def test_max_building_area_packs_every_copy():
+    site = load_site('К01_КР_П_R20')
+    ring = footprint(site, 2, 0.1)
+
+    area, scale, _, _ = max_building_area(site, ring.x, ring.y, count=3)
+    packed = pack_polygons(site, [ring.copy().scale(scale)] * 3)
+
+    assert area > 0
+    assert all(found for found, _, _ in packed)
+    polygons = [Polygon(zip(coords_x, coords_y)) for _, coords_x, coords_y in packed]
+    assert all(site.contains(polygon) for polygon in polygons)
+    assert not any(a.intersects(b) for i, a in enumerate(polygons) for b in polygons[i + 1:])
@@ -0,0 +1,83 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from src.pipeline import heights_key
+from src.stage_cache import STAGE_VERSIONS, StageCache, cache_key, file_digest
+
+
+HEIGHT_DXF = Path(__file__).parent.parent / 'data' / 'height_dxf' / 'Подоснова К01_КР_П_R20.dxf'
+
+
+@pytest.fixture
+def bump_heights(monkeypatch):
+    # Modules import the STAGE_VERSIONS dict itself, so the version is changed in place
+    return lambda: monkeypatch.setitem(STAGE_VERSIONS, 'heights', STAGE_VERSIONS['heights'] + 1)
+
+
+def test_cache_key_covers_every_part():
+    assert cache_key('site', 'abc', 1.5) == cache_key('site', 'abc', 1.5)
+    assert cache_key('site', 'abc', 1.5) != cache_key('site', 'abc', 1.6)
+    assert cache_key('site', 'abc') != cache_key('site', 'abc', None)
+    assert cache_key(('a', 'b')) != cache_key('a', 'b')
+
+
+def test_file_digest_follows_content(tmp_path):
+    path = tmp_path / 'site.dxf'
+    path.write_bytes(b'first')
+    first = file_digest(path)
+    assert file_digest(tmp_path / '.' / 'site.dxf') == first
+
+    path.write_bytes(b'second')
+    os.utime(path, ns=(0, 0))
+    assert file_digest(path) != first
+
+
+def test_result_is_computed_once(tmp_path):
+    calls = []
+    compute = lambda: calls.append(1) or {'area': 42}
+
+    assert StageCache(tmp_path, disk=True).get_or_compute('site', 'key', compute) == {'area': 42}
+    assert StageCache(tmp_path, disk=True).get_or_compute('site', 'key', compute) == {'area': 42}
+    assert len(calls) == 1
+
+
+def test_memory_tier_without_disk(tmp_path):
+    cache = StageCache(tmp_path, memory_items=1, disk=False)
+    cache.put('site', 'first', 1)
+    cache.put('site', 'second', 2)
+
+    assert cache.get('site', 'first') is None and cache.get('site', 'second') == 2
+    assert not (tmp_path / 'stages').exists()
+
+
+def test_new_stage_version_invalidates_results(tmp_path, bump_heights):
+    cache = StageCache(tmp_path, memory_items=0, disk=True)
+    cache.put('heights', 'key', 'old')
+    assert (tmp_path / 'stages' / 'heights' / f'v{STAGE_VERSIONS["heights"]}' / 'key.pkl').exists()
+
+    bump_heights()
+    assert cache.get('heights', 'key') is None
+
+    cache.put('heights', 'key', 'new')
+    cache.prune()
+    assert [path.relative_to(tmp_path).parts for path in tmp_path.glob('**/*.pkl')] == [
+        ('stages', 'heights', f'v{STAGE_VERSIONS["heights"]}', 'key.pkl')]
+    assert cache.get('heights', 'key') == 'new'
+
+
+def test_prune_keeps_the_disk_limit(tmp_path):
+    cache = StageCache(tmp_path, memory_items=0, disk=True, disk_limit_mb=0)
+    cache.put('site', 'first', b'x' * 1000)
+    cache.prune()
+
+    assert list(tmp_path.glob('**/*.pkl')) == []
+
+
+def test_heights_key_follows_the_stage_version(bump_heights):
+    key = heights_key(HEIGHT_DXF)
+    assert heights_key(HEIGHT_DXF) == key
+
+    bump_heights()
+    assert heights_key(HEIGHT_DXF) != key
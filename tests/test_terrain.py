@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+import shapely
+
+from src.terrain import build_tin, clip_tin, terrain_elevation
+
+
+@pytest.fixture
+def tin():
+    # 100 x 100 m survey on a 5 m grid, the ground rises along x
+    x, y = np.meshgrid(np.arange(0, 101, 5.0), np.arange(0, 101, 5.0))
+    return build_tin(np.column_stack((x.ravel(), y.ravel(), 0.1 * x.ravel())))
+
+
+def test_build_tin_covers_the_survey(tin):
+    assert len(tin['vertices']) == 21 * 21
+    assert len(tin['triangles']) == 2 * 20 * 20
+    assert terrain_elevation(tin, [[50, 50], [12.5, 80]]) == pytest.approx([5.0, 1.25])
+
+
+def test_clip_tin_keeps_triangles_near_the_site(tin):
+    site = shapely.box(40, 40, 60, 60)
+
+    clipped = clip_tin(tin, site, buffer=5)
+
+    triangles = clipped['vertices'][clipped['triangles']][:, :, :2]
+    polygons = shapely.polygons(np.concatenate([triangles, triangles[:, :1]], axis=1))
+    assert 0 < len(clipped['triangles']) < len(tin['triangles'])
+    assert shapely.intersects(polygons, site.buffer(5)).all()
+    assert shapely.union_all(polygons).contains(site)
+    # Unused vertices are dropped and the triangles renumbered
+    assert np.unique(clipped['triangles']).size == len(clipped['vertices'])
+
+
+def test_site_outside_the_survey_keeps_the_whole_tin(tin):
+    assert clip_tin(tin, shapely.box(500, 500, 520, 520)) is tin
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from scipy.spatial import KDTree
+
+from src.vector_index import VectorIndex
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).normal(size=(3000, 16))
+
+
+@pytest.mark.parametrize('k', [1, 5])
+def test_exact_query_matches_kdtree(vectors, k):
+    queries = np.random.default_rng(1).normal(size=(50, 16))
+
+    distances, ids = VectorIndex.from_vectors(vectors).query(queries, k=k)
+    expected_distances, expected_ids = KDTree(vectors).query(queries, k=k)
+
+    assert np.array_equal(ids, np.asarray(expected_ids).reshape(ids.shape))
+    assert np.allclose(distances, np.asarray(expected_distances).reshape(distances.shape), rtol=1e-5)
+
+
+def test_single_query_is_one_dimensional(vectors):
+    distance, index = VectorIndex.from_vectors(vectors).query(vectors[7], k=3)
+
+    assert distance.shape == index.shape == (3,)
+    assert index[0] == 7
+
+
+def test_near_duplicates_are_ranked_exactly():
+    # Far from the origin the float32 |x|^2 - 2 q.x scores cancel out, neighbours closer than that used to swap
+    rng = np.random.default_rng(2)
+    base = rng.normal(50, 1, size=(500, 16))
+    queries = base[:40] + rng.normal(0, 0.002, size=(40, 16))
+
+    distances, ids = VectorIndex.from_vectors(base).query(queries, k=3)
+    expected_distances, expected_ids = KDTree(base).query(queries, k=3)
+
+    assert np.array_equal(ids, expected_ids)
+    assert (distances[:, 0] > 0).all()
+    # Only the float32 storage of the vectors is left between the two
+    assert np.allclose(distances, expected_distances, atol=1e-5)
+
+
+def test_filters_leave_missing_neighbours(vectors):
+    area = np.arange(len(vectors), dtype=np.float64)
+    index = VectorIndex.from_vectors(vectors, metadata={'area': area})
+
+    distances, ids = index.query(vectors[:5], k=4, filters={'area': (10, 12)})
+
+    assert set(ids[:, :3].ravel()) <= {10, 11, 12}
+    assert np.isinf(distances[:, 3]).all() and (ids[:, 3] == len(index)).all()
+
+
+def test_ivf_with_every_list_probed_is_exact(vectors, tmp_path):
+    index = VectorIndex.from_vectors(vectors).build_ivf(nlist=16)
+    index.save(tmp_path)
+    reopened = VectorIndex.open(tmp_path)
+    queries = vectors[:20] + 0.01
+
+    assert reopened.has_ivf
+    assert np.array_equal(reopened.query(queries, k=3, mode='ivf', nprobe=16)[1], index.query(queries, k=3)[1])
+    assert reopened.recall(queries, k=3, nprobe=16) == 1.0